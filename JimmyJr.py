@@ -13,7 +13,15 @@ SELL = 0
 BUY = 1
 
 
+def attributes(o) -> dict:
+    # the small datamodel classes use __slots__ and have no __dict__
+    if hasattr(o, '__dict__'):
+        return o.__dict__
+    return {name: getattr(o, name) for name in o.__slots__}
+
 class Listing:
+    __slots__ = ['symbol', 'product', 'denomination']
+
     def __init__(self, symbol: Symbol, product: Product, denomination: Product):
         self.symbol = symbol
         self.product = product
@@ -21,6 +29,8 @@ class Listing:
 
 
 class Order:
+    __slots__ = ['symbol', 'price', 'quantity']
+
     def __init__(self, symbol: Symbol, price: int, quantity: int) -> None:
         self.symbol = symbol
         self.price = price
@@ -34,11 +44,15 @@ class Order:
     
 
 class OrderDepth:
+    __slots__ = ['buy_orders', 'sell_orders']
+
     def __init__(self):
         self.buy_orders: Dict[int, int] = {}
         self.sell_orders: Dict[int, int] = {}
 
 class OwnTrade:
+    __slots__ = ['symbol', 'price', 'quantity', 'counter_party']
+
     def __init__(self, symbol: Symbol, price: int, quantity: int, counter_party: UserId = None) -> None: # type: ignore
         self.symbol = symbol
         self.price: int = price
@@ -46,6 +60,8 @@ class OwnTrade:
         self.counter_party = counter_party
 
 class Trade:
+    __slots__ = ['symbol', 'price', 'quantity', 'buyer', 'seller', 'timestamp']
+
     def __init__(self, symbol: Symbol, price: int, quantity: int, buyer: UserId = None, seller: UserId = None, timestamp: int = 0) -> None: # type: ignore
         self.symbol = symbol
         self.price: int = price
@@ -72,11 +88,11 @@ class TradingState(object):
         self.observations = observations
         
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True)
+        return json.dumps(self, default=attributes, sort_keys=True)
     
 class ProsperityEncoder(JSONEncoder):
         def default(self, o):
-            return o.__dict__
+            return attributes(o)
         
 
 
@@ -0,0 +1,249 @@
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from log_parser import CompactLogDecoder
+from tournament import load_trader_module
+from walk_forward import import_backtester
+
+# series compared per product, in the order a divergence is reported when several start on the same tick
+FIELDS = ['ordered', 'filled', 'positions', 'pnl']
+SEGMENTS = 20
+
+
+'''
+A variant of a trader: the file it comes from, class attributes to override and handlers to swap,
+for instance {'handleCoconuts': 'handleCoconutsOLD'} runs the old coconuts handler in place of the current one
+'''
+def variant_class(trader_path: str = 'main.py', params: dict | None = None, methods: dict | None = None):
+    base = load_trader_module(trader_path).Trader
+    attributes = dict(params or {})
+    for name, source in (methods or {}).items():
+        attributes[name] = getattr(base, source)
+    return type('VariantTrader', (base,), attributes) if attributes else base
+
+
+# keeps only the CSVDATA or compact log lines the trader's writeLog prints, everything else it prints is dropped
+class CustomCapture:
+    def __init__(self):
+        self.lines: list[str] = []
+        self.pending = ''
+
+    # print writes a line in pieces, lines are only kept once complete
+    def write(self, text: str):
+        self.pending += text
+        if '\n' in self.pending:
+            *complete, self.pending = self.pending.split('\n')
+            self.lines += [line for line in complete if 'CSVDATA' in line or 'CLOG1:' in line]
+        return len(text)
+
+    def flush(self):
+        pass
+
+    # product -> (timestamps, (ticks, series) values) of the numeric columns after the position, bid, price and ask
+    def series(self) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        rows: dict[str, list] = {}
+        decoder = CompactLogDecoder()
+        for line in self.lines:
+            if 'CLOG1:' in line:
+                for time, product, values in decoder.feed(line):
+                    rows.setdefault(product, []).append((time, values[4:]))
+                continue
+            fields = line.strip().split(',')
+            if len(fields) < 7 or 'TIMESTAMP' in line:
+                continue
+            values = [1.0 if value == 'True' else 0.0 if value == 'False' else float(value) for value in fields[6:-1]]
+            rows.setdefault(fields[1].strip('"'), []).append((int(fields[0].split(' ')[0]), values))
+        series = {}
+        for product, product_rows in rows.items():
+            width = min(len(values) for _, values in product_rows)
+            series[product] = (np.array([time for time, _ in product_rows]), np.array([values[:width] for _, values in product_rows], dtype=float).reshape(len(product_rows), width))
+        return series
+
+
+'''
+Backtests a variant on one day in a worker and returns its per tick trace as arrays: times, symbols,
+positions, ordered, filled, mids and pnl, each (ticks, symbols), plus the custom series of writeLog
+'''
+def record_run(variant: dict, round: int, day: int, time_limit: int = 999900, halfway=True) -> dict:
+    backtester = import_backtester()
+    capture = CustomCapture()
+    with backtester.quiet(capture=capture):
+        trader = variant_class(variant.get('trader', 'main.py'), variant.get('params'), variant.get('methods'))()
+        states, trade_store, mids_by_time = backtester.load_day(round, day, time_limit)
+        max_time = max(states)
+        trace = backtester.Trace(backtester.SYMBOLS_BY_ROUND_POSITIONABLE[round])
+        _, _, profits_by_symbol, balance_by_symbol = backtester.trades_position_pnl_run(
+            states, max_time, *backtester.initial_accounting(states), trader=trader, round=round, halfway=halfway,
+            mids_by_time=mids_by_time, restart_at=None, persist_state=False, trade_store=trade_store, trace=trace)
+        arrays = trace.arrays()
+        return {
+            'times': arrays['times'],
+            'symbols': trace.symbols,
+            'positions': arrays['positions'],
+            'ordered': arrays['ordered'],
+            'filled': arrays['filled'],
+            'mids': arrays['mids'],
+            'pnl': backtester.pnl_matrix(profits_by_symbol, balance_by_symbol, trace.times, trace.symbols),
+            'customs': capture.series(),
+        }
+
+
+# both variants on every day, in parallel. Returns two {day: trace}
+def record_pair(a: dict, b: dict, round: int, days: list[int], time_limit: int = 999900, halfway=True, workers: int | None = None) -> tuple[dict, dict]:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {(side, day): pool.submit(record_run, variant, round, day, time_limit, halfway) for side, variant in (('a', a), ('b', b)) for day in days}
+        traces = {key: job.result() for key, job in jobs.items()}
+    return {day: traces[('a', day)] for day in days}, {day: traces[('b', day)] for day in days}
+
+
+def save_run(path: str, run: dict[int, dict]):
+    arrays = {}
+    for day, trace in run.items():
+        for name in ['times', 'positions', 'ordered', 'filled', 'mids', 'pnl']:
+            arrays[f'{day}/{name}'] = trace[name]
+        arrays[f'{day}/symbols'] = np.array(trace['symbols'])
+        for product, (times, values) in trace['customs'].items():
+            arrays[f'{day}/customs/{product}/times'] = times
+            arrays[f'{day}/customs/{product}/values'] = values
+    np.savez_compressed(path, **arrays)
+
+
+def load_run(path: str) -> dict[int, dict]:
+    run: dict[int, dict] = {}
+    with np.load(path) as data:
+        for key in data.files:
+            parts = key.split('/')
+            trace = run.setdefault(int(parts[0]), {'customs': {}})
+            if parts[1] == 'customs':
+                times, values = trace['customs'].get(parts[2], (None, None))
+                trace['customs'][parts[2]] = (data[key], values) if parts[3] == 'times' else (times, data[key])
+            elif parts[1] == 'symbols':
+                trace['symbols'] = data[key].tolist()
+            else:
+                trace[parts[1]] = data[key]
+    return run
+
+
+'''
+Aligns a matrix of each run on the timestamps and symbols both have: (times, a values, b values)
+'''
+def align(times_a: np.ndarray, a: np.ndarray, symbols_a: list[str], times_b: np.ndarray, b: np.ndarray, symbols_b: list[str], symbols: list[str]):
+    times, index_a, index_b = np.intersect1d(times_a, times_b, assume_unique=True, return_indices=True)
+    columns_a = [symbols_a.index(symbol) for symbol in symbols]
+    columns_b = [symbols_b.index(symbol) for symbol in symbols]
+    return times, a[np.ix_(index_a, columns_a)], b[np.ix_(index_b, columns_b)]
+
+
+# first row where any column differs by more than tolerance: (row, column) or None
+def first_difference(a: np.ndarray, b: np.ndarray, tolerance: float) -> tuple[int, int] | None:
+    different = ~np.isclose(a, b, atol=tolerance, rtol=0, equal_nan=True)
+    rows = np.flatnonzero(different.any(axis=1))
+    if len(rows) == 0:
+        return None
+    return int(rows[0]), int(np.flatnonzero(different[rows[0]])[0])
+
+
+'''
+Compares two runs day by day: the first timestamp where each field of a product diverges, the first
+divergence overall, the final profit of each run per product and the SEGMENTS stretches of the day where
+b gained or lost the most profit against a
+'''
+def diff_runs(run_a: dict[int, dict], run_b: dict[int, dict], tolerance: float = 1e-9) -> dict[int, dict]:
+    result = {}
+    for day in sorted(set(run_a) & set(run_b)):
+        a, b = run_a[day], run_b[day]
+        symbols = [symbol for symbol in a['symbols'] if symbol in b['symbols']]
+        divergences = []
+        aligned = {}
+        for field in FIELDS:
+            times, values_a, values_b = align(a['times'], a[field], a['symbols'], b['times'], b[field], b['symbols'], symbols)
+            aligned[field] = (values_a, values_b)
+            for column, symbol in enumerate(symbols):
+                found = first_difference(values_a[:, column:column + 1], values_b[:, column:column + 1], tolerance)
+                if found:
+                    divergences.append({'timestamp': int(times[found[0]]), 'product': symbol, 'field': field,
+                                        'a': float(values_a[found[0], column]), 'b': float(values_b[found[0], column])})
+        for product in sorted(set(a['customs']) & set(b['customs'])):
+            times_a, values_a = a['customs'][product]
+            times_b, values_b = b['customs'][product]
+            width = min(values_a.shape[1], values_b.shape[1])
+            _, index_a, index_b = np.intersect1d(times_a, times_b, return_indices=True)
+            found = first_difference(values_a[index_a, :width], values_b[index_b, :width], tolerance)
+            if found:
+                divergences.append({'timestamp': int(times_a[index_a[found[0]]]), 'product': product, 'field': f'custom {found[1]}',
+                                    'a': float(values_a[index_a[found[0]], found[1]]), 'b': float(values_b[index_b[found[0]], found[1]])})
+        divergences.sort(key=lambda item: (item['timestamp'], FIELDS.index(item['field']) if item['field'] in FIELDS else len(FIELDS)))
+
+        pnl_a, pnl_b = aligned['pnl']
+        gap = pnl_b - pnl_a
+        bounds = np.linspace(0, len(times) - 1, SEGMENTS + 1).astype(int)
+        changes = gap[bounds[1:]] - gap[bounds[:-1]]
+        segments = [{'start': int(times[bounds[i]]), 'end': int(times[bounds[i + 1]]),
+                     'products': {symbol: float(changes[i, column]) for column, symbol in enumerate(symbols) if changes[i, column] != 0}}
+                    for i in range(SEGMENTS)]
+        segments = [segment for segment in segments if segment['products']]
+        segments.sort(key=lambda segment: -abs(sum(segment['products'].values())))
+
+        result[day] = {
+            'first_divergence': divergences[0] if divergences else None,
+            'divergences': divergences,
+            'final': {symbol: {'a': float(pnl_a[-1, column]), 'b': float(pnl_b[-1, column])} for column, symbol in enumerate(symbols)},
+            'segments': segments,
+        }
+    return result
+
+
+def report(diff: dict[int, dict], top: int = 5) -> str:
+    lines = []
+    for day, result in diff.items():
+        lines.append(f'Day {day}:')
+        first = result['first_divergence']
+        if first is None:
+            lines.append('    the runs are identical')
+            continue
+        lines.append(f'    first divergence at {first["timestamp"]}: {first["product"]} {first["field"]} {first["a"]:g} -> {first["b"]:g}')
+        for divergence in result['divergences'][1:]:
+            lines.append(f'        then {divergence["product"]} {divergence["field"]} at {divergence["timestamp"]}')
+        lines.append(f'    {"product":<16}{"a":>12}{"b":>12}{"b - a":>12}')
+        for symbol, final in result['final'].items():
+            lines.append(f'    {symbol:<16}{final["a"]:>12.0f}{final["b"]:>12.0f}{final["b"] - final["a"]:>12.0f}')
+        lines.append('    where b gained or lost the most against a:')
+        for segment in result['segments'][:top]:
+            products = ', '.join(f'{symbol} {change:+.0f}' for symbol, change in segment['products'].items())
+            lines.append(f'        {segment["start"]:>7} - {segment["end"]:<7} {products}')
+    return '\n'.join(lines)
+
+
+def parse_methods(values: list[str] | None) -> dict:
+    return dict(value.split('=', 1) for value in values or [])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Runs two variants of a trader and diffs their per tick traces')
+    parser.add_argument('--round', type=int, default=2)
+    parser.add_argument('--days', type=int, nargs='+', default=[0])
+    for side in ['a', 'b']:
+        parser.add_argument(f'--{side}-trader', default='main.py', help='trader file relative to the repo')
+        parser.add_argument(f'--{side}-params', help='JSON object of class attributes to override')
+        parser.add_argument(f'--{side}-methods', nargs='*', help='handler swaps, for instance handleCoconuts=handleCoconutsOLD')
+        parser.add_argument(f'--{side}-load', help='diff a run saved with --save instead of running it')
+        parser.add_argument(f'--{side}-save', help='save the run as .npz')
+    parser.add_argument('--time-limit', type=int, default=999900)
+    parser.add_argument('--no-halfway', action='store_true')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    variants = {side: {'trader': getattr(args, f'{side}_trader'), 'params': json.loads(getattr(args, f'{side}_params') or '{}'),
+                       'methods': parse_methods(getattr(args, f'{side}_methods'))} for side in ['a', 'b']}
+    runs = {side: load_run(getattr(args, f'{side}_load')) for side in ['a', 'b'] if getattr(args, f'{side}_load')}
+    if len(runs) < 2:
+        run_a, run_b = record_pair(variants['a'], variants['b'], args.round, args.days, args.time_limit, not args.no_halfway, args.workers)
+        runs.setdefault('a', run_a)
+        runs.setdefault('b', run_b)
+    for side in ['a', 'b']:
+        if getattr(args, f'{side}_save'):
+            save_run(getattr(args, f'{side}_save'), runs[side])
+    print(report(diff_runs(runs['a'], runs['b'])))
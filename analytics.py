@@ -0,0 +1,151 @@
+import numpy as np
+
+# profit changes are summed over this many ticks before the Sharpe-like ratios, single ticks are mostly zero
+RETURN_WINDOW = 100
+
+# reason of the fills of orders the trader did not tag
+UNTAGGED = 'untagged'
+
+
+'''
+Per tick arrays of what the trader did, filled by trades_position_pnl_run when it gets a trace:
+the position after the tick, the volume ordered and filled and the mid of every symbol, and every fill
+with the reason code of the order it came from (see Trader.tagOrders and attribution.py)
+'''
+class Trace:
+    def __init__(self, symbols: list[str]):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.times: list[int] = []
+        self.positions: list[list[int]] = []
+        self.ordered: list[list[int]] = []
+        self.filled: list[list[int]] = []
+        self.mids: list[list[float]] = []
+        # (tick number, symbol index, price, signed quantity, reason index)
+        self.fills: list[tuple[int, int, float, int, int]] = []
+        self.reasons: list[str] = []
+        self.reason_index: dict[str, int] = {}
+
+    # reasons, if given, holds the reason code of every trade
+    def record(self, time: int, orders: dict, trades: list, position: dict[str, int], mids: dict[str, float], reasons: list[str] | None = None):
+        tick = len(self.times)
+        ordered = [0] * len(self.symbols)
+        filled = [0] * len(self.symbols)
+        for symbol, symbol_orders in (orders or {}).items():
+            if symbol in self.index:
+                ordered[self.index[symbol]] += sum(abs(order.quantity) for order in symbol_orders or [])
+        for n, trade in enumerate(trades):
+            i = self.index[trade.symbol]
+            filled[i] += abs(trade.quantity)
+            reason = reasons[n] if reasons else UNTAGGED
+            if reason not in self.reason_index:
+                self.reason_index[reason] = len(self.reasons)
+                self.reasons.append(reason)
+            self.fills.append((tick, i, trade.price, trade.quantity, self.reason_index[reason]))
+        self.times.append(time)
+        self.ordered.append(ordered)
+        self.filled.append(filled)
+        self.positions.append([position[symbol] for symbol in self.symbols])
+        self.mids.append([mids[symbol] for symbol in self.symbols])
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        fills = np.array(self.fills, dtype=float).reshape(-1, 5)
+        return {
+            'times': np.array(self.times),
+            'positions': np.array(self.positions, dtype=float).reshape(-1, len(self.symbols)),
+            'ordered': np.array(self.ordered, dtype=float).reshape(-1, len(self.symbols)),
+            'filled': np.array(self.filled, dtype=float).reshape(-1, len(self.symbols)),
+            'mids': np.array(self.mids, dtype=float).reshape(-1, len(self.symbols)),
+            'fill_ticks': fills[:, 0].astype(int),
+            'fill_symbols': fills[:, 1].astype(int),
+            'fill_prices': fills[:, 2],
+            'fill_quantities': fills[:, 3],
+            'fill_reasons': fills[:, 4].astype(int),
+        }
+
+
+# (ticks, symbols) array of the profit the backtester marks at every timestamp, profit plus open balance
+def pnl_matrix(profits_by_symbol: dict[int, dict[str, float]], balance_by_symbol: dict[int, dict[str, float]], times, symbols: list[str]) -> np.ndarray:
+    return np.array([[profits_by_symbol[time][symbol] + balance_by_symbol[time][symbol] for symbol in symbols] for time in times], dtype=float)
+
+
+'''
+Risk and execution metrics per product from a trace and the matching profit matrix, every one a vectorized
+pass over the (ticks, symbols) arrays:
+profit, max_drawdown, sharpe and sortino (mean over the std, or the downside std, of the profit change per
+RETURN_WINDOW ticks, scaled to a day), profit_to_drawdown, turnover (volume and notional traded),
+time_at_limit (share of ticks with the position at the limit), order_to_fill (volume ordered per volume filled)
+and fill_edge (average price improvement of a fill over the mid, per unit)
+'''
+def compute_metrics(trace: Trace, pnl: np.ndarray, limits: dict[str, int], window: int = RETURN_WINDOW) -> dict[str, dict[str, float]]:
+    arrays = trace.arrays()
+    symbols = trace.symbols
+    ticks = len(pnl)
+
+    drawdown = (np.maximum.accumulate(pnl, axis=0) - pnl).max(axis=0) if ticks else np.zeros(len(symbols))
+    windows = pnl[::window]
+    returns = np.diff(np.vstack([np.zeros((1, len(symbols))), windows, pnl[-1:]]), axis=0) if ticks else np.zeros((0, len(symbols)))
+    scale = np.sqrt(len(returns)) if len(returns) else 0.0
+    mean = returns.mean(axis=0) if len(returns) else np.zeros(len(symbols))
+    std = returns.std(axis=0) if len(returns) else np.zeros(len(symbols))
+    downside = np.sqrt((np.minimum(returns, 0) ** 2).mean(axis=0)) if len(returns) else np.zeros(len(symbols))
+
+    limit = np.array([limits.get(symbol, np.inf) for symbol in symbols], dtype=float)
+    at_limit = (np.abs(arrays['positions']) >= limit).mean(axis=0) if len(arrays['positions']) else np.zeros(len(symbols))
+    ordered = arrays['ordered'].sum(axis=0)
+    filled = arrays['filled'].sum(axis=0)
+
+    fill_symbols = arrays['fill_symbols']
+    fill_mids = arrays['mids'][arrays['fill_ticks'], fill_symbols] if len(fill_symbols) else np.zeros(0)
+    quantities = arrays['fill_quantities']
+    edge = (fill_mids - arrays['fill_prices']) * quantities
+    notional = np.bincount(fill_symbols, weights=np.abs(quantities * arrays['fill_prices']), minlength=len(symbols))
+    edge_total = np.bincount(fill_symbols, weights=edge, minlength=len(symbols))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, mean / std * scale, 0.0)
+        sortino = np.where(downside > 0, mean / downside * scale, 0.0)
+        profit_to_drawdown = np.where(drawdown > 0, pnl[-1] / drawdown, 0.0) if ticks else np.zeros(len(symbols))
+        order_to_fill = np.where(filled > 0, ordered / filled, np.inf)
+        fill_edge = np.where(filled > 0, edge_total / filled, 0.0)
+
+    return {symbol: {
+        'profit': float(pnl[-1, i]) if ticks else 0.0,
+        'max_drawdown': float(drawdown[i]),
+        'sharpe': float(sharpe[i]),
+        'sortino': float(sortino[i]),
+        'profit_to_drawdown': float(profit_to_drawdown[i]),
+        'turnover': float(filled[i]),
+        'notional': float(notional[i]),
+        'time_at_limit': float(at_limit[i]),
+        'order_to_fill': float(order_to_fill[i]),
+        'fill_edge': float(fill_edge[i]),
+    } for i, symbol in enumerate(symbols)}
+
+
+# the metrics summed over products (profit, drawdown of the total curve, Sharpe of the total curve)
+def total_metrics(pnl: np.ndarray, window: int = RETURN_WINDOW) -> dict[str, float]:
+    total = pnl.sum(axis=1)
+    drawdown = float((np.maximum.accumulate(total) - total).max()) if len(total) else 0.0
+    returns = np.diff(np.concatenate([[0.0], total[::window], total[-1:]]))
+    std = returns.std()
+    return {
+        'profit': float(total[-1]) if len(total) else 0.0,
+        'max_drawdown': drawdown,
+        'sharpe': float(returns.mean() / std * np.sqrt(len(returns))) if std > 0 else 0.0,
+        'profit_to_drawdown': float(total[-1] / drawdown) if drawdown > 0 else 0.0,
+    }
+
+
+# configurations (name -> total metrics) best first by a metric
+def rank(results: dict[str, dict[str, float]], by: str = 'sharpe') -> list[tuple[str, dict[str, float]]]:
+    return sorted(results.items(), key=lambda item: -item[1][by])
+
+
+def report(metrics: dict[str, dict[str, float]]) -> str:
+    columns = [('profit', 'profit', '.0f'), ('max_drawdown', 'max dd', '.0f'), ('sharpe', 'sharpe', '.2f'), ('sortino', 'sortino', '.2f'),
+               ('turnover', 'turnover', '.0f'), ('time_at_limit', 'at limit', '.1%'), ('order_to_fill', 'ord/fill', '.2f'), ('fill_edge', 'edge', '.2f')]
+    lines = [f'{"product":<16}' + ''.join(f'{title:>10}' for _, title, _ in columns)]
+    for symbol, values in metrics.items():
+        lines.append(f'{symbol:<16}' + ''.join(f'{values[key]:>10{spec}}' for key, _, spec in columns))
+    return '\n'.join(lines)
@@ -0,0 +1,134 @@
+import argparse
+import io
+import json
+import os
+import sys
+
+import pandas as pd
+
+from synthetic_market import SYMBOLS_BY_ROUND
+from walk_forward import REPO, import_backtester
+
+ARCHIVE_DIR = os.path.join(REPO, 'archive')
+ARCHIVED_LOGS = {
+    1: os.path.join(ARCHIVE_DIR, 'whole-round-one-log.csv'),
+    2: os.path.join(ARCHIVE_DIR, 'whole-round-two-log.csv'),
+}
+
+ACTIVITIES_HEADER = 'day;timestamp;product;'
+TRADE_COLUMNS = ['timestamp', 'buyer', 'seller', 'symbol', 'currency', 'price', 'quantity']
+# our side of every trade in the exchange's trade history
+SUBMISSION = 'SUBMISSION'
+
+
+def empty_trades() -> pd.DataFrame:
+    return pd.DataFrame({column: pd.Series(dtype=float if column == 'price' else int if column in ('timestamp', 'quantity') else str)
+                         for column in TRADE_COLUMNS})
+
+
+'''
+Reads an exchange log in any of the layouts we have: a plain activities CSV (the archived whole-round logs
+and the training prices files) or a sectioned log with "Sandbox logs:", "Activities log:" and optionally
+"Trade History:" sections, as downloaded from the exchange and imitated by create_log_file.
+Returns the activities as a prices dataframe and the market trades of the trade history, without our own
+trades, as a trades dataframe (empty when the log has none)
+'''
+def read_log(path: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    if text.startswith(ACTIVITIES_HEADER):
+        return pd.read_csv(io.StringIO(text), sep=';'), empty_trades()
+
+    if 'Activities log:' not in text:
+        raise ValueError(f'{path} has neither an activities header nor an "Activities log:" section')
+    activities = text.split('Activities log:', 1)[1].lstrip('\n')
+    history = None
+    if 'Trade History:' in activities:
+        activities, history = activities.split('Trade History:', 1)
+    # the backtester's own logs can have its prints in between the rows
+    rows = [line for line in activities.splitlines() if ';' in line]
+    df_prices = pd.read_csv(io.StringIO('\n'.join(rows)), sep=';')
+
+    df_trades = empty_trades()
+    if history and history.strip():
+        trades = pd.DataFrame(json.loads(history))
+        if len(trades):
+            trades = trades[(trades['buyer'] != SUBMISSION) & (trades['seller'] != SUBMISSION)]
+            df_trades = trades.reindex(columns=TRADE_COLUMNS).reset_index(drop=True)
+    return df_prices, df_trades
+
+
+# the round whose products match the log's
+def infer_round(df_prices) -> int:
+    products = set(df_prices['product'].unique())
+    matching = [round for round, symbols in SYMBOLS_BY_ROUND.items() if set(symbols) == products]
+    if not matching:
+        raise ValueError(f'No round trades exactly {sorted(products)}')
+    return max(matching)
+
+
+'''
+Every day of a log as (day, df_prices, df_trades), in the layout of the training files so they go straight into
+backtester.prepare_day or simulate_frames. A log without a trade history has no market trades
+'''
+def split_days(df_prices, df_trades) -> list[tuple[int, pd.DataFrame, pd.DataFrame]]:
+    days = []
+    for day, prices in df_prices.groupby('day', sort=True):
+        prices = prices.sort_values('timestamp', kind='stable', ignore_index=True)
+        # the trade history has no day, keep the trades inside this day's timestamps
+        trades = df_trades[(df_trades['timestamp'] >= prices['timestamp'].min()) & (df_trades['timestamp'] <= prices['timestamp'].max())]
+        days.append((int(day), prices, trades.reset_index(drop=True)))
+    return days
+
+
+'''
+One day of a log loaded like backtester.load_day: the states, the market trades and the mids from the columnar book
+'''
+def load_log_day(path: str, day: int | None = None, round: int | None = None, time_limit: int = 999900):
+    backtester = import_backtester()
+    df_prices, df_trades = read_log(path)
+    days = {number: (prices, trades) for number, prices, trades in split_days(df_prices, df_trades)}
+    prices, trades = days[day if day is not None else min(days)]
+    return backtester.prepare_day(prices, trades, round or infer_round(df_prices), time_limit)
+
+
+# the profit_and_loss the exchange reported for every product, a (timestamps) series per product
+def realized_pnl(df_prices) -> dict[str, pd.Series]:
+    return {product: rows.set_index('timestamp')['profit_and_loss'] for product, rows in df_prices.groupby('product', sort=False)}
+
+
+'''
+Backtests trader on every day of an archived log and returns, per day, the simulated final profit per symbol
+next to the final profit the exchange reported
+'''
+def replay(path: str, trader_factory, round: int | None = None, time_limit: int = 999900, halfway=True) -> dict[int, dict[str, dict[str, float]]]:
+    # outside quiet(), which moves to the repo, so a relative path is the caller's
+    df_prices, df_trades = read_log(path)
+    round = round or infer_round(df_prices)
+    backtester = import_backtester()
+    results = {}
+    for day, prices, trades in split_days(df_prices, df_trades):
+        with backtester.quiet():
+            simulated = backtester.simulate_frames(prices, trades, round, trader_factory(), time_limit, halfway, restart_at=None)
+        last = prices[prices['timestamp'] == min(prices['timestamp'].max(), time_limit)]
+        realized = dict(zip(last['product'], last['profit_and_loss'].astype(float)))
+        results[day] = {symbol: {'simulated': profit, 'realized': realized.get(symbol, 0.0)} for symbol, profit in simulated.items()}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backtests the Trader on the days of an archived exchange log')
+    parser.add_argument('log', nargs='?', default=ARCHIVED_LOGS[2], help='activities CSV or sectioned exchange log')
+    parser.add_argument('--round', type=int, help='inferred from the products in the log by default')
+    parser.add_argument('--time-limit', type=int, default=999900)
+    parser.add_argument('--no-halfway', action='store_true', help='only fill orders at prices in the book')
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO)
+    from main import Trader
+    results = replay(args.log, Trader, args.round, args.time_limit, not args.no_halfway)
+    for day, symbols in results.items():
+        print(f'Day {day}:')
+        print(f'    {"product":<16}{"simulated":>12}{"exchange":>12}')
+        for symbol, values in symbols.items():
+            print(f'    {symbol:<16}{values["simulated"]:>12.1f}{values["realized"]:>12.1f}')
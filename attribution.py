@@ -0,0 +1,77 @@
+import numpy as np
+
+from analytics import UNTAGGED, Trace
+
+
+'''
+Reason code of every trade from the orders the trader sent and its orderReasons table (Order -> reason).
+Trades carry no reference to their order, so a trade gets the reason of the first order with its symbol, price
+and side. Orders that are not in the table, or a trader without one, give UNTAGGED
+'''
+def trade_reasons(orders: dict, reasons: dict | None, trades: list) -> list[str]:
+    if not reasons:
+        return [UNTAGGED] * len(trades)
+    lookup: dict[tuple, str] = {}
+    for symbol, symbol_orders in orders.items():
+        for order in symbol_orders or []:
+            lookup.setdefault((symbol, order.price, order.quantity > 0), reasons.get(order, UNTAGGED))
+    return [lookup.get((trade.symbol, trade.price, trade.quantity > 0), UNTAGGED) for trade in trades]
+
+
+'''
+Profit of every reason code per product, treating the fills of each reason as a book of their own.
+The books add up to the product's profit marked at the last mid, the way the backtester liquidates at the end.
+Per reason: fills, volume, edge (what the fills gained against the mid when they happened), total (cash plus the
+open position at the last mid), unrealized (the open position against its average cost) and realized (the rest).
+The average cost is the one of the position built since the book last crossed or touched zero
+'''
+def attribute(trace: Trace) -> dict[str, dict[str, dict[str, float]]]:
+    arrays = trace.arrays()
+    symbols, reasons = arrays['fill_symbols'], arrays['fill_reasons']
+    quantities, prices = arrays['fill_quantities'], arrays['fill_prices']
+    if len(quantities) == 0:
+        return {}
+    final_mids = arrays['mids'][-1]
+    fill_mids = arrays['mids'][arrays['fill_ticks'], symbols]
+
+    result: dict[str, dict[str, dict[str, float]]] = {}
+    groups = symbols * len(trace.reasons) + reasons
+    order = np.argsort(groups, kind='stable')
+    bounds = np.flatnonzero(np.diff(groups[order])) + 1
+    for members in np.split(order, bounds):
+        symbol, reason = trace.symbols[symbols[members[0]]], trace.reasons[reasons[members[0]]]
+        q, p = quantities[members], prices[members]
+        position = np.cumsum(q)
+        open_position = position[-1]
+        total = -np.sum(q * p) + open_position * final_mids[symbols[members[0]]]
+
+        unrealized = 0.0
+        if open_position != 0:
+            side = np.sign(open_position)
+            before = position - q
+            start = np.flatnonzero(before * side <= 0)[-1]
+            adding = np.arange(len(q)) > start
+            adding &= q * side > 0
+            volume = position[start] + q[adding].sum()
+            cost = (position[start] * p[start] + (q[adding] * p[adding]).sum()) / volume
+            unrealized = float(open_position * (final_mids[symbols[members[0]]] - cost))
+
+        result.setdefault(symbol, {})[reason] = {
+            'fills': int(len(q)),
+            'volume': float(np.abs(q).sum()),
+            'edge': float(((fill_mids[members] - p) * q).sum()),
+            'realized': float(total - unrealized),
+            'unrealized': unrealized,
+            'total': float(total),
+            'open_position': float(open_position),
+        }
+    return result
+
+
+def report(attribution: dict[str, dict[str, dict[str, float]]]) -> str:
+    lines = [f'{"product":<16}{"reason":<20}{"fills":>7}{"volume":>9}{"edge":>10}{"realized":>11}{"unrealized":>12}{"total":>10}']
+    for symbol, by_reason in attribution.items():
+        for reason, values in sorted(by_reason.items(), key=lambda item: -item[1]['total']):
+            lines.append(f'{symbol:<16}{reason:<20}{values["fills"]:>7}{values["volume"]:>9.0f}{values["edge"]:>10.0f}'
+                         f'{values["realized"]:>11.0f}{values["unrealized"]:>12.0f}{values["total"]:>10.0f}')
+    return '\n'.join(lines)
@@ -1,17 +1,50 @@
 import sys
 from main import *
+from book_features import book_arrays, compute_book_features, mid_table
+import datamodel
+import struct
+from trade_store import SYMBOLS, TradeStore, load_trades
+from latency_profiler import LatencyProfiler, TimeBudget
+from time import perf_counter
+from memory_tracker import MemoryTracker
+from fill_model import FillModel
+from analytics import Trace, compute_metrics, pnl_matrix, report as analytics_report
+from attribution import attribute, trade_reasons, report as attribution_report
+from ledger import MODES as LEDGER_MODES, Ledger, report as ledger_report
 from typing import Any  #, Callable
 import numpy as np
 import pandas as pd
 import statistics
 import copy
-import uuid
+import gzip
 import random
 import os
-from datetime import datetime
+from contextlib import contextmanager
 
 sys.stdout = open('simresults.txt','wt')
 
+# the training paths below are relative to the repo
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+'''
+Runs the block from the repo (or workdir) with the trader's prints discarded, or written to capture,
+then gives the caller back its own stdout and working directory. For the tools that backtest in a loop or a worker
+'''
+@contextmanager
+def quiet(workdir: str = REPO_DIR, capture=None):
+    stdout, cwd = sys.stdout, os.getcwd()
+    sink = capture if capture is not None else open(os.devnull, 'w')
+    os.chdir(workdir)
+    sys.stdout = sink
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+        if capture is None:
+            sink.close()
+
 # Timesteps used in training files
 TIME_DELTA = 100
 # Please put all! the price and log files into
@@ -74,11 +107,13 @@ SYMBOLS_BY_ROUND_POSITIONABLE = {
 
 def process_prices(df_prices, round, time_limit) -> dict[int, TradingState]:
     states = {}
+    # listings never change during a day, every state shares the same ones
+    shared_listings: dict[str, Listing] = {}
     for _, row in df_prices.iterrows():
         time: int = int(row["timestamp"])
         if time > time_limit:
             break
-        product: str = row["product"]
+        product: str = SYMBOLS.intern(row["product"])
         if states.get(time) == None:
             position: Dict[Product, Position] = {}
             own_trades: Dict[Symbol, List[OwnTrade]] = {}
@@ -93,7 +128,9 @@ def process_prices(df_prices, round, time_limit) -> dict[int, TradingState]:
             states[time].own_trades[product] = []
             states[time].market_trades[product] = []
 
-        states[time].listings[product] = Listing(product, product, "1")
+        if product not in shared_listings:
+            shared_listings[product] = Listing(product, product, "1")
+        states[time].listings[product] = shared_listings[product]
 
         if product == "DOLPHIN_SIGHTINGS":
             states[time].observations["DOLPHIN_SIGHTINGS"] = row['mid_price']
@@ -115,22 +152,12 @@ def process_prices(df_prices, round, time_limit) -> dict[int, TradingState]:
 
     return states
 
+# Materializes every trade up front, simulate_alternative uses load_trades instead and
+# only builds the Trade objects of a timestamp when its state is handed to the trader
 def process_trades(df_trades, states: dict[int, TradingState], time_limit, names=True):
-    for _, trade in df_trades.iterrows():
-        time: int = trade['timestamp']
-        if time > time_limit:
-            break
-        symbol = trade['symbol']
-        if symbol not in states[time].market_trades:
-            states[time].market_trades[symbol] = []
-        t = Trade(
-                symbol, 
-                trade['price'], 
-                trade['quantity'], 
-                str(trade['buyer']), 
-                str(trade['seller']),
-                time)
-        states[time].market_trades[symbol].append(t)
+    store = load_trades(df_trades, time_limit)
+    for time, state in states.items():
+        store.trades_at(time, state.market_trades)
     return states
        
 current_limits = {
@@ -165,42 +192,114 @@ def calc_mid(states: dict[int, TradingState], round: int, time: int, max_time: i
     return medians_by_symbol
 
 
-# Setting a high time_limit can be harder to visualize
-# print_position prints the position before! every Trader.run
-def simulate_alternative(
-        round: int, 
-        day: int, 
-        trader, 
-        time_limit=999900, 
-        names=True, 
-        halfway=False,
-        monkeys=True,
-        monkey_names=['Peter', 'Mitch', 'Gary', 'Penelope', 'Omar', 'Camilla', 'Caesar', 'Glulla', 'Mabel', 'Charlie', 'Pablo', 'Olivia', 'Orson', 'Casey', 'George', 'Mya', 'Max', 'Paris', 'Gina', 'Olga']
-    ):
+# Reads the prices and trades of a day: the states, the market trades and the mid of every symbol at every timestamp
+def load_day(round: int, day: int, time_limit=999900, names=True) -> tuple[dict[int, TradingState], TradeStore, dict[int, dict[str, float]]]:
     prices_path = os.path.join(TRAINING_DATA_PREFIX, f'prices_round_{round}_day_{day}.csv')
     trades_path = os.path.join(TRAINING_DATA_PREFIX, f'trades_round_{round}_day_{day}_wn.csv')
     if not names:
         trades_path = os.path.join(TRAINING_DATA_PREFIX, f'trades_round_{round}_day_{day}_nn.csv')
     df_prices = pd.read_csv(prices_path, sep=';')
     df_trades = pd.read_csv(trades_path, sep=';', dtype={ 'seller': str, 'buyer': str })
+    return prepare_day(df_prices, df_trades, round, time_limit)
 
+
+# Same as load_day for dataframes that are already in memory, synthetic days for instance
+def prepare_day(df_prices, df_trades, round: int, time_limit=999900) -> tuple[dict[int, TradingState], TradeStore, dict[int, dict[str, float]]]:
     states = process_prices(df_prices, round, time_limit)
-    states = process_trades(df_trades, states, time_limit, names)
-    ref_symbols = list(states[0].position.keys())
-    max_time = max(list(states.keys()))
+    trade_store = load_trades(df_trades, time_limit)
+
+    # book features for the whole day in one vectorized pass, used for every mark to mid
+    book = book_arrays(df_prices)
+    mids_by_time = mid_table(book, compute_book_features(book), SYMBOLS_BY_ROUND_POSITIONABLE[round])
+
+    return states, trade_store, mids_by_time
 
+
+def initial_accounting(states: dict[int, TradingState]) -> tuple[dict[int, dict[str, float]], ...]:
+    ref_symbols = list(states[0].position.keys())
     # handling these four is rather tricky 
     profits_by_symbol: dict[int, dict[str, float]] = { 0: dict(zip(ref_symbols, [0.0]*len(ref_symbols))) }
     balance_by_symbol: dict[int, dict[str, float]] = { 0: copy.deepcopy(profits_by_symbol[0]) }
     credit_by_symbol: dict[int, dict[str, float]] = { 0: copy.deepcopy(profits_by_symbol[0]) }
     unrealized_by_symbol: dict[int, dict[str, float]] = { 0: copy.deepcopy(profits_by_symbol[0]) }
+    return profits_by_symbol, balance_by_symbol, credit_by_symbol, unrealized_by_symbol
+
+
+# the same numbers create_log_file prints as the final profit of each symbol
+def final_profits(profits_by_symbol: dict[int, dict[str, float]], balance_by_symbol: dict[int, dict[str, float]], round: int, max_time: int) -> dict[str, float]:
+    return { symbol: profits_by_symbol[max_time][symbol] + balance_by_symbol[max_time][symbol] for symbol in SYMBOLS_BY_ROUND_POSITIONABLE[round] }
+
+
+# Backtests a day given as prices and trades dataframes without writing any log, returns the final profit per symbol
+def simulate_frames(df_prices, df_trades, round: int, trader, time_limit=999900, halfway=True, restart_at=None, persist_state=False, fill_model: FillModel | None = None) -> dict[str, float]:
+    states, trade_store, mids_by_time = prepare_day(df_prices, df_trades, round, time_limit)
+    max_time = max(list(states.keys()))
+    profits_by_symbol, balance_by_symbol, credit_by_symbol, unrealized_by_symbol = initial_accounting(states)
+    states, trader, profits_by_symbol, balance_by_symbol = trades_position_pnl_run(states, max_time, profits_by_symbol, balance_by_symbol, credit_by_symbol, unrealized_by_symbol, trader=trader, round=round, halfway=halfway, mids_by_time=mids_by_time, restart_at=restart_at, persist_state=persist_state, trade_store=trade_store, fill_model=fill_model)
+    return final_profits(profits_by_symbol, balance_by_symbol, round, max_time)
 
-    states, trader, profits_by_symbol, balance_by_symbol = trades_position_pnl_run(states, max_time, profits_by_symbol, balance_by_symbol, credit_by_symbol, unrealized_by_symbol)
-    create_log_file(round, day, states, profits_by_symbol, balance_by_symbol, trader)
+
+# Setting a high time_limit can be harder to visualize
+# print_position prints the position before! every Trader.run
+def simulate_alternative(
+        round: int, 
+        day: int, 
+        trader, 
+        time_limit=999900, 
+        names=True, 
+        halfway=False,
+        monkeys=True,
+        restart_at=500000,
+        persist_state=None,
+        record_path=None,
+        profile=True,
+        time_budget_ms=None,
+        kill_on_overrun=False,
+        memory_every=None,
+        memory_cap_mb=None,
+        trace_allocations=False,
+        write_log=True,
+        compress_log=False,
+        analytics=False,
+        fill_profile=None,
+        monkey_names=['Peter', 'Mitch', 'Gary', 'Penelope', 'Omar', 'Camilla', 'Caesar', 'Glulla', 'Mabel', 'Charlie', 'Pablo', 'Olivia', 'Orson', 'Casey', 'George', 'Mya', 'Max', 'Paris', 'Gina', 'Olga']
+    ):
+    states, trade_store, mids_by_time = load_day(round, day, time_limit, names)
+    max_time = max(list(states.keys()))
+    profits_by_symbol, balance_by_symbol, credit_by_symbol, unrealized_by_symbol = initial_accounting(states)
+
+    # per call latency of run and every handler, cheap enough to always be on
+    profiler = LatencyProfiler(trader) if profile else None
+    # drop the orders of every run slower than the budget, like the exchange would
+    budget = TimeBudget(time_budget_ms, kill_on_overrun) if time_budget_ms is not None else None
+    # size of the state the trader keeps between ticks, sampled every memory_every ticks
+    memory = MemoryTracker(memory_every, memory_cap_mb, trace_allocations) if memory_every else None
+    # positions, orders, fills and mids of every tick for the risk and execution metrics
+    trace = Trace(SYMBOLS_BY_ROUND_POSITIONABLE[round]) if analytics else None
+    # a FillModel or the path of a profile written by calibrate_fills.py, replaces halfway
+    fill_model = FillModel.load(fill_profile) if isinstance(fill_profile, str) else fill_profile
+    states, trader, profits_by_symbol, balance_by_symbol = trades_position_pnl_run(states, max_time, profits_by_symbol, balance_by_symbol, credit_by_symbol, unrealized_by_symbol, trader=trader, round=round, halfway=halfway, mids_by_time=mids_by_time, restart_at=restart_at, persist_state=persist_state, record_path=record_path, trade_store=trade_store, profiler=profiler, budget=budget, memory=memory, trace=trace, fill_model=fill_model)
+    if write_log:
+        create_log_file(round, day, states, profits_by_symbol, balance_by_symbol, trader, compress_log)
+    if profiler:
+        print(f"\nLatency per call on round {round} day {day}:")
+        print(profiler.report())
+    if budget:
+        print(budget.report())
+    if memory:
+        print(memory.report())
+    if trace:
+        print(f"\nRisk and execution metrics on round {round} day {day}:")
+        print(analytics_report(compute_metrics(trace, pnl_matrix(profits_by_symbol, balance_by_symbol, trace.times, trace.symbols), current_limits)))
+        print(f"\nProfit by order reason on round {round} day {day}:")
+        print(attribution_report(attribute(trace)))
+        # the backtester only realizes profit when a position goes back to zero, the ledgers realize every closed lot
+        print(f"\nRealized and unrealized profit at the last mid on round {round} day {day}:")
+        print(ledger_report({mode: Ledger.from_trace(trace, mode) for mode in LEDGER_MODES}, mids_by_time[max_time]))
     profit_balance_monkeys = {}
     trades_monkeys = {}
     if monkeys:
-        profit_balance_monkeys, trades_monkeys, profit_monkeys, balance_monkeys, monkey_positions_by_timestamp = monkey_positions(monkey_names, states, round)
+        profit_balance_monkeys, trades_monkeys, profit_monkeys, balance_monkeys, monkey_positions_by_timestamp = monkey_positions(monkey_names, states, round, mids_by_time)
         # reset stdouts
         sys.stdout = sys.__stdout__
         print("End of monkey simulation reached for round {} day {}".format(round, day))
@@ -214,6 +313,7 @@ def simulate_alternative(
     if hasattr(trader, 'after_last_round'):
         if callable(trader.after_last_round): #type: ignore
             trader.after_last_round(profits_by_symbol, balance_by_symbol) #type: ignore
+    return final_profits(profits_by_symbol, balance_by_symbol, round, max_time)
 
 
 def trades_position_pnl_run(
@@ -223,17 +323,69 @@ def trades_position_pnl_run(
         balance_by_symbol: dict[int, dict[str, float]], 
         credit_by_symbol: dict[int, dict[str, float]], 
         unrealized_by_symbol: dict[int, dict[str, float]], 
+        trader=None,
+        round=None,
+        halfway=None,
+        mids_by_time: dict[int, dict[str, float]] | None = None,
+        restart_at: int | None = 500000,
+        persist_state: bool | None = None,
+        record_path: str | None = None,
+        trade_store: TradeStore | None = None,
+        profiler: LatencyProfiler | None = None,
+        budget: TimeBudget | None = None,
+        memory: MemoryTracker | None = None,
+        trace: Trace | None = None,
+        fill_model: FillModel | None = None,
+        ledger: Ledger | None = None,
+        start_at: int | None = None,
+        stop_at: int | None = None,
         ):
+        # fall back to the module level settings when called the old way
+        trader = trader if trader is not None else globals()['trader']
+        round = round if round is not None else globals()['round']
+        halfway = halfway if halfway is not None else globals()['halfway']
+        # the snapshot is only read back after a restart, without one saveState is wasted time
+        if persist_state is None:
+            persist_state = restart_at is not None
+        recording = open(record_path, 'wb') if record_path else None
         for time, state in states.items():
+            # start_at and stop_at run a slice of the day, see checkpoint.py
+            if start_at is not None and time < start_at:
+                continue
+            if stop_at is not None and time >= stop_at:
+                break
             position = copy.deepcopy(state.position)
 
-            if time == 500000:
-                trader.reset()
-
-
-            orders = trader.run(state)
-            trades = clear_order_book(orders, state.order_depths, time, halfway)
-            mids = calc_mid(states, round, time, max_time)
+            # the snapshot from the previous tick rides along in the state, like on the exchange
+            if persist_state:
+                state.traderData = getattr(trader, 'traderData', '')
+            # mimic the exchange restarting our process: a fresh Trader that only has that snapshot
+            if time == restart_at:
+                trader = type(trader)()
+                if profiler:
+                    profiler.attach(trader)
+            trader.persistState = persist_state
+
+
+            if trade_store is not None:
+                trade_store.trades_at(time, state.market_trades)
+            if recording:
+                encoded_state = datamodel.encode_state_binary(state)
+            if budget and budget.killed:
+                # the submission failed, the trader is not called anymore
+                orders = {}
+            else:
+                start = perf_counter()
+                orders = trader.run(state)
+                elapsed_ms = (perf_counter() - start) * 1000
+                if recording:
+                    write_recording_frame(recording, encoded_state, orders)
+                if budget and not budget.check(time, elapsed_ms):
+                    orders = {}
+                if memory:
+                    memory.sample(time, trader)
+            trades = clear_order_book(orders, state.order_depths, time, halfway, fill_model)
+            mids = mids_by_time[time] if mids_by_time is not None else calc_mid(states, round, time, max_time)
             if profits_by_symbol.get(time + TIME_DELTA) == None and time != max_time:
                 profits_by_symbol[time + TIME_DELTA] = copy.deepcopy(profits_by_symbol[time])
             if credit_by_symbol.get(time + TIME_DELTA) == None and time != max_time:
@@ -254,18 +406,23 @@ def trades_position_pnl_run(
                     n_position = position[trade.symbol] + trade.quantity
                     if abs(n_position) > current_limits[trade.symbol]:
                         print('ILLEGAL TRADE, WOULD EXCEED POSITION LIMIT, KILLING ALL REMAINING ORDERS')
-                        trade_vars = vars(trade)
+                        trade_vars = attributes(trade)
                         trade_str = ', '.join("%s: %s" % item for item in trade_vars.items())
                         print(f'Stopped at the following trade: {trade_str}')
                         print(f"All trades that were sent:")
                         for trade in trades:
-                            trade_vars = vars(trade)
+                            trade_vars = attributes(trade)
                             trades_str = ', '.join("%s: %s" % item for item in trade_vars.items())
                             print(trades_str)
                         failed_symbol.append(trade.symbol)
                     else:
                         valid_trades.append(trade) 
                         position[trade.symbol] += trade.quantity
+            if ledger:
+                for trade in valid_trades:
+                    ledger.fill(time, trade.symbol, trade.price, trade.quantity)
+            if trace:
+                trace.record(time, orders, valid_trades, position, mids, trade_reasons(orders, getattr(trader, 'orderReasons', None), valid_trades))
             FLEX_TIME_DELTA = TIME_DELTA
             if time == max_time:
                 FLEX_TIME_DELTA = 0
@@ -293,9 +450,46 @@ def trades_position_pnl_run(
                     balance_by_symbol[time + FLEX_TIME_DELTA][osymbol] = 0
             if states.get(time + FLEX_TIME_DELTA) != None:
                 states[time + FLEX_TIME_DELTA].position = copy.deepcopy(position)
+        if recording:
+            recording.close()
+        if memory:
+            memory.stop()
         return states, trader, profits_by_symbol, balance_by_symbol
 
-def monkey_positions(monkey_names: list[str], states: dict[int, TradingState], round):
+# A recording is a sequence of frames, one per tick: the TradingState exactly as the trader saw it
+# and the orders it returned, both in datamodel's binary format, each prefixed by its length
+def write_recording_frame(f, encoded_state: bytes, orders: dict[str, List[Order]]):
+    encoded_orders = datamodel.encode_orders_binary(orders if orders is not None else {})
+    f.write(struct.pack('<II', len(encoded_state), len(encoded_orders)))
+    f.write(encoded_state)
+    f.write(encoded_orders)
+
+def load_recording(path: str) -> list[tuple[TradingState, dict[str, List[Order]]]]:
+    frames = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        state_length, orders_length = struct.unpack_from('<II', data, offset)
+        offset += 8
+        state = datamodel.decode_state_binary(data[offset:offset + state_length])
+        offset += state_length
+        orders = datamodel.decode_orders_binary(data[offset:offset + orders_length])
+        offset += orders_length
+        frames.append((state, orders))
+    return frames
+
+# Feeds a recording through a trader, returns the timestamps where it sent different orders
+def replay_recording(path: str, trader) -> list[int]:
+    as_tuples = lambda orders: {symbol: [(o.price, o.quantity) for o in symbol_orders] for symbol, symbol_orders in orders.items()}
+    diverged = []
+    for state, recorded_orders in load_recording(path):
+        orders = trader.run(state) or {}
+        if as_tuples(orders) != as_tuples(recorded_orders):
+            diverged.append(state.timestamp)
+    return diverged
+
+def monkey_positions(monkey_names: list[str], states: dict[int, TradingState], round, mids_by_time: dict[int, dict[str, float]] | None = None):
     profits_by_symbol: dict[int, dict[str, dict[str, float]]] = { 0: {} }
     balance_by_symbol: dict[int, dict[str, dict[str, float]]] =  { 0: {} }
     credit_by_symbol: dict[int, dict[str, dict[str, float]]] = { 0: {} }
@@ -321,7 +515,7 @@ def monkey_positions(monkey_names: list[str], states: dict[int, TradingState], r
         already_calculated = False
         for monkey in monkey_names:
             position = copy.deepcopy(monkey_positions[monkey])
-            mids = calc_mid(states, round, time, max_time)
+            mids = mids_by_time[time] if mids_by_time is not None else calc_mid(states, round, time, max_time)
             if trades_by_round.get(time + TIME_DELTA) == None:
                 trades_by_round[time + TIME_DELTA] =  copy.deepcopy(trades_by_round[time])
 
@@ -392,11 +586,14 @@ def cleanup_order_volumes(org_orders: List[Order]) -> List[Order]:
         orders.append(final_order)
     return orders
 
-def clear_order_book(trader_orders: dict[str, List[Order]], order_depth: dict[str, OrderDepth], time: int, halfway: bool) -> list[Trade]:
+# fill_model replaces the halfway rule and can fill only part of an order, see fill_model.py
+def clear_order_book(trader_orders: dict[str, List[Order]], order_depth: dict[str, OrderDepth], time: int, halfway: bool, fill_model: FillModel | None = None) -> list[Trade]:
         trades = []
+        if fill_model is not None:
+            halfway = fill_model.halfway
         for symbol in trader_orders.keys():
             if order_depth.get(symbol) != None:
-                symbol_order_depth = copy.deepcopy(order_depth[symbol])
+                symbol_order_depth = order_depth[symbol] # only read below, no need to copy
                 t_orders = cleanup_order_volumes(trader_orders[symbol])
                 for order in t_orders:
                     if order.quantity < 0:
@@ -405,11 +602,18 @@ def clear_order_book(trader_orders: dict[str, List[Order]], order_depth: dict[st
                             asks = symbol_order_depth.sell_orders.keys()
                             max_bid = max(bids)
                             min_ask = min(asks)
-                            if order.price <= statistics.median([max_bid, min_ask]):
-                                trades.append(Trade(symbol, order.price, order.quantity, "BOT", "YOU", time))
+                            median = statistics.median([max_bid, min_ask])
+                            if fill_model is not None:
+                                crossed = fill_model.crosses(order.price, order.quantity, median)
+                                volume = fill_model.filled(order.quantity)
+                            else:
+                                crossed = order.price <= median
+                                volume = order.quantity
+                            if crossed and volume != 0:
+                                trades.append(Trade(symbol, order.price, volume, "BOT", "YOU", time))
                             else:
                                 print(f'No matches for order {order} at time {time}')
-                                print(f'Order depth is {order_depth[order.symbol].__dict__}')
+                                print(f'Order depth is {attributes(order_depth[order.symbol])}')
                         else:
                             potential_matches = list(filter(lambda o: o[0] == order.price, symbol_order_depth.buy_orders.items()))
                             if len(potential_matches) > 0:
@@ -420,21 +624,31 @@ def clear_order_book(trader_orders: dict[str, List[Order]], order_depth: dict[st
                                 else:
                                     #this should be negative
                                     final_volume = -match[1]
-                                trades.append(Trade(symbol, order.price, final_volume, "BOT", "YOU", time))
+                                if fill_model is not None:
+                                    final_volume = fill_model.filled(final_volume)
+                                if final_volume != 0:
+                                    trades.append(Trade(symbol, order.price, final_volume, "BOT", "YOU", time))
                             else:
                                 print(f'No matches for order {order} at time {time}')
-                                print(f'Order depth is {order_depth[order.symbol].__dict__}')
+                                print(f'Order depth is {attributes(order_depth[order.symbol])}')
                     if order.quantity > 0:
                         if halfway:
                             bids = symbol_order_depth.buy_orders.keys()
                             asks = symbol_order_depth.sell_orders.keys()
                             max_bid = max(bids)
                             min_ask = min(asks)
-                            if order.price >= statistics.median([max_bid, min_ask]):
-                                trades.append(Trade(symbol, order.price, order.quantity, "YOU", "BOT", time))
+                            median = statistics.median([max_bid, min_ask])
+                            if fill_model is not None:
+                                crossed = fill_model.crosses(order.price, order.quantity, median)
+                                volume = fill_model.filled(order.quantity)
+                            else:
+                                crossed = order.price >= median
+                                volume = order.quantity
+                            if crossed and volume != 0:
+                                trades.append(Trade(symbol, order.price, volume, "YOU", "BOT", time))
                             else:
                                 print(f'No matches for order {order} at time {time}')
-                                print(f'Order depth is {order_depth[order.symbol].__dict__}')
+                                print(f'Order depth is {attributes(order_depth[order.symbol])}')
                         else:
                             potential_matches = list(filter(lambda o: o[0] == order.price, symbol_order_depth.sell_orders.items()))
                             if len(potential_matches) > 0:
@@ -445,10 +659,13 @@ def clear_order_book(trader_orders: dict[str, List[Order]], order_depth: dict[st
                                     final_volume = order.quantity
                                 else:
                                     final_volume = abs(match[1])
-                                trades.append(Trade(symbol, order.price, final_volume, "YOU", "BOT", time))
+                                if fill_model is not None:
+                                    final_volume = fill_model.filled(final_volume)
+                                if final_volume != 0:
+                                    trades.append(Trade(symbol, order.price, final_volume, "YOU", "BOT", time))
                             else:
                                 print(f'No matches for order {order} at time {time}')
-                                print(f'Order depth is {order_depth[order.symbol].__dict__}')
+                                print(f'Order depth is {attributes(order_depth[order.symbol])}')
         return trades
                             
 csv_header = "day;timestamp;product;bid_price_1;bid_volume_1;bid_price_2;bid_volume_2;bid_price_3;bid_volume_3;ask_price_1;ask_volume_1;ask_price_2;ask_volume_2;ask_price_3;ask_volume_3;mid_price;profit_and_loss\n"
@@ -460,66 +677,61 @@ log_header = [
     'REPORT RequestId: 8ab36ff8-b4e6-42d4-b012-e6ad69c42085	Duration: 18.73 ms	Billed Duration: 19 ms	Memory Size: 128 MB	Max Memory Used: 94 MB	Init Duration: 1574.09 ms\n',
 ]
 
-def create_log_file(round: int, day: int, states: dict[int, TradingState], profits_by_symbol: dict[int, dict[str, float]], balance_by_symbol: dict[int, dict[str, float]], trader: Trader):
-    file_name = uuid.uuid4()
-    timest = datetime.timestamp(datetime.now())
-    max_time = max(list(states.keys()))
-    with open(f'simresults.txt', 'a', encoding="utf-8", newline='\n') as f:
-        f.writelines(log_header)
-        f.write('\n')
-        for time, state in states.items():
-            if time != 0:
-                f.write(f'{time}\n')
+# level 9 takes four times as long for a tenth less size
+LOG_COMPRESSLEVEL = 6
 
-        f.write(f'\n\n')
-        f.write('Submission logs:\n\n\n')
-        f.write('Activities log:\n')
-        f.write(csv_header)
-        for time, state in states.items():
-            for symbol in SYMBOLS_BY_ROUND[round]:
-                f.write(f'{day};{time};{symbol};')
-                bids_length = len(state.order_depths[symbol].buy_orders)
-                bids = list(state.order_depths[symbol].buy_orders.items())
-                bids_prices = list(state.order_depths[symbol].buy_orders.keys())
-                bids_prices.sort()
-                asks_length = len(state.order_depths[symbol].sell_orders)
-                asks_prices = list(state.order_depths[symbol].sell_orders.keys())
-                asks_prices.sort()
-                asks = list(state.order_depths[symbol].sell_orders.items())
-                if bids_length >= 3:
-                    f.write(f'{bids[0][0]};{bids[0][1]};{bids[1][0]};{bids[1][1]};{bids[2][0]};{bids[2][1]};')
-                elif bids_length == 2:
-                    f.write(f'{bids[0][0]};{bids[0][1]};{bids[1][0]};{bids[1][1]};;;')
-                elif bids_length == 1:
-                    f.write(f'{bids[0][0]};{bids[0][1]};;;;;')
-                else:
-                    f.write(f';;;;;;')
-                if asks_length >= 3:
-                    f.write(f'{asks[0][0]};{asks[0][1]};{asks[1][0]};{asks[1][1]};{asks[2][0]};{asks[2][1]};')
-                elif asks_length == 2:
-                    f.write(f'{asks[0][0]};{asks[0][1]};{asks[1][0]};{asks[1][1]};;;')
-                elif asks_length == 1:
-                    f.write(f'{asks[0][0]};{asks[0][1]};;;;;')
-                else:
-                    f.write(f';;;;;;')
-                if len(asks_prices) == 0 or max(bids_prices) == 0:
-                    if symbol == 'DOLPHIN_SIGHTINGS':
-                        dolphin_sightings = state.observations['DOLPHIN_SIGHTINGS']
-                        f.write(f'{dolphin_sightings};{0.0}\n')
-                    else:
-                        f.write(f'{0};{0.0}\n')
-                else:
-                    actual_profit = 0.0
-                    if symbol in SYMBOLS_BY_ROUND_POSITIONABLE[round]:
-                            actual_profit = profits_by_symbol[time][symbol] + balance_by_symbol[time][symbol]
-                    min_ask = min(asks_prices)
-                    max_bid = max(bids_prices)
-                    median_price = statistics.median([min_ask, max_bid])
-                    f.write(f'{median_price};{actual_profit}\n')
-                    if time == max_time:
-                        if profits_by_symbol[time].get(symbol) != None:
-                            print(f'Final profit for {symbol} = {actual_profit}')
-        print(f"\nSimulation on round {round} day {day} for time {max_time} complete")
+# padding of a book side with fewer than three levels in the activities log, by number of levels
+MISSING_LEVELS = [';;;;;;', ';;;;', ';;', '']
+
+
+'''
+Activities log rows of a day, formatted in one pass over the states. Levels are printed in the order they have
+in the OrderDepth, the mid is the float mean of the best bid and ask and books without a bid or an ask print the
+dolphin sightings (0 for other products) in its place
+'''
+def activities_lines(round: int, day: int, states: dict[int, TradingState], profits_by_symbol: dict[int, dict[str, float]], balance_by_symbol: dict[int, dict[str, float]]) -> tuple[list[str], dict[str, float]]:
+    symbols = SYMBOLS_BY_ROUND[round]
+    positionable = [symbol in SYMBOLS_BY_ROUND_POSITIONABLE[round] for symbol in symbols]
+    max_time = max(states)
+    lines = []
+    final_profits = {}
+    for time, state in states.items():
+        profits, balances = profits_by_symbol[time], balance_by_symbol[time]
+        for symbol, known in zip(symbols, positionable):
+            depth = state.order_depths[symbol]
+            bids = list(depth.buy_orders.items())[:3]
+            asks = list(depth.sell_orders.items())[:3]
+            book = ''.join([f'{price};{volume};' for price, volume in bids]) + MISSING_LEVELS[len(bids)]
+            book += ''.join([f'{price};{volume};' for price, volume in asks]) + MISSING_LEVELS[len(asks)]
+            if len(asks) == 0 or max(depth.buy_orders, default=0) == 0:
+                sightings = state.observations['DOLPHIN_SIGHTINGS'] if symbol == 'DOLPHIN_SIGHTINGS' else 0
+                lines.append(f'{day};{time};{symbol};{book}{sightings};0.0\n')
+                continue
+            actual_profit = profits[symbol] + balances[symbol] if known else 0.0
+            lines.append(f'{day};{time};{symbol};{book}{(min(depth.sell_orders) + max(depth.buy_orders)) / 2};{actual_profit}\n')
+            if time == max_time and profits.get(symbol) != None:
+                final_profits[symbol] = actual_profit
+    return lines, final_profits
+
+
+'''
+Appends the day to simresults.txt in the format of the exchange's logs, or to simresults.txt.gz with compress.
+The log is built in memory and written with a single call
+'''
+def create_log_file(round: int, day: int, states: dict[int, TradingState], profits_by_symbol: dict[int, dict[str, float]], balance_by_symbol: dict[int, dict[str, float]], trader: Trader, compress=False):
+    max_time = max(list(states.keys()))
+    lines, final_profits = activities_lines(round, day, states, profits_by_symbol, balance_by_symbol)
+    text = ''.join(log_header) + '\n' + ''.join([f'{time}\n' for time in states if time != 0])
+    text += '\n\n' + 'Submission logs:\n\n\n' + 'Activities log:\n' + csv_header + ''.join(lines)
+    if compress:
+        with gzip.open('simresults.txt.gz', 'at', compresslevel=LOG_COMPRESSLEVEL, encoding="utf-8", newline='\n') as f:
+            f.write(text)
+    else:
+        with open('simresults.txt', 'a', encoding="utf-8", newline='\n') as f:
+            f.write(text)
+    for symbol, actual_profit in final_profits.items():
+        print(f'Final profit for {symbol} = {actual_profit}')
+    print(f"\nSimulation on round {round} day {day} for time {max_time} complete")
 
 
 def run_simulation(day = 1, round = 4, plot_monkeys=False):
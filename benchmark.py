@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import log_parser
+from walk_forward import import_backtester
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+# timings are only comparable on one machine, so every checkout makes its own with --save-baseline (not in git)
+BASELINE_PATH = os.path.join(REPO, 'benchmark_baseline.json')
+
+# fixed inputs so runs are comparable: round 2 is the last round with both prices and trades files
+BENCH_ROUND = 2
+BENCH_DAYS = [-1, 0, 1]
+BENCH_SEED = 2023
+BENCH_TIME_LIMIT = 999900
+
+STAGES = [
+    'read_csv',
+    'process_prices',
+    'process_trades',
+    'load_trades',
+    'trader_run',
+    'clear_order_book',
+    'accounting',
+    'monkey_positions',
+    'create_log_file',
+    'parse_log',
+]
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds: dict[str, float] = {stage: 0.0 for stage in STAGES}
+
+    def time(self, stage: str, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.seconds[stage] += time.perf_counter() - start
+        return result
+
+    def wrap(self, stage: str, func):
+        def timed(*args, **kwargs):
+            return self.time(stage, func, *args, **kwargs)
+        return timed
+
+
+'''
+Runs every stage of a backtest for one day, the same way simulate_alternative does,
+and returns the seconds spent per stage. trader.run and clear_order_book are timed
+inside trades_position_pnl_run, accounting is whatever else the loop spends
+'''
+def bench_day(backtester, day: int, time_limit: int) -> dict[str, float]:
+    random.seed(BENCH_SEED)
+    np.random.seed(BENCH_SEED)
+    timer = StageTimer()
+    round = BENCH_ROUND
+
+    prices_path = os.path.join(REPO, 'training', f'prices_round_{round}_day_{day}.csv')
+    trades_path = os.path.join(REPO, 'training', f'trades_round_{round}_day_{day}_wn.csv')
+    df_prices = timer.time('read_csv', pd.read_csv, prices_path, sep=';')
+    df_trades = timer.time('read_csv', pd.read_csv, trades_path, sep=';', dtype={ 'seller': str, 'buyer': str })
+
+    # the eager loader is only timed, the run uses the lazy store like simulate_alternative
+    timer.time('process_trades', backtester.process_trades, df_trades, backtester.process_prices(df_prices, round, time_limit), time_limit)
+    states = timer.time('process_prices', backtester.process_prices, df_prices, round, time_limit)
+    trade_store = timer.time('load_trades', backtester.load_trades, df_trades, time_limit)
+
+    book = backtester.book_arrays(df_prices)
+    mids_by_time = backtester.mid_table(book, backtester.compute_book_features(book), backtester.SYMBOLS_BY_ROUND_POSITIONABLE[round])
+    ref_symbols = list(states[0].position.keys())
+    max_time = max(states.keys())
+    profits_by_symbol = { 0: dict(zip(ref_symbols, [0.0]*len(ref_symbols))) }
+    balance_by_symbol = { 0: dict(profits_by_symbol[0]) }
+    credit_by_symbol = { 0: dict(profits_by_symbol[0]) }
+    unrealized_by_symbol = { 0: dict(profits_by_symbol[0]) }
+
+    trader = backtester.Trader()
+    trader.run = timer.wrap('trader_run', trader.run)
+    clear_order_book = backtester.clear_order_book
+    backtester.clear_order_book = timer.wrap('clear_order_book', clear_order_book)
+    loop_start = time.perf_counter()
+    try:
+        states, trader, profits_by_symbol, balance_by_symbol = backtester.trades_position_pnl_run(
+            states, max_time, profits_by_symbol, balance_by_symbol, credit_by_symbol, unrealized_by_symbol,
+            trader=trader, round=round, halfway=True, mids_by_time=mids_by_time,
+            restart_at=None, persist_state=False, trade_store=trade_store)
+    finally:
+        backtester.clear_order_book = clear_order_book
+    loop = time.perf_counter() - loop_start
+    timer.seconds['accounting'] = loop - timer.seconds['trader_run'] - timer.seconds['clear_order_book']
+
+    monkey_names = ['Peter', 'Mitch', 'Gary', 'Penelope', 'Omar', 'Camilla', 'Caesar', 'Glulla', 'Mabel', 'Charlie', 'Pablo', 'Olivia', 'Orson', 'Casey', 'George', 'Mya', 'Max', 'Paris', 'Gina', 'Olga']
+    timer.time('monkey_positions', backtester.monkey_positions, monkey_names, states, round, mids_by_time)
+
+    # create_log_file appends to simresults.txt in the working directory, which is a scratch dir here
+    if os.path.exists('simresults.txt'):
+        os.remove('simresults.txt')
+    timer.time('create_log_file', backtester.create_log_file, round, day, states, profits_by_symbol, balance_by_symbol, trader)
+    sys.stdout.flush()
+    timer.time('parse_log', log_parser.parse_log, 'simresults.txt', backtester.SYMBOLS_BY_ROUND[round])
+    return timer.seconds
+
+
+'''
+Benchmarks every stage repeat times over the fixed days.
+Per stage the result has the median and the minimum over the repeats of the summed seconds of all days
+'''
+def run_benchmark(days: list[int] = BENCH_DAYS, repeat: int = 3, time_limit: int = BENCH_TIME_LIMIT) -> dict:
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    backtester = import_backtester()
+    try:
+        samples: dict[str, list[float]] = {stage: [] for stage in STAGES}
+        for _ in range(repeat):
+            totals = {stage: 0.0 for stage in STAGES}
+            for day in days:
+                # in the scratch dir, see create_log_file in bench_day
+                with backtester.quiet(workdir):
+                    for stage, seconds in bench_day(backtester, day, time_limit).items():
+                        totals[stage] += seconds
+            for stage in STAGES:
+                samples[stage].append(totals[stage])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'round': BENCH_ROUND,
+            'days': days,
+            'seed': BENCH_SEED,
+            'time_limit': time_limit,
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+        },
+        'stages': {
+            stage: {'median_s': statistics.median(samples[stage]), 'min_s': min(samples[stage])}
+            for stage in STAGES
+        },
+    }
+
+
+'''
+Compares the medians of a run against a baseline, a stage regresses when it is slower by more than tolerance (relative).
+Stages under 5 ms in both are too noisy to judge and are never flagged
+'''
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> tuple[list[str], list[str]]:
+    lines = [f'{"stage":<20}{"baseline s":>12}{"current s":>12}{"change":>10}']
+    regressions = []
+    for stage in STAGES:
+        current = results['stages'][stage]['median_s']
+        if stage not in baseline['stages']:
+            lines.append(f'{stage:<20}{"-":>12}{current:>12.3f}{"new":>10}')
+            continue
+        before = baseline['stages'][stage]['median_s']
+        change = (current - before) / before if before > 0 else 0.0
+        flag = ''
+        if change > tolerance and max(current, before) >= 0.005:
+            flag = '  REGRESSION'
+            regressions.append(stage)
+        lines.append(f'{stage:<20}{before:>12.3f}{current:>12.3f}{change:>+10.1%}{flag}')
+    return lines, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times every stage of the backtester on fixed training days')
+    parser.add_argument('--days', type=int, nargs='+', default=BENCH_DAYS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--time-limit', type=int, default=BENCH_TIME_LIMIT)
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write this run')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.days, args.repeat, args.time_limit)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+        for stage, timing in results['stages'].items():
+            print(f'{stage:<20}{timing["median_s"]:>12.3f}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta']['days'] != results['meta']['days'] or baseline['meta']['time_limit'] != results['meta']['time_limit']:
+            print('Warning: baseline was taken on different days or time limit')
+        lines, regressions = compare(results, baseline, args.tolerance)
+        print('\n'.join(lines))
+        if regressions:
+            print(f'{len(regressions)} stage(s) regressed by more than {args.tolerance:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+    else:
+        print(f'No baseline at {args.baseline}, run with --save-baseline to create one')
+        for stage, timing in results['stages'].items():
+            print(f'{stage:<20}{timing["median_s"]:>12.3f}')
@@ -0,0 +1,94 @@
+from typing import Dict, List
+import numpy as np
+
+# Every prices file quotes up to three levels per side
+LEVELS = 3
+
+
+'''
+Converts a prices dataframe (one row per timestamp and product) into a columnar book.
+Prices and volumes are (n, LEVELS) float arrays, level 1 being the best quote.
+Missing levels are 0 and ask volumes are positive (unlike OrderDepth.sell_orders)
+'''
+def book_arrays(df_prices) -> Dict[str, np.ndarray]:
+    book = {
+        'timestamp': df_prices['timestamp'].to_numpy(dtype=np.int64),
+        'product': df_prices['product'].to_numpy(dtype=object),
+        'mid_price': df_prices['mid_price'].to_numpy(dtype=np.float64),
+    }
+    for side in ['bid', 'ask']:
+        for field in ['price', 'volume']:
+            columns = [f'{side}_{field}_{level}' for level in range(1, LEVELS + 1)]
+            values = df_prices[columns].to_numpy(dtype=np.float64)
+            book[f'{side}_{field}'] = np.nan_to_num(np.abs(values))
+    return book
+
+
+'''
+Book features over a whole columnar book, the microprice is the one Trader.getMicroprice (main.py) trades on.
+Returns (n,) arrays for the scalar features and (n, LEVELS) arrays for the
+per-level imbalance and cumulative depth. Rows with an empty side get NaN
+for every feature that needs both sides.
+'''
+def compute_book_features(book: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    bid_price, bid_volume = book['bid_price'], book['bid_volume']
+    ask_price, ask_volume = book['ask_price'], book['ask_volume']
+    bid_volume = np.where(bid_price > 0, bid_volume, 0)
+    ask_volume = np.where(ask_price > 0, ask_volume, 0)
+
+    has_bid = (bid_price > 0).any(axis=1)
+    has_ask = (ask_price > 0).any(axis=1)
+    two_sided = has_bid & has_ask
+
+    best_bid = np.where(has_bid, np.where(bid_price > 0, bid_price, -np.inf).max(axis=1), np.nan)
+    best_ask = np.where(has_ask, np.where(ask_price > 0, ask_price, np.inf).min(axis=1), np.nan)
+    best_bid_volume = bid_volume[:, 0]
+    best_ask_volume = ask_volume[:, 0]
+
+    bid_depth = np.cumsum(bid_volume, axis=1)
+    ask_depth = np.cumsum(ask_volume, axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bid_vwap = (bid_price * bid_volume).sum(axis=1) / bid_depth[:, -1]
+        ask_vwap = (ask_price * ask_volume).sum(axis=1) / ask_depth[:, -1]
+        top_volume = best_bid_volume + best_ask_volume
+        microprice = (best_bid * best_ask_volume + best_ask * best_bid_volume) / top_volume
+        imbalance = (bid_depth - ask_depth) / (bid_depth + ask_depth)
+
+    mid = np.where(two_sided, (best_bid + best_ask) / 2, np.nan)
+    return {
+        'best_bid': best_bid,
+        'best_ask': best_ask,
+        'mid': mid,
+        'vwap_mid': np.where(two_sided, (bid_vwap + ask_vwap) / 2, np.nan),
+        'microprice': np.where(two_sided & (top_volume > 0), microprice, mid),
+        'imbalance': np.where(two_sided[:, None], imbalance, np.nan),
+        'bid_depth': bid_depth,
+        'ask_depth': ask_depth,
+    }
+
+
+'''
+Builds the {timestamp: {symbol: mid}} lookup that backtester.calc_mid would produce.
+calc_mid uses the median of the best bid and ask, walking backwards in time when a side
+is empty (forwards at timestamp 0), which is a forward fill (and leading back fill) per symbol
+'''
+def mid_table(book: Dict[str, np.ndarray], features: Dict[str, np.ndarray], symbols: List[str]) -> Dict[int, Dict[str, float]]:
+    timestamps = np.unique(book['timestamp'])
+    table: Dict[int, Dict[str, float]] = {int(time): {} for time in timestamps}
+    for symbol in symbols:
+        rows = book['product'] == symbol
+        if not rows.any():
+            continue
+        times = book['timestamp'][rows]
+        mids = features['mid'][rows]
+        valid = ~np.isnan(mids)
+        if not valid.any():
+            continue
+        # index of the last valid row at or before each row, falling back to the first valid row
+        last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(mids)), -1))
+        last_valid[last_valid < 0] = np.argmax(valid)
+        filled = mids[last_valid]
+        for time, mid in zip(times.tolist(), filled.tolist()):
+            table[time][symbol] = mid
+    return table
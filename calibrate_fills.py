@@ -0,0 +1,100 @@
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from archive_replay import ARCHIVED_LOGS, read_log, realized_pnl, split_days
+from fill_model import FILL_PROFILE_PATH, FillModel
+from tournament import load_trader_module, tolerant_class
+from walk_forward import import_backtester
+
+# the submission that traded each archived log, the realized profit in it is theirs
+SUBMISSION_BY_ROUND = {
+    1: 'archive/Round 1 Submission.py',
+    2: 'archive/Round 2 Submission.py',
+}
+
+DEFAULT_GRID = {
+    'halfway': [True, False],
+    'through': [0.0, 0.5, 1.0, 1.5, 2.0, 3.0],
+    'fraction': [0.25, 0.5, 0.75, 1.0],
+}
+
+
+# every distinct fill model of the grid, through only matters in halfway mode
+def candidates(grid: dict[str, list]) -> list[FillModel]:
+    models = {}
+    for halfway, through, fraction in itertools.product(grid['halfway'], grid['through'], grid['fraction']):
+        model = FillModel(halfway, through if halfway else 0.0, fraction)
+        models[repr(model)] = model
+    return list(models.values())
+
+
+'''
+Backtests the submission on every day of an archived log with the fill model and returns, per product,
+the root mean square difference between the simulated and the reported profit over the day's timestamps
+and the difference of the final profits
+'''
+def divergence(model: FillModel, log_path: str, trader_path: str, round: int, time_limit: int = 999900) -> dict[str, dict[str, float]]:
+    backtester = import_backtester()
+    with backtester.quiet():
+        df_prices, df_trades = read_log(log_path)
+        module = load_trader_module(trader_path)
+        result = {}
+        for day, prices, trades in split_days(df_prices, df_trades):
+            states, trade_store, mids_by_time = backtester.prepare_day(prices, trades, round, time_limit)
+            max_time = max(states)
+            # the archived round 2 submission raises on its first PINA_COLADAS tick, before it has a velocity
+            _, _, profits_by_symbol, balance_by_symbol = backtester.trades_position_pnl_run(
+                states, max_time, *backtester.initial_accounting(states), trader=tolerant_class(module.Trader, {})(), round=round,
+                halfway=model.halfway, mids_by_time=mids_by_time, restart_at=None, persist_state=False, trade_store=trade_store, fill_model=model)
+            for symbol, realized in realized_pnl(prices).items():
+                if symbol not in backtester.SYMBOLS_BY_ROUND_POSITIONABLE[round]:
+                    continue
+                realized = realized[realized.index <= max_time]
+                simulated = np.array([profits_by_symbol[time][symbol] + balance_by_symbol[time][symbol] for time in realized.index])
+                error = simulated - realized.to_numpy(dtype=float)
+                result[f'{day}/{symbol}'] = {'rmse': float(np.sqrt(np.mean(error ** 2))), 'final_error': float(error[-1])}
+        return result
+
+
+'''
+Scores every candidate fill model on every archived log in parallel and returns them best first
+with their mean RMSE over all days and products and the per product breakdown
+'''
+def calibrate(logs: dict[int, tuple[str, str]], grid: dict[str, list] = DEFAULT_GRID, workers: int | None = None,
+              time_limit: int = 999900) -> list[tuple[FillModel, float, dict]]:
+    models = candidates(grid)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {(i, round): pool.submit(divergence, model, log_path, trader_path, round, time_limit)
+                for i, model in enumerate(models) for round, (log_path, trader_path) in logs.items()}
+        scores = {key: job.result() for key, job in jobs.items()}
+
+    ranked = []
+    for i, model in enumerate(models):
+        breakdown = {f'round {round} day {key}': values for round in logs for key, values in scores[(i, round)].items()}
+        ranked.append((model, float(np.mean([values['rmse'] for values in breakdown.values()])), breakdown))
+    ranked.sort(key=lambda item: item[1])
+    return ranked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fits the backtester fill model to the profit the exchange reported in the archived logs')
+    parser.add_argument('--rounds', type=int, nargs='+', default=list(ARCHIVED_LOGS))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--time-limit', type=int, default=999900)
+    parser.add_argument('--output', default=FILL_PROFILE_PATH)
+    args = parser.parse_args()
+
+    logs = {round: (ARCHIVED_LOGS[round], SUBMISSION_BY_ROUND[round]) for round in args.rounds}
+    ranked = calibrate(logs, DEFAULT_GRID, args.workers, args.time_limit)
+    print(f'{"fill model":<60}{"mean rmse":>12}')
+    for model, rmse, _ in ranked[:10]:
+        print(f'{repr(model):<60}{rmse:>12.1f}')
+    best, rmse, breakdown = ranked[0]
+    print('\nBest fit per product:')
+    for key, values in breakdown.items():
+        print(f'    {key:<36}{values["rmse"]:>12.1f} rmse{values["final_error"]:>12.1f} final')
+    best.save(args.output, rmse=rmse, rounds=args.rounds, time_limit=args.time_limit)
+    print(f'Wrote {args.output}')
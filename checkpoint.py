@@ -0,0 +1,150 @@
+import os
+import pickle
+import select
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from walk_forward import import_backtester
+
+
+'''
+Everything a backtest needs to carry on from a timestamp: the states (positions and own trades
+filled in up to it), the trader with its indicators, the four accounting dicts and the day's market data
+'''
+class Checkpoint:
+    def __init__(self, round, day, time, halfway, restart_at, persist_state, states, trader, accounting, trade_store, mids_by_time):
+        self.round = round
+        self.day = day
+        self.time = time
+        self.halfway = halfway
+        self.restart_at = restart_at
+        self.persist_state = persist_state
+        self.states = states
+        self.trader = trader
+        self.accounting = accounting
+        self.trade_store = trade_store
+        self.mids_by_time = mids_by_time
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str) -> 'Checkpoint':
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+'''
+Backtests a day up to (not including) timestamp at and returns the checkpoint there.
+The simulated restart is only applied if it falls before at, the variants resumed from the
+checkpoint get it otherwise
+'''
+def run_to(round: int, day: int, at: int, trader=None, halfway=True, restart_at=None, persist_state=False, time_limit=999900) -> Checkpoint:
+    backtester = import_backtester()
+    with backtester.quiet():
+        states, trade_store, mids_by_time = backtester.load_day(round, day, time_limit)
+        trader = trader if trader is not None else backtester.Trader()
+        accounting = backtester.initial_accounting(states)
+        states, trader, _, _ = backtester.trades_position_pnl_run(
+            states, max(states), *accounting, trader=trader, round=round, halfway=halfway, mids_by_time=mids_by_time,
+            restart_at=restart_at, persist_state=persist_state, trade_store=trade_store, stop_at=at)
+    return Checkpoint(round, day, at, halfway, restart_at, persist_state, states, trader, accounting, trade_store, mids_by_time)
+
+
+'''
+Runs the rest of the day from the checkpoint with params set on the trader and returns the final
+profit per symbol. params become class attributes of a subclass of the checkpointed trader's class, so the
+trader keeps its warmed up indicators and a Trader created by a later restart gets them too.
+Only parameters that make no difference before the checkpoint give the same result as a full run.
+The checkpoint is consumed, pass a copy to resume it twice in the same process
+'''
+def resume(checkpoint: Checkpoint, params: dict | None = None) -> dict[str, float]:
+    backtester = import_backtester()
+    with backtester.quiet():
+        trader = checkpoint.trader
+        if params:
+            trader.__class__ = type('VariantTrader', (type(trader),), dict(params))
+        states = checkpoint.states
+        max_time = max(states)
+        _, _, profits_by_symbol, balance_by_symbol = backtester.trades_position_pnl_run(
+            states, max_time, *checkpoint.accounting, trader=trader, round=checkpoint.round, halfway=checkpoint.halfway,
+            mids_by_time=checkpoint.mids_by_time, restart_at=checkpoint.restart_at, persist_state=checkpoint.persist_state,
+            trade_store=checkpoint.trade_store, start_at=checkpoint.time)
+    return backtester.final_profits(profits_by_symbol, balance_by_symbol, checkpoint.round, max_time)
+
+
+def resume_pickled(data: bytes, params: dict) -> dict[str, float]:
+    return resume(pickle.loads(data), params)
+
+
+# resumes in a forked child and sends the result back through a pipe, the checkpoint is shared copy on write
+def fork_resume(checkpoint: Checkpoint, params: dict) -> tuple[int, int]:
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            payload = pickle.dumps((True, resume(checkpoint, params)))
+        except BaseException as e:
+            payload = pickle.dumps((False, repr(e)))
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(payload)
+        os._exit(0)
+    os.close(write_fd)
+    return pid, read_fd
+
+
+'''
+Resumes one copy of the checkpoint per parameter set, at most workers at a time, and returns their final profits
+in the same order. With os.fork every variant runs in a fresh child of this process that shares the checkpoint
+without copying it, elsewhere the checkpoint is pickled once and sent to a process pool
+'''
+def fork_variants(checkpoint: Checkpoint, variants: list[dict], workers: int | None = None) -> list[dict[str, float]]:
+    workers = workers or os.cpu_count() or 1
+    if not hasattr(os, 'fork'):
+        data = pickle.dumps(checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(resume_pickled, [data] * len(variants), variants))
+
+    sys.stdout.flush()
+    results: list = [None] * len(variants)
+    pending = list(enumerate(variants))
+    running: dict[int, tuple[int, int, bytearray]] = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            index, params = pending.pop(0)
+            pid, read_fd = fork_resume(checkpoint, params)
+            running[read_fd] = (pid, index, bytearray())
+        # a child blocks on a full pipe until it is read, so read as it comes and only wait for a child at its EOF
+        ready, _, _ = select.select(list(running), [], [])
+        for read_fd in ready:
+            pid, index, payload = running[read_fd]
+            chunk = os.read(read_fd, 1 << 16)
+            if chunk:
+                payload += chunk
+                continue
+            del running[read_fd]
+            os.close(read_fd)
+            os.waitpid(pid, 0)
+            ok, result = pickle.loads(payload) if payload else (False, 'child exited without a result')
+            if not ok:
+                raise RuntimeError(f'Variant {variants[index]} failed: {result}')
+            results[index] = result
+    return results
+
+
+'''
+Runs every variant from the shared warm up: one backtest up to at, then only the rest of the day per variant
+'''
+def sweep_from(round: int, day: int, at: int, variants: list[dict], workers: int | None = None, **kwargs) -> list[dict[str, float]]:
+    return fork_variants(run_to(round, day, at, **kwargs), variants, workers)
+
+
+if __name__ == "__main__":
+    import time
+    variants = [{'coconutsBuyBelow': value} for value in [7890, 7910, 7930]]
+    start = time.time()
+    for variant, profits in zip(variants, sweep_from(2, 0, 500000, variants)):
+        print(variant, profits)
+    print(f'{time.time() - start:.1f} s for {len(variants)} variants from a checkpoint at 500000')
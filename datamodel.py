@@ -1,4 +1,6 @@
 import json
+import struct
+from numbers import Integral
 from typing import Dict, List
 from json import JSONEncoder
 
@@ -9,13 +11,23 @@ Position = int
 UserId = str
 Observation = int
 
+def attributes(o) -> dict:
+    # the small datamodel classes use __slots__ and have no __dict__
+    if hasattr(o, '__dict__'):
+        return o.__dict__
+    return {name: getattr(o, name) for name in o.__slots__}
+
 class Listing:
+    __slots__ = ['symbol', 'product', 'denomination']
+
     def __init__(self, symbol: Symbol, product: Product, denomination: Product):
         self.symbol = symbol
         self.product = product
         self.denomination = denomination
 
 class Order:
+    __slots__ = ['symbol', 'price', 'quantity']
+
     def __init__(self, symbol: Symbol, price: int, quantity: int) -> None:
         self.symbol = symbol
         self.price = price
@@ -29,11 +41,15 @@ class Order:
     
 
 class OrderDepth:
+    __slots__ = ['buy_orders', 'sell_orders']
+
     def __init__(self):
         self.buy_orders: Dict[int, int] = {}
         self.sell_orders: Dict[int, int] = {}
 
 class Trade:
+    __slots__ = ['symbol', 'price', 'quantity', 'buyer', 'seller', 'timestamp']
+
     def __init__(self, symbol: Symbol, price: int, quantity: int, buyer: UserId = None, seller: UserId = None, timestamp: int = 0) -> None: # type: ignore
         self.symbol = symbol
         self.price: int = price
@@ -50,7 +66,8 @@ class TradingState(object):
                  own_trades: Dict[Symbol, List[Trade]],
                  market_trades: Dict[Symbol, List[Trade]],
                  position: Dict[Product, Position],
-                 observations: Dict[Product, Observation]):
+                 observations: Dict[Product, Observation],
+                 traderData: str = ""):
         self.timestamp = timestamp
         self.listings = listings
         self.order_depths = order_depths
@@ -58,10 +75,282 @@ class TradingState(object):
         self.market_trades = market_trades
         self.position = position
         self.observations = observations
+        self.traderData = traderData
         
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True)
+        return json.dumps(self, default=attributes, sort_keys=True)
     
 class ProsperityEncoder(JSONEncoder):
         def default(self, o):
-            return o.__dict__
+            return attributes(o)
+
+
+# ----- compact serialization -----
+# Schema aware, positional encoding of the objects above. Much smaller and faster than
+# toJSON/ProsperityEncoder, which write every attribute name of every object on every tick.
+#
+# JSON layout of a state (all lists, no keys except symbols):
+#   [timestamp, listings, order_depths, own_trades, market_trades, position, observations, traderData]
+#   listings:     [[symbol, product, denomination], ...]
+#   order_depths: {symbol: [bid_prices, bid_volumes, ask_prices, ask_volumes]}
+#   trades:       {symbol: [[price, quantity, buyer, seller, timestamp], ...]}
+# Orders are {symbol: [[price, quantity], ...]}.
+
+STATE_FORMAT_VERSION = 1
+
+def _plain_number(o):
+    # numpy scalars from the pandas loaders
+    if hasattr(o, 'item'):
+        return o.item()
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+def encode_state(state: TradingState) -> str:
+    depths = {}
+    for symbol, depth in state.order_depths.items():
+        depths[symbol] = [list(depth.buy_orders.keys()), list(depth.buy_orders.values()),
+                          list(depth.sell_orders.keys()), list(depth.sell_orders.values())]
+    return json.dumps([
+        state.timestamp,
+        [[l.symbol, l.product, l.denomination] for l in state.listings.values()],
+        depths,
+        _encode_trades(state.own_trades),
+        _encode_trades(state.market_trades),
+        state.position,
+        state.observations,
+        getattr(state, 'traderData', ''),
+    ], separators=(',', ':'), default=_plain_number)
+
+def decode_state(data: str) -> TradingState:
+    timestamp, listings, depths, own_trades, market_trades, position, observations, traderData = json.loads(data)
+    order_depths = {}
+    for symbol, (bid_prices, bid_volumes, ask_prices, ask_volumes) in depths.items():
+        depth = OrderDepth()
+        depth.buy_orders = dict(zip(bid_prices, bid_volumes))
+        depth.sell_orders = dict(zip(ask_prices, ask_volumes))
+        order_depths[symbol] = depth
+    return TradingState(
+        timestamp,
+        {l[0]: Listing(l[0], l[1], l[2]) for l in listings},
+        order_depths,
+        _decode_trades(own_trades),
+        _decode_trades(market_trades),
+        position,
+        observations,
+        traderData)
+
+def encode_orders(orders: Dict[Symbol, List[Order]]) -> str:
+    return json.dumps({symbol: [[o.price, o.quantity] for o in symbol_orders] for symbol, symbol_orders in orders.items()}, separators=(',', ':'), default=_plain_number)
+
+def decode_orders(data: str) -> Dict[Symbol, List[Order]]:
+    return {symbol: [Order(symbol, price, quantity) for price, quantity in symbol_orders] for symbol, symbol_orders in json.loads(data).items()}
+
+def _encode_trades(trades: Dict[Symbol, List[Trade]]) -> Dict[Symbol, list]:
+    return {symbol: [[t.price, t.quantity, t.buyer, t.seller, t.timestamp] for t in symbol_trades] for symbol, symbol_trades in trades.items()}
+
+def _decode_trades(trades: Dict[Symbol, list]) -> Dict[Symbol, List[Trade]]:
+    return {symbol: [Trade(symbol, *t) for t in symbol_trades] for symbol, symbol_trades in trades.items()}
+
+
+# Binary layout, little endian, every string is an index into a table at the start.
+# Everything is stored column-wise so each block is a single struct call:
+#   b'TS' version:B timestamp:q
+#   strings:      H count, H lengths, utf8 bytes
+#   listings:     H count, symbol indices, product indices, denomination indices
+#   depths:       H count, symbol indices, then a bid and an ask column pair per symbol
+#   trades:       (own then market) H symbols, symbol indices, I counts, then per symbol
+#                 with trades a price/quantity column pair, buyer indices, seller indices, timestamps:q
+#   position:     H count, symbol indices, quantities:i
+#   observations: H count, symbol indices, one value column
+#   traderData:   I length, utf8 bytes
+# A column pair is B kind, H n, n prices, n volumes:i. A number column has kind 0 for int32,
+# 1 for doubles, or 2 for doubles followed by one byte per value flagging the ints,
+# so ints and floats come back as they went in.
+# Orders are b'TO' version:B, strings, H symbols, symbol indices, then a price/quantity pair per symbol.
+
+_NO_STRING = 0xFFFF
+
+class _StringTable:
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+
+    def __call__(self, value) -> int:
+        if value is None:
+            return _NO_STRING
+        index = self.index.get(value)
+        if index is None:
+            index = self.index[value] = len(self.index)
+        return index
+
+    def pack(self) -> bytes:
+        encoded = [value.encode() for value in self.index]
+        return struct.pack(f'<H{len(encoded)}H', len(encoded), *map(len, encoded)) + b''.join(encoded)
+
+_IS_INT_TYPE: Dict[type, bool] = {}
+
+def _is_int(value) -> bool:
+    # Integral is an ABC, isinstance against it is slow enough to matter here
+    t = type(value)
+    is_int = _IS_INT_TYPE.get(t)
+    if is_int is None:
+        is_int = _IS_INT_TYPE[t] = issubclass(t, Integral)
+    return is_int
+
+def _number_kind(values) -> int:
+    types = {type(v) for v in values}
+    if len(types) == 1:
+        return 0 if _is_int(values[0]) else 1
+    ints = [_is_int(v) for v in values]
+    return 0 if all(ints) else 1 if not any(ints) else 2
+
+def _pack_numbers(values, then: str = '', rest = ()) -> bytes:
+    kind = _number_kind(values)
+    n = len(values)
+    packed = struct.pack(f'<BH{n}{"idd"[kind]}{then}', kind, n, *values, *rest)
+    if kind == 2: # mixed, remember which values were ints
+        packed += bytes(_is_int(v) for v in values)
+    return packed
+
+def _pack_side(prices, volumes) -> bytes:
+    return _pack_numbers(prices, f'{len(volumes)}i', volumes)
+
+def _pack_trades(trades: Dict[Symbol, List[Trade]], strings: _StringTable) -> bytes:
+    parts = [struct.pack(f'<H{len(trades)}H{len(trades)}I', len(trades), *map(strings, trades.keys()), *map(len, trades.values()))]
+    for symbol_trades in trades.values():
+        n = len(symbol_trades)
+        if n == 0:
+            continue
+        parts.append(_pack_side([t.price for t in symbol_trades], [t.quantity for t in symbol_trades]))
+        parts.append(struct.pack(f'<{n}H{n}H{n}q', *[strings(t.buyer) for t in symbol_trades], *[strings(t.seller) for t in symbol_trades], *[t.timestamp for t in symbol_trades]))
+    return b''.join(parts)
+
+def encode_state_binary(state: TradingState) -> bytes:
+    strings = _StringTable()
+    listings = list(state.listings.values())
+    n = len(listings)
+    body = [struct.pack(f'<H{3 * n}H', n, *[strings(l.symbol) for l in listings], *[strings(l.product) for l in listings], *[strings(l.denomination) for l in listings])]
+
+    n = len(state.order_depths)
+    body.append(struct.pack(f'<H{n}H', n, *map(strings, state.order_depths.keys())))
+    for depth in state.order_depths.values():
+        body.append(_pack_side(list(depth.buy_orders.keys()), list(depth.buy_orders.values())))
+        body.append(_pack_side(list(depth.sell_orders.keys()), list(depth.sell_orders.values())))
+
+    body.append(_pack_trades(state.own_trades, strings))
+    body.append(_pack_trades(state.market_trades, strings))
+
+    n = len(state.position)
+    body.append(struct.pack(f'<H{n}H{n}i', n, *map(strings, state.position.keys()), *state.position.values()))
+
+    n = len(state.observations)
+    body.append(struct.pack(f'<H{n}H', n, *map(strings, state.observations.keys())))
+    body.append(_pack_numbers(list(state.observations.values())))
+
+    trader_data = getattr(state, 'traderData', '').encode()
+    body.append(struct.pack('<I', len(trader_data)))
+    body.append(trader_data)
+    return b'TS' + struct.pack('<Bq', STATE_FORMAT_VERSION, state.timestamp) + strings.pack() + b''.join(body)
+
+class _Reader:
+    def __init__(self, data: bytes, magic: bytes):
+        if data[:2] != magic or data[2] != STATE_FORMAT_VERSION:
+            raise ValueError(f'not a version {STATE_FORMAT_VERSION} {magic.decode()} record')
+        self.data = data
+        self.offset = 3
+        self.strings: List[str | None] = []
+
+    def read(self, fmt: str):
+        values = struct.unpack_from('<' + fmt, self.data, self.offset)
+        self.offset += struct.calcsize('<' + fmt)
+        return values
+
+    def read_strings(self):
+        n = self.read('H')[0]
+        for length in self.read(f'{n}H'):
+            self.strings.append(self.data[self.offset:self.offset + length].decode())
+            self.offset += length
+
+    def symbols(self) -> List[str]:
+        n = self.read('H')[0]
+        return self.names(n)
+
+    def names(self, n: int) -> List[str | None]:
+        return [None if i == _NO_STRING else self.strings[i] for i in self.read(f'{n}H')]
+
+    def numbers(self, then: str = '') -> tuple:
+        kind, n = self.read('BH')
+        values = self.read(f'{n}{"idd"[kind]}{then.format(n=n)}')
+        numbers = list(values[:n])
+        if kind == 2:
+            for i, was_int in enumerate(self.data[self.offset:self.offset + n]):
+                if was_int:
+                    numbers[i] = int(numbers[i])
+            self.offset += n
+        return numbers, values[n:]
+
+    def side_lists(self):
+        return self.numbers('{n}i')
+
+    def side(self) -> Dict[int, int]:
+        return dict(zip(*self.side_lists()))
+
+    def trades(self) -> Dict[Symbol, List[Trade]]:
+        n = self.read('H')[0]
+        symbols = self.names(n)
+        counts = self.read(f'{n}I')
+        trades = {}
+        for symbol, count in zip(symbols, counts):
+            if count == 0:
+                trades[symbol] = []
+                continue
+            prices, quantities = self.side_lists()
+            buyers = self.names(count)
+            sellers = self.names(count)
+            timestamps = self.read(f'{count}q')
+            trades[symbol] = [Trade(symbol, *t) for t in zip(prices, quantities, buyers, sellers, timestamps)]
+        return trades
+
+def decode_state_binary(data: bytes) -> TradingState:
+    r = _Reader(data, b'TS')
+    timestamp = r.read('q')[0]
+    r.read_strings()
+
+    n = r.read('H')[0]
+    columns = r.names(3 * n)
+    listings = {symbol: Listing(symbol, product, denomination) for symbol, product, denomination in zip(columns[:n], columns[n:2 * n], columns[2 * n:])}
+
+    order_depths = {}
+    for symbol in r.symbols():
+        depth = OrderDepth()
+        depth.buy_orders = r.side()
+        depth.sell_orders = r.side()
+        order_depths[symbol] = depth
+
+    own_trades = r.trades()
+    market_trades = r.trades()
+
+    n = r.read('H')[0]
+    symbols = r.names(n)
+    position = dict(zip(symbols, r.read(f'{n}i')))
+
+    symbols = r.symbols()
+    observations = dict(zip(symbols, r.numbers()[0]))
+
+    length = r.read('I')[0]
+    trader_data = r.data[r.offset:r.offset + length].decode()
+    return TradingState(timestamp, listings, order_depths, own_trades, market_trades, position, observations, trader_data)
+
+def encode_orders_binary(orders: Dict[Symbol, List[Order]]) -> bytes:
+    strings = _StringTable()
+    n = len(orders)
+    body = [struct.pack(f'<H{n}H', n, *map(strings, orders.keys()))]
+    for symbol_orders in orders.values():
+        body.append(_pack_side([o.price for o in symbol_orders], [o.quantity for o in symbol_orders]))
+    return b'TO' + struct.pack('<B', STATE_FORMAT_VERSION) + strings.pack() + b''.join(body)
+
+def decode_orders_binary(data: bytes) -> Dict[Symbol, List[Order]]:
+    r = _Reader(data, b'TO')
+    r.read_strings()
+    orders = {}
+    for symbol in r.symbols():
+        orders[symbol] = [Order(symbol, price, quantity) for price, quantity in zip(*r.side_lists())]
+    return orders
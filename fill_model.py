@@ -0,0 +1,44 @@
+import json
+import os
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+FILL_PROFILE_PATH = os.path.join(REPO, 'fill_profile.json')
+
+
+'''
+How clear_order_book decides which of our orders fill and for how much.
+halfway fills an order that reaches through past the mid (0 is the original halfway rule, any order
+at or beyond the mid fills), otherwise an order only fills at a price that is in the book.
+fraction is the share of the order's volume that fills, rounded towards zero
+'''
+class FillModel:
+    def __init__(self, halfway: bool = True, through: float = 0.0, fraction: float = 1.0):
+        self.halfway = halfway
+        self.through = through
+        self.fraction = fraction
+
+    def __repr__(self) -> str:
+        return f'FillModel(halfway={self.halfway}, through={self.through}, fraction={self.fraction})'
+
+    def params(self) -> dict:
+        return {'halfway': self.halfway, 'through': self.through, 'fraction': self.fraction}
+
+    # whether a buy (quantity > 0) or sell at price fills against a book with this mid in halfway mode
+    def crosses(self, price: float, quantity: int, mid: float) -> bool:
+        if quantity > 0:
+            return price >= mid + self.through
+        return price <= mid - self.through
+
+    def filled(self, quantity: int) -> int:
+        return int(quantity * self.fraction)
+
+    def save(self, path: str = FILL_PROFILE_PATH, **fit):
+        with open(path, 'w') as f:
+            json.dump({**self.params(), **fit}, f, indent=2)
+
+    # a profile written by save, the fit statistics next to the parameters are ignored
+    @staticmethod
+    def load(path: str = FILL_PROFILE_PATH) -> 'FillModel':
+        with open(path) as f:
+            profile = json.load(f)
+        return FillModel(profile['halfway'], profile['through'], profile['fraction'])
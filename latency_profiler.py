@@ -0,0 +1,167 @@
+import gc
+import time
+
+# methods that get timed: Trader.run plus every product handler
+PROFILED_PREFIXES = ('handle', 'tradeStrategy')
+
+'''
+Log-linear histogram of non negative integers (nanoseconds here), 16 buckets per power of two,
+so any percentile is within about 3% of the true value while recording stays O(1)
+'''
+class Histogram:
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        if value < 2 * self.SUB_BUCKETS:
+            index = value
+        else:
+            shift = value.bit_length() - 5
+            index = shift * self.SUB_BUCKETS + (value >> shift)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def bucket_range(self, index: int) -> tuple[int, int]:
+        if index < 2 * self.SUB_BUCKETS:
+            return index, index + 1
+        shift = index // self.SUB_BUCKETS - 1
+        low = (index - shift * self.SUB_BUCKETS) << shift
+        return low, low + (1 << shift)
+
+    def percentile(self, q: float) -> float:
+        if self.count == 0:
+            return 0
+        target = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                low, high = self.bucket_range(index)
+                return min((low + high) / 2, self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+
+'''
+Wraps Trader.run and the product handlers of a trader instance and records, per call,
+the wall time and the number of container objects (lists, dicts, Orders...) it allocated
+net of the ones it freed, read from the gc generation 0 counter. Calls during which the
+collector ran reset that counter and only get their time recorded.
+Overhead is around a microsecond per call, so it can stay on for every backtest
+'''
+class LatencyProfiler:
+    def __init__(self, trader=None, prefixes=PROFILED_PREFIXES):
+        self.prefixes = prefixes
+        self.times: dict[str, Histogram] = {}
+        self.allocations: dict[str, Histogram] = {}
+        if trader is not None:
+            self.attach(trader)
+
+    '''
+    Instruments a trader instance, call again with the new instance after a simulated restart.
+    The wrappers live on the instance, the class is not touched
+    '''
+    def attach(self, trader):
+        names = ['run'] + [name for name in dir(type(trader)) if name.startswith(self.prefixes)]
+        for name in names:
+            method = getattr(trader, name, None)
+            if callable(method) and not hasattr(method, 'profiled'):
+                setattr(trader, name, self.wrap(name, method))
+
+    def wrap(self, name: str, method):
+        times = self.times.setdefault(name, Histogram())
+        allocations = self.allocations.setdefault(name, Histogram())
+        clock = time.perf_counter_ns
+        allocated = gc.get_count
+
+        def profiled(*args, **kwargs):
+            allocated_before = allocated()[0]
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                times.record(clock() - start)
+                delta = allocated()[0] - allocated_before
+                if delta >= 0:
+                    allocations.record(delta)
+        profiled.profiled = True
+        return profiled
+
+    # per method: calls, mean, p50, p99 and max in milliseconds, mean and p99 of the allocated objects
+    def summary(self) -> dict[str, dict[str, float]]:
+        summary = {}
+        for name, times in self.times.items():
+            if times.count == 0:
+                continue
+            summary[name] = {
+                'calls': times.count,
+                'mean_ms': times.mean() / 1e6,
+                'p50_ms': times.percentile(50) / 1e6,
+                'p99_ms': times.percentile(99) / 1e6,
+                'max_ms': times.max / 1e6,
+                'mean_allocations': self.allocations[name].mean(),
+                'p99_allocations': self.allocations[name].percentile(99),
+            }
+        return summary
+
+    def report(self) -> str:
+        lines = [f'{"method":<30}{"calls":>8}{"p50 ms":>10}{"p99 ms":>10}{"max ms":>10}{"allocs":>9}{"p99 allocs":>12}']
+        summary = self.summary()
+        # run first, then the handlers from most to least expensive
+        for name in sorted(summary, key=lambda n: (n != 'run', -summary[n]['p99_ms'])):
+            s = summary[name]
+            lines.append(f'{name:<30}{s["calls"]:>8}{s["p50_ms"]:>10.3f}{s["p99_ms"]:>10.3f}{s["max_ms"]:>10.3f}{s["mean_allocations"]:>9.1f}{s["p99_allocations"]:>12.0f}')
+        return '\n'.join(lines)
+
+
+'''
+Per call time limit of the exchange. A run that takes longer than budget_ms is a missed tick:
+its orders never reach the book. With kill_on_overrun the first overrun fails the whole
+submission and the trader sends nothing for the rest of the day, positions are still marked to the end
+'''
+class TimeBudget:
+    # the exchange stops waiting for Trader.run after 900 ms
+    EXCHANGE_LIMIT_MS = 900
+
+    def __init__(self, budget_ms: float = EXCHANGE_LIMIT_MS, kill_on_overrun=False):
+        self.budget_ms = budget_ms
+        self.kill_on_overrun = kill_on_overrun
+        self.calls = 0
+        self.missed_ticks: list[int] = []
+        self.killed_at: int | None = None
+        self.slowest_ms = 0.0
+
+    @property
+    def killed(self) -> bool:
+        return self.killed_at is not None
+
+    # records one run call, returns whether its orders count
+    def check(self, timestamp: int, elapsed_ms: float) -> bool:
+        self.calls += 1
+        self.slowest_ms = max(self.slowest_ms, elapsed_ms)
+        if elapsed_ms <= self.budget_ms:
+            return True
+        self.missed_ticks.append(timestamp)
+        if self.kill_on_overrun:
+            self.killed_at = timestamp
+        return False
+
+    def report(self) -> str:
+        lines = [f'Missed {len(self.missed_ticks)} of {self.calls} ticks over the {self.budget_ms} ms budget (slowest call {self.slowest_ms:.1f} ms)']
+        if self.missed_ticks:
+            lines.append(f'First missed ticks: {self.missed_ticks[:10]}')
+        if self.killed:
+            lines.append(f'Submission killed at {self.killed_at}, no orders were sent afterwards')
+        return '\n'.join(lines)
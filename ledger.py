@@ -0,0 +1,141 @@
+from array import array
+
+import numpy as np
+
+from analytics import Trace
+
+MODES = ['fifo', 'average']
+
+# consumed FIFO lots are dropped from the front of the arrays once there are this many
+COMPACT_AFTER = 1024
+
+
+'''
+Lot based trade ledger. Every fill closes open lots of the opposite side, oldest first in fifo mode or at the
+average cost of the position in average mode, realizing (fill price - lot price) per unit closed; what is left
+opens a new lot. Open lots live in flat arrays per symbol and each fill appends one event (time, realized so far,
+position and cost of the open lots after it), so recording costs O(fills) and the per tick curves are a
+vectorized forward fill of the events
+'''
+class Ledger:
+    def __init__(self, symbols: list[str], mode: str = 'fifo'):
+        if mode not in MODES:
+            raise ValueError(f'Unknown ledger mode {mode}, expected one of {MODES}')
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.mode = mode
+        self.lot_quantities = [array('d') for _ in self.symbols]
+        self.lot_prices = [array('d') for _ in self.symbols]
+        self.heads = [0] * len(self.symbols)
+        self.positions = [0.0] * len(self.symbols)
+        self.open_costs = [0.0] * len(self.symbols)
+        self.realized = [0.0] * len(self.symbols)
+        self.event_times = array('q')
+        self.event_symbols = array('h')
+        self.event_realized = array('d')
+        self.event_positions = array('d')
+        self.event_costs = array('d')
+
+    def fill(self, time: int, symbol: str, price: float, quantity: float):
+        i = self.index[symbol]
+        if self.mode == 'fifo':
+            self.fill_fifo(i, price, quantity)
+        else:
+            self.fill_average(i, price, quantity)
+        self.positions[i] += quantity
+        self.event_times.append(time)
+        self.event_symbols.append(i)
+        self.event_realized.append(self.realized[i])
+        self.event_positions.append(self.positions[i])
+        self.event_costs.append(self.open_costs[i])
+
+    def fill_fifo(self, i: int, price: float, quantity: float):
+        quantities, prices = self.lot_quantities[i], self.lot_prices[i]
+        head = self.heads[i]
+        remaining = quantity
+        while remaining != 0 and head < len(quantities) and quantities[head] * remaining < 0:
+            # the part of the oldest lot this fill closes, with the lot's sign
+            closed = min(abs(remaining), abs(quantities[head])) * (1 if quantities[head] > 0 else -1)
+            self.realized[i] += closed * (price - prices[head])
+            self.open_costs[i] -= closed * prices[head]
+            quantities[head] -= closed
+            remaining += closed
+            if quantities[head] == 0:
+                head += 1
+        if remaining != 0:
+            quantities.append(remaining)
+            prices.append(price)
+            self.open_costs[i] += remaining * price
+        if head >= COMPACT_AFTER:
+            del quantities[:head]
+            del prices[:head]
+            head = 0
+        self.heads[i] = head
+
+    def fill_average(self, i: int, price: float, quantity: float):
+        position = self.positions[i]
+        if position * quantity >= 0:
+            self.open_costs[i] += quantity * price
+            return
+        average = self.open_costs[i] / position
+        closed = min(abs(quantity), abs(position)) * (1 if position > 0 else -1)
+        self.realized[i] += closed * (price - average)
+        self.open_costs[i] -= closed * average
+        rest = quantity + closed
+        if rest != 0:
+            # the fill flipped the position, what is left opens at the fill price
+            self.open_costs[i] = rest * price
+
+    '''
+    (ticks, symbols) arrays of realized and unrealized profit at every one of times, the unrealized part being
+    the open lots marked at mids (a (ticks, symbols) array, for instance the trace's)
+    '''
+    def curves(self, times, mids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        times = np.asarray(times)
+        event_times = np.frombuffer(self.event_times, dtype=np.int64) if len(self.event_times) else np.zeros(0, dtype=np.int64)
+        event_symbols = np.frombuffer(self.event_symbols, dtype=np.int16) if len(self.event_symbols) else np.zeros(0, dtype=np.int16)
+        event_realized = np.frombuffer(self.event_realized) if len(self.event_realized) else np.zeros(0)
+        event_positions = np.frombuffer(self.event_positions) if len(self.event_positions) else np.zeros(0)
+        event_costs = np.frombuffer(self.event_costs) if len(self.event_costs) else np.zeros(0)
+
+        realized = np.zeros((len(times), len(self.symbols)))
+        positions = np.zeros((len(times), len(self.symbols)))
+        costs = np.zeros((len(times), len(self.symbols)))
+        for i in range(len(self.symbols)):
+            mask = event_symbols == i
+            if not mask.any():
+                continue
+            # the last event at or before every tick, -1 before the first fill
+            last = np.searchsorted(event_times[mask], times, side='right') - 1
+            seen = last >= 0
+            realized[seen, i] = event_realized[mask][last[seen]]
+            positions[seen, i] = event_positions[mask][last[seen]]
+            costs[seen, i] = event_costs[mask][last[seen]]
+        return realized, positions * mids - costs
+
+    # per symbol: realized, unrealized at the given mids, open position and its average cost
+    def summary(self, mids: dict[str, float]) -> dict[str, dict[str, float]]:
+        return {symbol: {
+            'realized': self.realized[i],
+            'unrealized': self.positions[i] * mids[symbol] - self.open_costs[i],
+            'position': self.positions[i],
+            'average_cost': self.open_costs[i] / self.positions[i] if self.positions[i] else 0.0,
+        } for i, symbol in enumerate(self.symbols)}
+
+    @staticmethod
+    def from_trace(trace: Trace, mode: str = 'fifo') -> 'Ledger':
+        ledger = Ledger(trace.symbols, mode)
+        for tick, symbol, price, quantity, _ in trace.fills:
+            ledger.fill(trace.times[tick], trace.symbols[symbol], price, quantity)
+        return ledger
+
+
+def report(ledgers: dict[str, Ledger], mids: dict[str, float]) -> str:
+    lines = [f'{"product":<16}' + ''.join(f'{mode + " realized":>18}{mode + " unrealized":>20}' for mode in ledgers) + f'{"position":>10}']
+    summaries = {mode: ledger.summary(mids) for mode, ledger in ledgers.items()}
+    for symbol in next(iter(ledgers.values())).symbols:
+        line = f'{symbol:<16}'
+        for mode in ledgers:
+            line += f'{summaries[mode][symbol]["realized"]:>18.0f}{summaries[mode][symbol]["unrealized"]:>20.0f}'
+        lines.append(line + f'{summaries[mode][symbol]["position"]:>10.0f}')
+    return '\n'.join(lines)
@@ -0,0 +1,235 @@
+import base64
+import gzip
+import re
+import struct
+
+products = ['PEARLS', 'BANANAS', 'COCONUTS', 'PINA_COLADAS', 'DIVING_GEAR', 'BERRIES', 'DOLPHIN_SIGHTINGS', 'BAGUETTE', 'DIP', 'UKULELE', 'PICNIC_BASKET']
+
+common_customs = ["shortMa", "longMa", "ultraLongMa", "shortVel", "longVel", "ultraLongVel", "shortAcc", "longAcc", "ultraLongAcc", "volume"]
+
+productToCustomSeries = {
+    "PEARLS": common_customs + ["CUSTOM1", "CUSTOM2", "CUSTOM3", "CUSTOM4", "CUSTOM5"],
+    "BANANAS": common_customs + ["buyPrice", "sellPrice"],
+    "PINA_COLADAS": common_customs + ["PC NPrice", "Coconut NPrice", "Ratio", "+t", "-t", "versusAcc"],
+    "COCONUTS": common_customs + ["rsi", "rstatus"],
+    "BERRIES": common_customs + ["buyPrice", "sellPrice", "Diff"],
+    "DOLPHIN_SIGHTINGS": common_customs + ["trend0", "trend1", "trend2", "dolphinDays", "gearDays", "prediction"],
+    "DIVING_GEAR": common_customs + ["ultraLongTrend", "sellPrice", "buyPrice", "longTrend", "sd", "sdsAway"] ,
+    "DIP": common_customs + ["rsi", "rstatus"],
+    "BAGUETTE": common_customs + ["rsi", "rstatus"],
+    "UKULELE": common_customs + ["rsi", "overallVel", "bandVel", "upperPrice", "lowerPrice", "bbb"],
+    "PICNIC_BASKET": common_customs + ["rsi", "rstatus"],
+}
+
+#TIMESTAMP, PRODUCT, POSITION, BID, PRICE, ASK, shortMa, longMa, ultraLongMa, shortVel, longVel, ultraLongVel, shortAcc, longAcc, ultraLongAcc, custom1, custom2, custom3, custom4, custom5
+#day;timestamp;product;bid_price_1;bid_volume_1;bid_price_2;bid_volume_2;bid_price_3;bid_volume_3;ask_price_1;ask_volume_1;ask_price_2;ask_volume_2;ask_price_3;ask_volume_3;mid_price;profit_and_loss
+
+# lines printed by Trader.flushCompactLog, keyframes carry the product names and field scales the others use
+COMPACT_LOG_PATTERN = re.compile(r'CLOG1:([A-Za-z0-9+/=]+)')
+
+
+def readVarint(data: bytes, offset: int) -> tuple[int, int]:
+    n = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        n |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return n, offset
+
+# the product names of a keyframe: their count, then each one's length and ascii bytes
+def readSchema(data: bytes, offset: int) -> tuple[list[str], int]:
+    count, offset = readVarint(data, offset)
+    names = []
+    for _ in range(count):
+        length, offset = readVarint(data, offset)
+        names.append(data[offset:offset + length].decode('ascii'))
+        offset += length
+    return names, offset
+
+def unzigzag(n: int) -> int:
+    return n // 2 if n % 2 == 0 else -(n + 1) // 2
+
+
+'''
+Decoder of the compact log lines, fed every line in order. It keeps the scaled values last sent per product
+like the trader does and skips the lines after a missing or truncated one until the next keyframe.
+Product numbers and field scales come from the keyframes, so the tables cannot drift from the trader's
+'''
+class CompactLogDecoder:
+    def __init__(self):
+        self.last: dict[str, list[int]] = {}
+        self.lineNumber: int | None = None
+        self.skipped = 0
+        self.products: list[str] = []
+        self.scales: list[int] = []
+
+    # (timestamp, product, values) per product in the line, values in writeLog's order: position, bid, mid, ask and the customs
+    def feed(self, line: str) -> list[tuple[int, str, list[float]]]:
+        match = COMPACT_LOG_PATTERN.search(line)
+        if not match:
+            return []
+        try:
+            data = base64.b64decode(match.group(1))
+            keyframe, lineNumber = data[0] & 1, data[1]
+            offset = 2
+            if keyframe:
+                self.last = {}
+                self.products, offset = readSchema(data, offset)
+                scales, offset = readVarint(data, offset)
+                self.scales = []
+                for _ in range(scales):
+                    scale, offset = readVarint(data, offset)
+                    self.scales.append(scale)
+            elif self.lineNumber is None or lineNumber != (self.lineNumber + 1) % 256:
+                self.lineNumber = None
+                self.skipped += 1
+                return []
+            timestamp, offset = readVarint(data, offset)
+            mask, offset = readVarint(data, offset)
+            rows = []
+            for index, product in enumerate(self.products):
+                if not mask >> index & 1:
+                    continue
+                changed, offset = readVarint(data, offset)
+                raw, offset = readVarint(data, offset)
+                scaled = self.last.get(product, [0] * len(self.scales))
+                values = [0.0] * len(self.scales)
+                for i, scale in enumerate(self.scales):
+                    if raw >> i & 1:
+                        values[i] = struct.unpack_from('<d', data, offset)[0]
+                        offset += 8
+                        scaled[i] = 0
+                        continue
+                    if changed >> i & 1:
+                        delta, offset = readVarint(data, offset)
+                        scaled[i] += unzigzag(delta)
+                    values[i] = scaled[i] / scale
+                self.last[product] = scaled
+                rows.append((timestamp, product, values))
+        except (ValueError, IndexError, struct.error):
+            # a truncated line
+            self.lineNumber = None
+            self.skipped += 1
+            return []
+        self.lineNumber = lineNumber
+        return rows
+
+
+'''
+Parses a results log (the activities csv lines and the CSVDATA or compact lines written by Trader.writeLog)
+for the products in plot_products. A product the trader logged takes its series from those rows and only its pnl
+from the activities lines, the others take timestamps, prices and pnls from the activities lines.
+Returns a dict of series per product: timestamps, prices, bids, asks, positions, pnls and customs (one list per custom series)
+'''
+def parse_log(filename: str, plot_products: list[str], resultsMode=True, jsonMode=False) -> dict[str, dict]:
+    timestamps: dict[str, list[int]] = {}
+    prices: dict[str, list[float]] = {}
+    bids: dict[str, list[float]] = {}
+    asks: dict[str, list[float]] = {}
+    positions: dict[str, list[float]] = {}
+    customs: dict[str, list[list[float]]] = {}
+    pnls: dict[str, list[float]] = {}
+
+    for i in [timestamps, prices, bids, asks, positions, pnls]:
+        for product in products:
+            i[product] = []
+
+    for product in products:
+        customs[product] = [
+            [] for i in range(len(productToCustomSeries[product]) if product in productToCustomSeries else 0)
+        ]
+
+    compactLog = CompactLogDecoder()
+    # (timestamp, mid price, pnl) of the activities lines, kept apart from the trader's own log rows
+    activities: dict[str, list[tuple[int, float, float]]] = {}
+
+    print("Opening file: " + filename)
+    # the backtester writes simresults.txt.gz when asked to compress its log
+    with (gzip.open(filename, "rt") if filename.endswith(".gz") else open(filename, "r")) as f:
+        lines = f.readlines()
+        if jsonMode:
+            lines = lines[8].split('": "')[1].split("\\n")
+        for line in lines:
+            if "CLOG1:" in line:
+                for timestamp, product, values in compactLog.feed(line):
+                    if product not in plot_products:
+                        continue
+                    timestamps[product].append(timestamp)
+                    positions[product].append(values[0])
+                    bids[product].append(values[1])
+                    prices[product].append(values[2])
+                    asks[product].append(values[3])
+                    for series, value in zip(customs[product], values[4:]):
+                        series.append(value)
+                continue
+            if len(line) < 3 or (line[1] != ";" and line[2] != ';' and (not "CSVDATA" in line or "TIMESTAMP" in line)): # skip header and all lines without CSVDATA, but don't skip lines with ; in them
+                continue
+            line = line.strip()
+
+            if line[1] == ";":
+                line = line.split(";")
+                product = line[2]
+                if product not in plot_products:
+                    continue
+
+                rows = activities.setdefault(product, [])
+                timestamp = int(line[1] if line[1] != "" else rows[-1][0] + 100 if len(rows) > 0 else 0)
+                rows.append((timestamp, float(line[-2]), float(line[-1])))
+                continue
+
+            line = line.split(",")
+            product = line[1].removeprefix('"').removesuffix('"') if len(line) > 1 else "UNKNOWN"
+            if product not in plot_products:
+                continue
+            timestamps[product].append(int(line[0].split(" ")[0]))
+            positions[product].append(float(line[2]))
+            prices[product].append(float(line[4]))
+            bids[product].append(float(line[3]))
+            asks[product].append(float(line[5]))
+            for i in range(6, len(line) - 1): # skip timestamp, product, position, bid, price, ask and CSVDATA
+                if i-6 >= len(customs[product]):
+                    #print("ERROR: too many custom series for product " + product)
+                    break
+                if line[i] == "True":
+                    customs[product][i-6].append(1)
+                elif line[i] == "False":
+                    customs[product][i-6].append(0)
+                else:
+                    customs[product][i-6].append(float(line[i]))
+
+    if compactLog.skipped:
+        print("Skipped " + str(compactLog.skipped) + " compact log lines after missing or truncated ones")
+
+    for product, rows in activities.items():
+        if timestamps[product]:
+            # the series are those of the log rows, the activities only give their pnl
+            pnlAt = {timestamp: pnl for timestamp, _, pnl in rows}
+            pnls[product] = [pnlAt.get(timestamp, 0.0) for timestamp in timestamps[product]]
+        elif resultsMode or jsonMode:
+            timestamps[product] = [timestamp for timestamp, _, _ in rows]
+            prices[product] = [price for _, price, _ in rows]
+            pnls[product] = [pnl for _, _, pnl in rows]
+
+    for product in products:
+        if len(timestamps[product]) != len(pnls[product]):
+            print("Different lengths for timestamps and pnls for product " + product + ": " + str(len(timestamps[product])) + " vs " + str(len(pnls[product])) + ". Fixing...")
+            modified = 0
+            while len(timestamps[product]) > len(pnls[product]):
+                pnls[product].append(pnls[product][-1])
+                modified += 1
+            while len(timestamps[product]) < len(pnls[product]):
+                pnls[product].pop(0)
+                modified += 1
+            print("Modified " + str(modified) + " PnLs for product " + product)
+
+    return {
+        'timestamps': timestamps,
+        'prices': prices,
+        'bids': bids,
+        'asks': asks,
+        'positions': positions,
+        'customs': customs,
+        'pnls': pnls,
+    }
@@ -1,6 +1,11 @@
 from typing import Dict, List
 import math
 import json
+import zlib
+import base64
+import sys
+import struct
+from array import array
 from json import JSONEncoder
 
 Time = int
@@ -13,7 +18,15 @@ SELL = 0
 BUY = 1
 
 
+def attributes(o) -> dict:
+    # the small datamodel classes use __slots__ and have no __dict__
+    if hasattr(o, '__dict__'):
+        return o.__dict__
+    return {name: getattr(o, name) for name in o.__slots__}
+
 class Listing:
+    __slots__ = ['symbol', 'product', 'denomination']
+
     def __init__(self, symbol: Symbol, product: Product, denomination: Product):
         self.symbol = symbol
         self.product = product
@@ -21,6 +34,8 @@ class Listing:
 
 
 class Order:
+    __slots__ = ['symbol', 'price', 'quantity']
+
     def __init__(self, symbol: Symbol, price: int, quantity: int) -> None:
         self.symbol = symbol
         self.price = price
@@ -34,11 +49,15 @@ class Order:
     
 
 class OrderDepth:
+    __slots__ = ['buy_orders', 'sell_orders']
+
     def __init__(self):
         self.buy_orders: Dict[int, int] = {}
         self.sell_orders: Dict[int, int] = {}
 
 class OwnTrade:
+    __slots__ = ['symbol', 'price', 'quantity', 'counter_party']
+
     def __init__(self, symbol: Symbol, price: int, quantity: int, counter_party: UserId = None) -> None: # type: ignore
         self.symbol = symbol
         self.price: int = price
@@ -46,6 +65,8 @@ class OwnTrade:
         self.counter_party = counter_party
 
 class Trade:
+    __slots__ = ['symbol', 'price', 'quantity', 'buyer', 'seller', 'timestamp']
+
     def __init__(self, symbol: Symbol, price: int, quantity: int, buyer: UserId = None, seller: UserId = None, timestamp: int = 0) -> None: # type: ignore
         self.symbol = symbol
         self.price: int = price
@@ -62,7 +83,8 @@ class TradingState(object):
                  own_trades: Dict[Symbol, List[OwnTrade]],
                  market_trades: Dict[Symbol, List[Trade]],
                  position: Dict[Product, Position],
-                 observations: Dict[Product, Observation]):
+                 observations: Dict[Product, Observation],
+                 traderData: str = ""):
         self.timestamp = timestamp
         self.listings = listings
         self.order_depths = order_depths
@@ -70,13 +92,14 @@ class TradingState(object):
         self.market_trades = market_trades
         self.position = position
         self.observations = observations
+        self.traderData = traderData
         
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True)
+        return json.dumps(self, default=attributes, sort_keys=True)
     
 class ProsperityEncoder(JSONEncoder):
         def default(self, o):
-            return o.__dict__
+            return attributes(o)
         
 
 
@@ -123,6 +146,9 @@ class Trader:
     recentBollingerBandwidths: Dict[Product, List[float]] = {    }
     recentBBUpCrosses: Dict[Product, int] = {    } # Timestamp of last cross
     recentBBDownCrosses: Dict[Product, int] = {    } # Timestamp of last cross
+    compactLogRows: Dict[Product, list] = {    } # writeLog's values of this tick
+    compactLogLast: Dict[Product, list] = {    } # the scaled values last sent per product, see flushCompactLog
+    orderReasons: Dict[Order, str] = {    } # why each order of this tick was placed, see tagOrders
 
     shortTermAboveLongTerm: bool = False
     tryToBuy: bool = True
@@ -153,6 +179,7 @@ class Trader:
     ukuleleLastTradeIsBuy: bool = False
 
     done_initializing: bool = False # we use this to detect state resets
+    traderData: str = "" # snapshot of the state below, refreshed every tick (see saveState)
 
     FullBuy = Hold = FullSell = False
 
@@ -169,6 +196,42 @@ class Trader:
     bollingerBandStdDev: float = 2.0
     priceHistoryLength: int = 500
 
+    # how far the bananas fair value leans from its moving average towards the microprice
+    microPriceWeight: float = 0.25
+
+    # fixed bands: buy everything offered at or below the first, sell everything bid at or above the second
+    coconutsBuyBelow: int = 7910
+    coconutsSellAbove: int = 7950
+    dipBuyBelow: int = 7069
+    dipSellAbove: int = 7110
+
+    # everything saveState writes out: per product lists, per product numbers, and plain flags
+    persistedBuffers = ['shortMovingAverages', 'longMovingAverages', 'ultraLongMovingAverages', 
+                        'shortVelocities', 'longVelocities', 'ultraLongVelocities', 
+                        'priceHistory', 'rsiHistory', 'recentBollingerBandwidths']
+    persistedScalars = ['shortAccelerations', 'longAccelerations', 'ultraLongAccelerations', 
+                        'rsiStatus', 'bollingerBreakout', 'recentBBUpCrosses', 'recentBBDownCrosses']
+    persistedFlags = ['shortTermAboveLongTerm', 'tryToBuy', 'daysSinceCross', 'basePinaColadaPrice', 'baseCoconutPrice',
+                      'coconutsCrossedUp', 'coconutsDaysSinceCross', 'coconutsRecentlyRisky', 'coconutsTrendStartTimestamp', 'coconutsTrendDays',
+                      'divingGearTrendTimestamp', 'predictedDivingGearTrend', 'dolphinTrendDays', 'divingGearTrendDays', 'daysTryingToEndDivingGear',
+                      'ukuleleLastTradeTimestamp', 'ukuleleLastTradePrice', 'ukuleleLastTradeIsBuy', 'FullBuy', 'Hold', 'FullSell']
+    stateVersion: int = 1
+    perInstanceContainers = persistedBuffers + persistedScalars + ['massiveMovingAverages', 'massiveVelocities', 'massiveAccelerations', 'orderReasons',
+                                                                'compactLogRows', 'compactLogLast']
+    persistState: bool = True # saveState takes about 0.3 ms a tick, backtests without a restart turn it off
+    # how much of a buffer the indicators ever read, saveState drops the rest: the 200 tick windows of the
+    # bollinger bands and triple moving average cover the 100 period rsi, the velocities are only read at [-1], [-2]
+    # and checked for a length of 5 (processMovingAverage) or shortMovingAverageSize / 2 (see persistedTail)
+    persistedTails = {'priceHistory': 200}
+
+    # writeLog's values as one compact line per tick (see flushCompactLog), the exchange truncates the plain CSVDATA lines
+    compactLog: bool = True
+    compactLogBudget: int = 1000 # characters per line, products that do not fit are sent on a later tick
+    compactLogKeyframeEvery: int = 100 # lines between keyframes, which do not depend on the lines before them
+    compactLogFields = ['position', 'bid', 'mid', 'ask', 'shortMa', 'longMa', 'ultraLongMa', 'shortVel', 'longVel', 'ultraLongVel',
+                        'shortAcc', 'longAcc', 'ultraLongAcc', 'volume', 'c1', 'c2', 'c3', 'c4', 'c5', 'c6']
+    compactLogScales = [1, 1, 2, 1] + [1000] * 9 + [1] + [1000] * 6 # values are sent as integer deltas of value * scale
+
     # Define a fair value for the PEARLS.
     pearl_acceptable_price = 10000
     # ignored for now
@@ -176,6 +239,11 @@ class Trader:
 
 
     def reset(self):
+        # fresh containers on the instance, the class level ones would be shared by every Trader
+        for name in self.perInstanceContainers:
+            setattr(self, name, {})
+        self.coconutsPriceMovingAverage = []
+        self.coconutsPriceMovingAverageLong = []
         for product in self.trackingStatsOf:
             self.shortMovingAverages[product] = []
             self.longMovingAverages[product] = []
@@ -193,6 +261,8 @@ class Trader:
             self.recentBollingerBandwidths[product] = []
             self.recentBBUpCrosses[product] = 0
             self.recentBBDownCrosses[product] = 0
+        self.compactLogLines = 0
+        self.savedStateRaw = b''
 
     def __init__(self):
         # initialize the tracked stats
@@ -208,29 +278,35 @@ class Trader:
         if not self.done_initializing:
             if state.timestamp > 0:
                 print("STATE MAY HAVE BEEN RESET")
-                print("ATTEMPTING TO FIX BERRIES!")
-                if state.timestamp >= 380000: 
-                    self.FullBuy = True
-                if state.timestamp >= 525000: 
-                    self.FullBuy = False
-                    self.Hold = False
-                    self.FullSell = True
-                if state.timestamp >= 775000: 
-                    self.Hold = False
-                    self.FullSell = False
+                # the exchange's TradingState may not have traderData at all
+                if self.restoreState(getattr(state, 'traderData', '')):
+                    print("RESTORED STATE FROM SNAPSHOT")
+                else:
+                    print("ATTEMPTING TO FIX BERRIES!")
+                    if state.timestamp >= 380000: 
+                        self.FullBuy = True
+                    if state.timestamp >= 525000: 
+                        self.FullBuy = False
+                        self.Hold = False
+                        self.FullSell = True
+                    if state.timestamp >= 775000: 
+                        self.Hold = False
+                        self.FullSell = False
 
             print("OPERATING WITH SMASIZE ", self.shortMovingAverageSize, "LONGSMASIZE", self.longMovingAverageSize, "ULTRALONGSMASIZE", self.ultraLongMovingAverageSize)
             self.done_initializing = True
 
-        if self.getMidpointPrice(state.order_depths['PINA_COLADAS']) != -1 and self.basePinaColadaPrice == 0:
+        # both only trade from round 2 on
+        if 'PINA_COLADAS' in state.order_depths and self.getMidpointPrice(state.order_depths['PINA_COLADAS']) != -1 and self.basePinaColadaPrice == 0:
             self.basePinaColadaPrice = self.getMidpointPrice(state.order_depths['PINA_COLADAS'])
 
-        if self.getMidpointPrice(state.order_depths['COCONUTS']) != -1 and self.baseCoconutPrice == 0:
+        if 'COCONUTS' in state.order_depths and self.getMidpointPrice(state.order_depths['COCONUTS']) != -1 and self.baseCoconutPrice == 0:
             self.baseCoconutPrice = self.getMidpointPrice(state.order_depths['COCONUTS'])
 
 
         # Initialize the method output dict as an empty dict
         result = {}
+        self.orderReasons.clear()
 
         for product in state.observations:
             if product not in self.trackingStatsOf:
@@ -306,6 +382,10 @@ class Trader:
                 result[product] = self.tradeStrategyBollingerBands(state, product, currentProductAmount)
                 pass
 
+        if self.compactLog:
+            self.flushCompactLog(state.timestamp)
+        if self.persistState:
+            self.traderData = self.saveState()
         return result
     
 # --------------------- START PRODUCT HANDLERS --------------------- #
@@ -378,17 +458,23 @@ class Trader:
 
         recentStandardDeviation = (recentStandardDeviation / len(self.shortMovingAverages[product])) ** 0.5
 
-        self.writeLog(state, product, priceAverage, recentStandardDeviation)
+        # lean the fair value towards the microprice, which already prices in the queue imbalance
+        fairValue = priceAverage
+        microprice = self.getMicroprice(state.order_depths[product])
+        if microprice is not None:
+            fairValue = weightedAverage(priceAverage, microprice, self.microPriceWeight)
+
+        self.writeLog(state, product, fairValue, recentStandardDeviation)
 
         if len(order_depth.sell_orders) > 0: # we are going to consider buying
             print("AT TIME ", state.timestamp, "PRODUCT ", product, " HAS SELL ORDERS: ", state.order_depths[product].sell_orders)
-            acceptable_buy_price = priceAverage - recentStandardDeviation * self.stddevThreshold
+            acceptable_buy_price = fairValue - recentStandardDeviation * self.stddevThreshold
 
             orders = orders + self.getAllOrdersBetterThan(product, state, True, acceptable_buy_price, currentProductAmount)
 
         if len(order_depth.buy_orders) > 0: # we are going to consider selling
             print("AT TIME ", state.timestamp, "PRODUCT ", product, " HAS BUY ORDERS: ", state.order_depths[product].buy_orders)
-            acceptable_sell_price = priceAverage + recentStandardDeviation * self.stddevThreshold
+            acceptable_sell_price = fairValue + recentStandardDeviation * self.stddevThreshold
 
             orders = orders + self.getAllOrdersBetterThan(product, state, False, acceptable_sell_price, currentProductAmount)
         return orders
@@ -445,8 +531,8 @@ class Trader:
         return orders
 
     def handleCoconuts(self, state: TradingState, product: str, currentProductAmount: int) -> list[Order]:
-        orders = self.getAllOrdersBetterThan(product, state, True, 7910, currentProductAmount)
-        orders = orders + self.getAllOrdersBetterThan(product, state, False, 7950, currentProductAmount)
+        orders = self.getAllOrdersBetterThan(product, state, True, self.coconutsBuyBelow, currentProductAmount)
+        orders = orders + self.getAllOrdersBetterThan(product, state, False, self.coconutsSellAbove, currentProductAmount)
         self.writeLog(state, product)
 
         upper_limit = 8000
@@ -518,8 +604,8 @@ class Trader:
         return orders #type: ignore #if self.getMidpointPrice(state.order_depths[product]) < upper_limit and self.getMidpointPrice(state.order_depths[product]) > lower_limit else closeOrders
 
     def handleDip(self, state: TradingState, product: str, currentProductAmount: int) -> list[Order]:
-        orders = self.getAllOrdersBetterThan(product, state, True, 7069, currentProductAmount)
-        orders = orders + self.getAllOrdersBetterThan(product, state, False, 7110, currentProductAmount)
+        orders = self.getAllOrdersBetterThan(product, state, True, self.dipBuyBelow, currentProductAmount)
+        orders = orders + self.getAllOrdersBetterThan(product, state, False, self.dipSellAbove, currentProductAmount)
         self.writeLog(state, product)
 
         upper_limit = 7140
@@ -586,28 +672,28 @@ class Trader:
             self.ukuleleLastTradeIsBuy = False
             self.ukuleleLastTradePrice = self.getMidpointPrice(order_depth)
             # if UL is far higher than L, sell
-            orders = self.getAllOrdersBetterThan(product, state, False, self.getMidpointPrice(order_depth) - 0.025 * diff_long_ultra_long, currentProductAmount)
+            orders = self.tagOrders(self.getAllOrdersBetterThan(product, state, False, self.getMidpointPrice(order_depth) - 0.025 * diff_long_ultra_long, currentProductAmount), 'entry')
         elif diff_long_ultra_long < -25 and diff_short_long < -9:
             self.ukuleleLastTradeTimestamp = state.timestamp
             self.ukuleleLastTradeIsBuy = True
             self.ukuleleLastTradePrice = self.getMidpointPrice(order_depth)
             # if UL is far lower than L, buy
-            orders = self.getAllOrdersBetterThan(product, state, True, self.getMidpointPrice(order_depth) - 0.025 * diff_long_ultra_long, currentProductAmount)
+            orders = self.tagOrders(self.getAllOrdersBetterThan(product, state, True, self.getMidpointPrice(order_depth) - 0.025 * diff_long_ultra_long, currentProductAmount), 'entry')
         
         if currentProductAmount != 0:
             if currentProductAmount > 0 and ultraLongTrend < 0:
                 # sell to close if we have a long position and the trend is going down
-                orders = orders + self.getAllOrdersBetterThan(product, state, False, self.getMidpointPrice(order_depth) + 20 - 1 * diff_long_ultra_long - 0.5 * diff_short_long, currentProductAmount, alt_max=0)
+                orders = orders + self.tagOrders(self.getAllOrdersBetterThan(product, state, False, self.getMidpointPrice(order_depth) + 20 - 1 * diff_long_ultra_long - 0.5 * diff_short_long, currentProductAmount, alt_max=0), 'trendClose')
             elif currentProductAmount < 0 and ultraLongTrend > 0:
                 # buy to close if we have a short position and the trend is going up
-                orders = orders + self.getAllOrdersBetterThan(product, state, True, self.getMidpointPrice(order_depth) - 20 - 1 * diff_long_ultra_long - 0.5 * diff_short_long, currentProductAmount, alt_max=0)
+                orders = orders + self.tagOrders(self.getAllOrdersBetterThan(product, state, True, self.getMidpointPrice(order_depth) - 20 - 1 * diff_long_ultra_long - 0.5 * diff_short_long, currentProductAmount, alt_max=0), 'trendClose')
             
         if self.ukuleleLastTradeTimestamp > 0:
             closeOrders = []
             if self.ukuleleLastTradeIsBuy and ultraLongTrend < 0.001:
-                closeOrders = self.getAllOrdersBetterThan(product, state, False, self.ukuleleLastTradePrice + 110, currentProductAmount, alt_max=0)
+                closeOrders = self.tagOrders(self.getAllOrdersBetterThan(product, state, False, self.ukuleleLastTradePrice + 110, currentProductAmount, alt_max=0), 'closeOrders')
             elif ultraLongTrend > -0.001:
-                closeOrders = self.getAllOrdersBetterThan(product, state, True, self.ukuleleLastTradePrice - 110, currentProductAmount, alt_max=0)
+                closeOrders = self.tagOrders(self.getAllOrdersBetterThan(product, state, True, self.ukuleleLastTradePrice - 110, currentProductAmount, alt_max=0), 'closeOrders')
 
             if len(closeOrders) > 0:
                 self.ukuleleLastTradeTimestamp = 0
@@ -771,12 +857,12 @@ class Trader:
 
         # buying conditions
         if self.predictedDivingGearTrend == 1 and longVel > 0.5:
-            orders = self.getAllOrdersBetterThan(product, state, True, acceptable_buy_price, currentProductAmount)
+            orders = self.tagOrders(self.getAllOrdersBetterThan(product, state, True, acceptable_buy_price, currentProductAmount), 'trend')
             placedOrder = True
 
         # selling conditions
         if self.predictedDivingGearTrend == -1 and longVel < -0.5:
-            orders = self.getAllOrdersBetterThan(product, state, False, acceptable_sell_price, currentProductAmount)
+            orders = self.tagOrders(self.getAllOrdersBetterThan(product, state, False, acceptable_sell_price, currentProductAmount), 'trend')
             placedOrder = True
 
 
@@ -807,14 +893,14 @@ class Trader:
 
         if currentProductAmount > 0 and self.daysTryingToEndDivingGear > 90:
             # try to close out position to secure profit (sell)
-            orders = self.getAllOrdersBetterThan(product, state, False, acceptable_sell_price, currentProductAmount, alt_max=0)
+            orders = self.tagOrders(self.getAllOrdersBetterThan(product, state, False, acceptable_sell_price, currentProductAmount, alt_max=0), 'trendCloseOut')
             if (self.predictedDivingGearTrend == 1 and ultraLongVel < 0):
                 self.predictedDivingGearTrend = 0 # we are done capitalizing on this trend
                 self.dolphinTrendDays = 0
 
         if currentProductAmount < 0 and self.daysTryingToEndDivingGear > 90:
             # try to close out position to secure profit (buy)
-            orders = self.getAllOrdersBetterThan(product, state, True, acceptable_buy_price, currentProductAmount, alt_max=0)
+            orders = self.tagOrders(self.getAllOrdersBetterThan(product, state, True, acceptable_buy_price, currentProductAmount, alt_max=0), 'trendCloseOut')
             if (self.predictedDivingGearTrend == -1 and ultraLongVel > 0):
                 self.predictedDivingGearTrend = 0 # we are done capitalizing on this trend
                 self.dolphinTrendDays = 0
@@ -861,17 +947,17 @@ class Trader:
 
         if spike_up and not too_risky:
             # sell at upper price
-            volatilityOrders = self.getAllOrdersBetterThan(product, state, False, upper_price + 10, currentProductAmount)
+            volatilityOrders = self.tagOrders(self.getAllOrdersBetterThan(product, state, False, upper_price + 10, currentProductAmount), 'spikeUp')
         if spike_down and not too_risky:
             # buy at lower price
-            volatilityOrders = self.getAllOrdersBetterThan(product, state, True, lower_price - 10, currentProductAmount)
+            volatilityOrders = self.tagOrders(self.getAllOrdersBetterThan(product, state, True, lower_price - 10, currentProductAmount), 'spikeDown')
 
         if (too_risky or midpointPrice + 10 > currentLMA) and currentProductAmount > 0:
             # close at midpoint price - 2*stddev by selling
-            volatilityOrders = volatilityOrders + self.getAllOrdersBetterThan(product, state, False, midpointPrice - 0.1 * recentStandardDeviation, currentProductAmount, alt_max=0)
+            volatilityOrders = volatilityOrders + self.tagOrders(self.getAllOrdersBetterThan(product, state, False, midpointPrice - 0.1 * recentStandardDeviation, currentProductAmount, alt_max=0), 'volatilityClose')
         elif (too_risky or midpointPrice - 10 < currentLMA) and currentProductAmount < 0:
             # close at midpoint price + 2*stddev by buying
-            volatilityOrders = volatilityOrders + self.getAllOrdersBetterThan(product, state, True, midpointPrice + 0.1 * recentStandardDeviation, currentProductAmount, alt_max=0)
+            volatilityOrders = volatilityOrders + self.tagOrders(self.getAllOrdersBetterThan(product, state, True, midpointPrice + 0.1 * recentStandardDeviation, currentProductAmount, alt_max=0), 'volatilityClose')
 
         return orders if (len(orders) != 0 or self.predictedDivingGearTrend != 0) else volatilityOrders
 
@@ -1138,6 +1224,88 @@ class Trader:
 
 # --------------------- END PRODUCT HANDLERS --------------------- #
 
+    '''
+    Serializes every indicator buffer and strategy flag into a single string:
+    "S<version>:" followed by base64 of a zlib compressed blob, which is a json header
+    (flags, per product numbers, buffer lengths), a newline, then all buffers as little endian doubles.
+    The doubles are byte shuffled (all first bytes, then all second bytes, ...) since neighbouring
+    values share their high bytes, which roughly halves the compressed size and the compression time.
+    Buffers are cut to the tail the indicators read (see persistedTail), an unchanged state reuses the last snapshot
+    '''
+    def saveState(self) -> str:
+        header = {
+            'products': self.trackingStatsOf,
+            'flags': [getattr(self, name) for name in self.persistedFlags],
+            'scalars': [[getattr(self, name).get(product, 0) for product in self.trackingStatsOf] for name in self.persistedScalars],
+            'lengths': [],
+        }
+        values = []
+        for name in self.persistedBuffers:
+            buffers = getattr(self, name)
+            tail = self.persistedTail(name)
+            for product in self.trackingStatsOf:
+                buffer = buffers.get(product, [])
+                if len(buffer) > tail:
+                    buffer = buffer[-tail:]
+                header['lengths'].append(len(buffer))
+                values.extend(buffer)
+
+        # struct is about three times faster than array.extend here
+        packed = struct.pack('<%dd' % len(values), *values)
+        headerBytes = json.dumps(header, separators=(',', ':')).encode() + b'\n'
+        # nothing changed since the last snapshot (no product had a book), so it still holds
+        if headerBytes + packed == self.savedStateRaw:
+            return self.traderData
+        self.savedStateRaw = headerBytes + packed
+        raw = headerBytes + b''.join(packed[i::8] for i in range(8))
+        return 'S' + str(self.stateVersion) + ':' + base64.b64encode(zlib.compress(raw, 1)).decode()
+
+    '''
+    Number of values at the end of a buffer that saveState keeps, see persistedTails
+    '''
+    def persistedTail(self, name: str) -> int:
+        if name.endswith('Velocities'):
+            return max(5, self.shortMovingAverageSize // 2 + 1)
+        return self.persistedTails.get(name, sys.maxsize)
+
+    '''
+    Inverse of saveState. Returns False (and changes nothing) if the snapshot is missing,
+    from another version or unreadable
+    '''
+    def restoreState(self, data: str) -> bool:
+        if not data or not data.startswith('S' + str(self.stateVersion) + ':'):
+            return False
+        try:
+            raw = zlib.decompress(base64.b64decode(data.split(':', 1)[1]))
+            headerBytes, shuffled = raw.split(b'\n', 1)
+            header = json.loads(headerBytes)
+            count = len(shuffled) // 8
+            packed = bytearray(len(shuffled))
+            for i in range(8):
+                packed[i::8] = shuffled[i * count:(i + 1) * count]
+            values = array('d')
+            values.frombytes(packed)
+            if sys.byteorder != 'little':
+                values.byteswap()
+        except Exception as e:
+            print("COULD NOT READ STATE SNAPSHOT:", e)
+            return False
+
+        products = header['products']
+        for name, value in zip(self.persistedFlags, header['flags']):
+            setattr(self, name, value)
+        for name, perProduct in zip(self.persistedScalars, header['scalars']):
+            for product, value in zip(products, perProduct):
+                getattr(self, name)[product] = value
+        offset = 0
+        lengths = iter(header['lengths'])
+        for name in self.persistedBuffers:
+            for product in products:
+                length = next(lengths)
+                getattr(self, name)[product] = values[offset:offset + length].tolist()
+                offset += length
+        return True
+
     def PriceOrder(self, product, buy : int, state : TradingState, price : int, volumeLimit = 0, printTime = False):
         """Trades best prices until price hit (inclusive), optional max volume traded
         Returns a list of orders made and a tuple of last price traded at, total volume traded, 
@@ -1257,10 +1425,14 @@ class Trader:
         if isBuying:
             if len(order_depth.buy_orders) == 0:
                 return -1
+            if offset == 0: # no need to sort the whole book
+                return min(order_depth.buy_orders.keys())
             possiblePrices: list[int] = sorted(order_depth.buy_orders.keys(), reverse=False)
         else:
             if len(order_depth.sell_orders) == 0:
                 return -1
+            if offset == 0:
+                return max(order_depth.sell_orders.keys())
             possiblePrices: list[int] = sorted(order_depth.sell_orders.keys(), reverse=True)
 
         return possiblePrices[offset]
@@ -1343,6 +1515,24 @@ class Trader:
         return avg
 
 
+    '''
+    Mid weighted by the volume on the other side of the top of the book, so it leans towards the side
+    more likely to trade next. The rest of the book features are only computed in bulk, see book_features.py.
+    Returns None for a one-sided book
+    '''
+    def getMicroprice(self, order_depth: OrderDepth):
+        if len(order_depth.buy_orders) == 0 or len(order_depth.sell_orders) == 0:
+            return None
+
+        bestBid = max(order_depth.buy_orders)
+        bestAsk = min(order_depth.sell_orders)
+        bestBidVolume = order_depth.buy_orders[bestBid]
+        bestAskVolume = -order_depth.sell_orders[bestAsk]
+        topVolume = bestBidVolume + bestAskVolume
+        if topVolume <= 0:
+            return (bestBid + bestAsk) / 2
+        return (bestBid * bestAskVolume + bestAsk * bestBidVolume) / topVolume
+
     def writeLog(self, state: TradingState, product: str, c1 = 0.0, c2 = 0.0, c3 = 0.0, c4 = 0.0, c5 = 0.0, c6 = 0.0, is_observation = False):
         currentProductAmount = state.position.get(product, 0)
         bid = Trader.getBestPossiblePrice(self, state.order_depths[product], True) if not is_observation else state.observations[product]
@@ -1370,6 +1560,96 @@ class Trader:
         #       shortMa, longMa, ultraLongMa, shortVel, longVel, ultraLongVel, shortAcc, longAcc, ultraLongAcc, volume,
               
         #       c1,c2,c3,c4,c5,c6, '"CSVDATA"', sep=",")
+        if self.compactLog:
+            self.compactLogRows[product] = [currentProductAmount, bid, midpointPrice, ask, shortMa, longMa, ultraLongMa,
+                                            shortVel, longVel, ultraLongVel, shortAcc, longAcc, ultraLongAcc, volume, c1, c2, c3, c4, c5, c6]
+
+    '''
+    Prints the values writeLog collected this tick as one line: 'CLOG1:' and the base64 of
+    a flags byte (1 for a keyframe), the line number mod 256, on keyframes the tables the reader needs
+    (the count of trackingStatsOf and each name as a varint length and ascii, the count of compactLogScales and each scale),
+    the timestamp and the bitmask of the products sent (bit i for trackingStatsOf[i]), then per product the bitmask of the fields that changed, the bitmask of the ones
+    sent raw and the changed fields: a zigzag varint of the change of round(value * scale) since the last value sent,
+    or a little endian double for values that are not finite numbers or too large for that. Keyframes send changes from zero.
+    Products are added from a different one every tick until the line would exceed compactLogBudget,
+    the others keep their last sent values and go out later. log_parser.CompactLogDecoder reads the lines back
+    '''
+    def flushCompactLog(self, timestamp: int):
+        keyframe = self.compactLogLines % self.compactLogKeyframeEvery == 0
+        if keyframe:
+            self.compactLogLast.clear()
+        header = bytearray([1 if keyframe else 0, self.compactLogLines % 256])
+        if keyframe:
+            writeVarint(header, len(self.trackingStatsOf))
+            for product in self.trackingStatsOf:
+                writeVarint(header, len(product))
+                header += product.encode('ascii')
+            writeVarint(header, len(self.compactLogScales))
+            for scale in self.compactLogScales:
+                writeVarint(header, scale)
+        writeVarint(header, timestamp)
+
+        indices = sorted(self.trackingStatsOf.index(product) for product in self.compactLogRows)
+        start = self.compactLogLines % len(indices) if indices else 0
+        # bytes of the header once the widest product mask is added
+        size = len(header) + (len(self.trackingStatsOf) + 6) // 7
+        chunks: Dict[int, bytes] = {}
+        for index in indices[start:] + indices[:start]:
+            product = self.trackingStatsOf[index]
+            chunk, sent = self.encodeCompactRow(self.compactLogRows[product], self.compactLogLast.get(product))
+            if 6 + (size + len(chunk) + 2) // 3 * 4 > self.compactLogBudget:
+                continue
+            size += len(chunk)
+            chunks[index] = chunk
+            self.compactLogLast[product] = sent
+
+        writeVarint(header, sum(1 << index for index in chunks))
+        for index in sorted(chunks):
+            header += chunks[index]
+        print('CLOG1:' + base64.b64encode(bytes(header)).decode())
+        self.compactLogRows.clear()
+        self.compactLogLines += 1
+
+    # one product's part of a compact log line and the scaled values the reader will hold after it
+    def encodeCompactRow(self, values: list, last: list) -> tuple[bytes, list[int]]:
+        sent = list(last) if last else [0] * len(self.compactLogFields)
+        changed = rawFields = 0
+        body = bytearray()
+        try:
+            scaled = [round(value * scale) for value, scale in zip(values, self.compactLogScales)]
+        except (TypeError, ValueError, OverflowError):
+            # None, nan or inf somewhere, those are sent raw
+            scaled = [compactScaled(value, scale) for value, scale in zip(values, self.compactLogScales)]
+        for i, now in enumerate(scaled):
+            if now == sent[i]:
+                continue
+            changed |= 1 << i
+            if now is None or not -2 ** 53 < now < 2 ** 53:
+                try:
+                    raw = array('d', [float(values[i])])
+                except (TypeError, ValueError):
+                    raw = array('d', [math.nan])
+                if sys.byteorder != 'little':
+                    raw.byteswap()
+                body += raw.tobytes()
+                rawFields |= 1 << i
+                sent[i] = 0
+                continue
+            writeVarint(body, zigzag(now - sent[i]))
+            sent[i] = now
+        chunk = bytearray()
+        writeVarint(chunk, changed)
+        writeVarint(chunk, rawFields)
+        return bytes(chunk + body), sent
+
+    '''
+    Records the rule that placed the orders, for the backtester's profit attribution.
+    Only a side table on the trader, the orders sent to the exchange are unchanged
+    '''
+    def tagOrders(self, orders: list[Order], reason: str) -> list[Order]:
+        for order in orders:
+            self.orderReasons[order] = reason
+        return orders
 
 ######### UTILITY FUNCTIONS #########
 
@@ -1458,4 +1738,22 @@ def computeSimpleAverage(list: List) -> float:
     if len(list) == 0:
         return -1
     return sum(list) / len(list)
-    
\ No newline at end of file
+    
+
+# 7 bits per byte, low bits first, the high bit set on every byte but the last
+def writeVarint(buffer: bytearray, n: int):
+    while n >= 0x80:
+        buffer.append(n & 0x7f | 0x80)
+        n >>= 7
+    buffer.append(n)
+
+# round(value * scale), None for values that are not finite numbers
+def compactScaled(value, scale: int):
+    try:
+        return round(value * scale)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+# 0, -1, 1, -2, 2 -> 0, 1, 2, 3, 4, small changes of either sign stay small varints
+def zigzag(n: int) -> int:
+    return n * 2 if n >= 0 else -n * 2 - 1
@@ -0,0 +1,134 @@
+import sys
+import tracemalloc
+import types
+
+# the exchange reports Max Memory Used against this
+EXCHANGE_MEMORY_MB = 128
+
+# objects that belong to the program, not to the trader's state
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+class MemoryCapExceeded(Exception):
+    pass
+
+
+'''
+Size in bytes of obj and everything it references (dicts, lists, tuples, sets, objects with
+__dict__ or __slots__). Objects already in seen are not counted again, so shared floats and
+strings count once per sample
+'''
+def deep_sizeof(obj, seen: set[int] | None = None) -> int:
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SKIPPED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for name in getattr(type(obj), '__slots__', ()):
+                if hasattr(obj, name):
+                    stack.append(getattr(obj, name))
+    return size
+
+
+'''
+Samples how much memory a trader keeps between ticks. Every sample_every ticks it measures
+the deep size of each instance attribute of the trader (its retained state) and, with
+use_tracemalloc, the live allocations made from the trader's source file. Flags a growth trend
+over the second half of the run and raises MemoryCapExceeded when the retained state passes cap_mb
+'''
+class MemoryTracker:
+    def __init__(self, sample_every: int = 100, cap_mb: float | None = None, use_tracemalloc=False, growth_tolerance: float = 0.05):
+        self.sample_every = sample_every
+        self.cap_bytes = cap_mb * 1024 * 1024 if cap_mb is not None else None
+        self.use_tracemalloc = use_tracemalloc
+        self.growth_tolerance = growth_tolerance
+        self.ticks = 0
+        self.timestamps: list[int] = []
+        self.retained: list[int] = []
+        self.traced: list[int] = []
+        self.peak_attributes: dict[str, int] = {}
+        self.source_file: str | None = None
+        self.started_tracing = False
+
+    def start(self, trader):
+        self.source_file = sys.modules[type(trader).__module__].__file__
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def stop(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    # bytes per instance attribute of the trader, shared objects count towards the first attribute holding them
+    def attribute_sizes(self, trader) -> dict[str, int]:
+        seen: set[int] = set()
+        return {name: deep_sizeof(value, seen) for name, value in vars(trader).items()}
+
+    # call after every run, only every sample_every-th call actually measures
+    def sample(self, timestamp: int, trader):
+        self.ticks += 1
+        if (self.ticks - 1) % self.sample_every != 0:
+            return
+        if self.source_file is None:
+            self.start(trader)
+
+        sizes = self.attribute_sizes(trader)
+        total = sum(sizes.values())
+        self.timestamps.append(timestamp)
+        self.retained.append(total)
+        if total >= max(self.retained):
+            self.peak_attributes = sizes
+        if self.use_tracemalloc:
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, self.source_file)])
+            self.traced.append(sum(stat.size for stat in snapshot.statistics('filename')))
+
+        if self.cap_bytes is not None and total > self.cap_bytes:
+            self.stop()
+            largest = sorted(sizes.items(), key=lambda item: -item[1])[:5]
+            raise MemoryCapExceeded(f'Trader state is {total / 1024 / 1024:.2f} MB at {timestamp}, over the cap of {self.cap_bytes / 1024 / 1024:.2f} MB. Largest: {largest}')
+
+    '''
+    Least squares slope of the retained size over the second half of the samples (the first half is warm up,
+    while the history buffers fill), in bytes per 1000 ticks, and whether that growth exceeds growth_tolerance
+    of the size at the start of the second half
+    '''
+    def trend(self) -> tuple[float, bool]:
+        half = len(self.retained) // 2
+        xs, ys = self.timestamps[half:], self.retained[half:]
+        if len(xs) < 2:
+            return 0.0, False
+        meanX, meanY = sum(xs) / len(xs), sum(ys) / len(ys)
+        variance = sum((x - meanX) ** 2 for x in xs)
+        slope = sum((x - meanX) * (y - meanY) for x, y in zip(xs, ys)) / variance if variance > 0 else 0.0
+        growth = slope * (xs[-1] - xs[0])
+        return slope * 1000, ys[0] > 0 and growth > self.growth_tolerance * ys[0]
+
+    def report(self) -> str:
+        if not self.retained:
+            return 'No memory samples taken'
+        slope, growing = self.trend()
+        lines = [
+            f'Trader state: {self.retained[-1] / 1024:.1f} KB at the end, peak {max(self.retained) / 1024:.1f} KB over {len(self.retained)} samples',
+            f'Trend over the second half: {slope:+.1f} bytes per 1000 timestamps' + (' GROWING' if growing else ''),
+        ]
+        if self.traced:
+            lines.append(f'Live allocations from {self.source_file}: {self.traced[-1] / 1024:.1f} KB at the end, peak {max(self.traced) / 1024:.1f} KB (limit {EXCHANGE_MEMORY_MB} MB)')
+        lines.append('Largest attributes at the peak:')
+        for name, size in sorted(self.peak_attributes.items(), key=lambda item: -item[1])[:8]:
+            lines.append(f'    {name:<30}{size / 1024:>10.1f} KB')
+        return '\n'.join(lines)
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from walk_forward import TRAINING_DIR, import_backtester, training_days
+
+DAY_LENGTH = 1000000
+
+# timestamps per bootstrap block, 20 blocks make a day
+DEFAULT_BLOCK = 50000
+
+# products whose price sits on a fixed value, their blocks are never shifted to join the previous one
+ANCHORED = ['PEARLS']
+
+PRICE_COLUMNS = [f'{side}_price_{level}' for side in ('bid', 'ask') for level in (1, 2, 3)] + ['mid_price']
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+# the training days of a round, read once per worker process
+day_cache: dict[int, list[tuple[pd.DataFrame, pd.DataFrame]]] = {}
+
+
+def round_frames(round: int) -> list[tuple[pd.DataFrame, pd.DataFrame]]:
+    if round not in day_cache:
+        day_cache[round] = [(pd.read_csv(os.path.join(TRAINING_DIR, f'prices_round_{round}_day_{day}.csv'), sep=';'),
+                             pd.read_csv(os.path.join(TRAINING_DIR, f'trades_round_{round}_day_{day}_wn.csv'), sep=';', dtype={'seller': str, 'buyer': str}))
+                            for day in training_days()[round]]
+    return day_cache[round]
+
+
+'''
+A day of the round resampled with a block bootstrap on timestamps: the day is cut into blocks of block
+timestamps and every block of the new day is a block drawn with replacement from any training day, all products
+together so their relations hold within a block. With rebase, every block of a product that is not in ANCHORED
+is shifted (book and trades) so it opens where the previous block closed, instead of jumping between days' levels
+'''
+def bootstrap_day(round: int, rng: np.random.Generator, block: int = DEFAULT_BLOCK, rebase=False) -> tuple[pd.DataFrame, pd.DataFrame]:
+    frames = round_frames(round)
+    blocks = DAY_LENGTH // block
+    prices_out, trades_out = [], []
+    last_mid: dict[str, float] = {}
+    for index in range(blocks):
+        df_prices, df_trades = frames[rng.integers(len(frames))]
+        source = int(rng.integers(blocks)) * block
+        prices = df_prices[(df_prices['timestamp'] >= source) & (df_prices['timestamp'] < source + block)].copy()
+        trades = df_trades[(df_trades['timestamp'] >= source) & (df_trades['timestamp'] < source + block)].copy()
+        prices['timestamp'] += index * block - source
+        trades['timestamp'] += index * block - source
+        prices['day'] = 0
+
+        if rebase:
+            for product, rows in prices.groupby('product', sort=False):
+                first_mid = rows['mid_price'].iloc[0]
+                if product in last_mid and product not in ANCHORED:
+                    shift = int(np.rint(last_mid[product] - first_mid))
+                    prices.loc[rows.index, PRICE_COLUMNS] += shift
+                    trades.loc[trades['symbol'] == product, 'price'] += shift
+                last_mid[product] = prices.loc[rows.index[-1], 'mid_price']
+
+        prices_out.append(prices)
+        trades_out.append(trades)
+    return pd.concat(prices_out, ignore_index=True), pd.concat(trades_out, ignore_index=True)
+
+
+# largest drop from a running peak of a profit curve
+def max_drawdown(curve: np.ndarray) -> float:
+    return float(np.max(np.maximum.accumulate(curve) - curve)) if len(curve) else 0.0
+
+
+'''
+Backtests one day given as dataframes and returns the final profit and the max drawdown of every symbol,
+both from the profit the backtester marks at every timestamp
+'''
+def run_frames(backtester, df_prices, df_trades, round: int, params: dict, time_limit: int) -> dict[str, dict[str, float]]:
+    trader = type('TunedTrader', (backtester.Trader,), dict(params))()
+    states, trade_store, mids_by_time = backtester.prepare_day(df_prices, df_trades, round, time_limit)
+    max_time = max(states)
+    accounting = backtester.initial_accounting(states)
+    _, _, profits_by_symbol, balance_by_symbol = backtester.trades_position_pnl_run(
+        states, max_time, *accounting, trader=trader, round=round, halfway=True, mids_by_time=mids_by_time,
+        restart_at=None, persist_state=False, trade_store=trade_store)
+    times = sorted(profits_by_symbol)
+    result = {}
+    for symbol in backtester.SYMBOLS_BY_ROUND_POSITIONABLE[round]:
+        curve = np.array([profits_by_symbol[time][symbol] + balance_by_symbol[time][symbol] for time in times])
+        result[symbol] = {'profit': float(curve[-1]), 'drawdown': max_drawdown(curve)}
+    return result
+
+
+'''
+One sample in a worker process: a bootstrapped training day or a synthetic day (source 'synthetic'),
+drawn from a generator seeded with (seed, index) so every sample is reproducible on its own.
+index None backtests the training days themselves and returns their average, the point estimate
+'''
+def sample(round: int, index: int | None, source: str, seed: int, block: int, rebase: bool, params: dict, time_limit: int) -> dict[str, dict[str, float]]:
+    backtester = import_backtester()
+    with backtester.quiet():
+        if index is None:
+            results = [run_frames(backtester, df_prices, df_trades, round, params, time_limit) for df_prices, df_trades in round_frames(round)]
+            return {symbol: {key: float(np.mean([result[symbol][key] for result in results])) for key in results[0][symbol]}
+                    for symbol in results[0]}
+        if source == 'synthetic':
+            from synthetic_market import generate_days, load_calibration
+            df_prices, df_trades = next(generate_days(load_calibration(), round, 1, seed=seed * 100003 + index))
+        else:
+            df_prices, df_trades = bootstrap_day(round, np.random.default_rng([seed, index]), block, rebase)
+        return run_frames(backtester, df_prices, df_trades, round, params, time_limit)
+
+
+'''
+Backtests samples resampled days across a process pool, plus the point estimate on the real days, and
+aggregates per product: the point estimate, mean, standard deviation and quantiles of the final profit,
+the mean and worst max drawdown and the share of losing days
+'''
+def monte_carlo(round: int, samples: int = 100, source: str = 'bootstrap', seed: int = 0, block: int = DEFAULT_BLOCK, rebase=False,
+                params: dict | None = None, workers: int | None = None, time_limit: int = 999900) -> dict[str, dict]:
+    params = params or {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        point_job = pool.submit(sample, round, None, source, seed, block, rebase, params, time_limit)
+        jobs = [pool.submit(sample, round, index, source, seed, block, rebase, params, time_limit) for index in range(samples)]
+        results = [job.result() for job in jobs]
+        point = point_job.result()
+
+    summary = {}
+    for symbol in point:
+        profits = np.array([result[symbol]['profit'] for result in results])
+        drawdowns = np.array([result[symbol]['drawdown'] for result in results])
+        summary[symbol] = {
+            'point': point[symbol]['profit'],
+            'mean': float(profits.mean()),
+            'std': float(profits.std(ddof=1)) if len(profits) > 1 else 0.0,
+            'quantiles': {str(q): float(np.quantile(profits, q)) for q in QUANTILES},
+            'mean_drawdown': float(drawdowns.mean()),
+            'worst_drawdown': float(drawdowns.max()),
+            'loss_share': float((profits < 0).mean()),
+            'profits': profits.tolist(),
+        }
+    return summary
+
+
+def report(summary: dict[str, dict], samples: int) -> str:
+    header = f'{"product":<16}{"point":>10}{"mean":>10}{"std":>10}' + ''.join(f'{"p" + str(int(q * 100)):>10}' for q in QUANTILES)
+    header += f'{"mean dd":>10}{"worst dd":>10}{"P(loss)":>9}'
+    lines = [f'Final profit over {samples} resampled days, point is the average over the real ones', header]
+    for symbol, stats in summary.items():
+        line = f'{symbol:<16}{stats["point"]:>10.0f}{stats["mean"]:>10.0f}{stats["std"]:>10.0f}'
+        line += ''.join(f'{stats["quantiles"][str(q)]:>10.0f}' for q in QUANTILES)
+        line += f'{stats["mean_drawdown"]:>10.0f}{stats["worst_drawdown"]:>10.0f}{stats["loss_share"]:>9.0%}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backtests the Trader on resampled days and reports the spread of its profit')
+    parser.add_argument('--round', type=int, default=2)
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--source', choices=['bootstrap', 'synthetic'], default='bootstrap',
+                        help='block bootstrap of the training days or days from synthetic_market.py')
+    parser.add_argument('--block', type=int, default=DEFAULT_BLOCK, help='timestamps per bootstrap block')
+    parser.add_argument('--rebase', action='store_true', help='shift bootstrap blocks to open where the previous one closed')
+    parser.add_argument('--params', help='JSON object of Trader attributes to override')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--time-limit', type=int, default=999900)
+    parser.add_argument('--output', help='also write the summary as JSON')
+    args = parser.parse_args()
+
+    if args.source == 'synthetic':
+        from synthetic_market import CALIBRATION_PATH, calibrate
+        if not os.path.exists(CALIBRATION_PATH):
+            with open(CALIBRATION_PATH, 'w') as f:
+                json.dump(calibrate(seed=args.seed), f)
+
+    summary = monte_carlo(args.round, args.samples, args.source, args.seed, args.block, args.rebase,
+                          json.loads(args.params) if args.params else None, args.workers, args.time_limit)
+    print(report(summary, args.samples))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
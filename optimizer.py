@@ -0,0 +1,192 @@
+import argparse
+import json
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from results_db import ResultsDB, profit_record, trader_hash
+from walk_forward import evaluate
+
+TICK = 100
+FULL_DAY = 999900
+
+'''
+Search space: name -> [low, high] for a numeric range (an int range if both bounds are ints)
+or {"choices": [...]} for a categorical parameter
+'''
+DEFAULT_SPACE: dict = {
+    'shortMovingAverageSize': [3, 30],
+    'microPriceWeight': [0.0, 1.0],
+    'coconutsBuyBelow': [7850, 7950],
+    'coconutsSellAbove': [7900, 8000],
+}
+
+# prefixes of the day every rung is evaluated on, each twice as long as the one before
+DEFAULT_RUNGS = [125000, 250000, 500000, FULL_DAY]
+
+
+def ticks(time_limit: int) -> int:
+    return time_limit // TICK + 1
+
+
+def sample_uniform(space: dict, rng: random.Random) -> dict:
+    params = {}
+    for name, spec in space.items():
+        if isinstance(spec, dict):
+            params[name] = rng.choice(spec['choices'])
+        elif isinstance(spec[0], int) and isinstance(spec[1], int):
+            params[name] = rng.randint(spec[0], spec[1])
+        else:
+            params[name] = rng.uniform(spec[0], spec[1])
+    return params
+
+
+'''
+Tree-structured Parzen estimator: splits the scored candidates into the best gamma fraction and the rest,
+draws samples around the good ones and returns the one maximizing l(x) / g(x),
+the ratio of the kernel densities of the good and the bad candidates (a uniform prior is mixed in both)
+'''
+def sample_tpe(space: dict, history: list[tuple[dict, float]], rng: random.Random, gamma=0.25, samples=32) -> dict:
+    ordered = [params for params, _ in sorted(history, key=lambda item: -item[1])]
+    count = max(1, int(math.ceil(gamma * len(ordered))))
+    good, bad = ordered[:count], ordered[count:]
+
+    def log_density(name, value, group) -> float:
+        spec = space[name]
+        if isinstance(spec, dict):
+            hits = sum(1 for params in group if params[name] == value)
+            return math.log((hits + 1) / (len(group) + len(spec['choices'])))
+        low, high = spec
+        width = high - low
+        bandwidth = max(width / (len(group) + 1) ** 0.5 / 2, 1e-9)
+        density = 1 / width
+        for params in group:
+            density += math.exp(-0.5 * ((value - params[name]) / bandwidth) ** 2) / (bandwidth * math.sqrt(2 * math.pi))
+        return math.log(density / (len(group) + 1))
+
+    best, best_ratio = None, -math.inf
+    for _ in range(samples):
+        center = rng.choice(good)
+        params = {}
+        for name, spec in space.items():
+            if isinstance(spec, dict):
+                params[name] = center[name] if rng.random() < 0.7 else rng.choice(spec['choices'])
+                continue
+            low, high = spec
+            bandwidth = (high - low) / (len(good) + 1) ** 0.5 / 2
+            value = min(high, max(low, rng.gauss(center[name], bandwidth)))
+            params[name] = int(round(value)) if isinstance(low, int) and isinstance(high, int) else value
+        ratio = sum(log_density(name, params[name], good) - log_density(name, params[name], bad or good) for name in space)
+        if ratio > best_ratio:
+            best, best_ratio = params, ratio
+    return best
+
+
+'''
+Every evaluation (parameters, round, day, time limit, digest of main.py) and its profit per symbol, one JSON line each.
+Already evaluated keys are served from the file, so an interrupted search resumes where it stopped,
+and evaluations of an older main.py are not reused
+'''
+class Study:
+    def __init__(self, path: str | None):
+        self.path = path
+        self.results: dict[str, dict[str, float]] = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.results[record['key']] = record['profit']
+
+    @staticmethod
+    def key(params: dict, round: int, day: int, time_limit: int, trader_digest: str) -> str:
+        return json.dumps([params, round, day, time_limit, trader_digest], sort_keys=True)
+
+    def get(self, key: str) -> dict[str, float] | None:
+        return self.results.get(key)
+
+    def add(self, key: str, profit: dict[str, float]):
+        self.results[key] = profit
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'key': key, 'profit': profit}) + '\n')
+
+
+'''
+Successive halving: every candidate is backtested on the first rung's prefix of each day, the best
+1/eta (by total profit over the days) move on to the next, longer prefix, until the survivors run the full day.
+Candidates come in batches, the first batch is uniform, later ones come from the TPE sampler when use_tpe is set,
+fitted on the first rung scores. Returns the candidates that reached the last rung, best first, and the ticks simulated
+'''
+def successive_halving(space: dict, round: int, days: list[int], candidates: int = 16, batches: int = 1, eta: int = 2,
+                       rungs: list[int] = DEFAULT_RUNGS, use_tpe=False, seed: int = 0, workers: int | None = None,
+                       study: Study | None = None, results_db: ResultsDB | None = None) -> tuple[list[tuple[dict, float]], int]:
+    rng = random.Random(seed)
+    study = study or Study(None)
+    history: list[tuple[dict, float]] = []
+    finalists: list[tuple[dict, float]] = []
+    simulated = 0
+    digest = trader_hash('main.py')
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in range(batches):
+            if use_tpe and batch > 0 and len(history) >= 4:
+                population = [sample_tpe(space, history, rng) for _ in range(candidates)]
+            else:
+                population = [sample_uniform(space, rng) for _ in range(candidates)]
+            # a small or categorical space can draw the same parameters twice, they would be backtested twice
+            population = list({json.dumps(params, sort_keys=True): params for params in population}.values())
+
+            for level, time_limit in enumerate(rungs):
+                jobs = {}
+                for i, params in enumerate(population):
+                    for day in days:
+                        key = Study.key(params, round, day, time_limit, digest)
+                        if study.get(key) is None:
+                            jobs[key] = (params, day, pool.submit(evaluate, params, round, day, time_limit))
+                            simulated += ticks(time_limit)
+                for key, (_, _, job) in jobs.items():
+                    study.add(key, job.result())
+                if results_db and jobs:
+                    results_db.insert_many([profit_record('main.py', params, round, day, time_limit, study.get(key), 'optimizer')
+                                            for key, (params, day, _) in jobs.items()])
+
+                scored = [(params, sum(sum(study.get(Study.key(params, round, day, time_limit, digest)).values()) for day in days))
+                          for params in population]
+                scored.sort(key=lambda item: -item[1])
+                if level == 0:
+                    history += scored
+                if level == len(rungs) - 1:
+                    finalists += scored
+                else:
+                    population = [params for params, _ in scored[:max(1, len(scored) // eta)]]
+
+    finalists.sort(key=lambda item: -item[1])
+    return finalists, simulated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Searches Trader parameters with successive halving over prefixes of the day')
+    parser.add_argument('--space', help='JSON search space, defaults to DEFAULT_SPACE')
+    parser.add_argument('--round', type=int, default=2)
+    parser.add_argument('--days', type=int, nargs='+', default=[-1, 0])
+    parser.add_argument('--candidates', type=int, default=16)
+    parser.add_argument('--batches', type=int, default=1)
+    parser.add_argument('--eta', type=int, default=2)
+    parser.add_argument('--rungs', type=int, nargs='+', default=DEFAULT_RUNGS, help='time limits, shortest first')
+    parser.add_argument('--tpe', action='store_true', help='sample batches after the first from a TPE surrogate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--study', default='optimizer_study.jsonl', help='results file, reused to resume a search')
+    parser.add_argument('--results-db', help='also record every evaluation in this results database (see results_db.py)')
+    args = parser.parse_args()
+
+    space = json.loads(args.space) if args.space else DEFAULT_SPACE
+    finalists, simulated = successive_halving(space, args.round, args.days, args.candidates, args.batches, args.eta,
+                                              args.rungs, args.tpe, args.seed, args.workers, Study(args.study),
+                                              ResultsDB(args.results_db) if args.results_db else None)
+    full = args.candidates * args.batches * len(args.days) * ticks(args.rungs[-1])
+    print(f'Simulated {simulated} new ticks, {simulated / full:.0%} of the {full} a full-day evaluation of every candidate would take')
+    for params, score in finalists[:5]:
+        print(f'{score:>12.1f}  {params}')
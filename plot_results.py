@@ -2,6 +2,7 @@
 import sys
 import matplotlib.pyplot as plt
 import re # for regex
+from log_parser import parse_log, products, productToCustomSeries
 
 # CONFIGURABLES -----------------------------
 filename = "whole-round-five-log.csv"
@@ -76,110 +77,23 @@ if mirror_const_customs:
     plot_const_customs = new_const_customs    
 
 
-timestamps: dict[str, list[int]] = {}
-prices: dict[str, list[float]] = {}
-bids: dict[str, list[float]] = {}
-asks: dict[str, list[float]] = {}
-positions: dict[str, list[float]] = {}
-customs: dict[str, list[list[float]]] = {}
-pnls: dict[str, list[float]] = {}
-products = ['PEARLS', 'BANANAS', 'COCONUTS', 'PINA_COLADAS', 'DIVING_GEAR', 'BERRIES', 'DOLPHIN_SIGHTINGS', 'BAGUETTE', 'DIP', 'UKULELE', 'PICNIC_BASKET']
 monkeyBuyTrades: dict[str, dict[str, dict[float, float]]] = {}
 monkeySellTrades: dict[str, dict[str, dict[float, float]]] = {}
 monkeyVolume: dict[str, dict[str, dict[float, float]]] = {}
 # product: monkey: {timestamp: price}
 monkeyColors = ["red", "green", "blue", "orange", "purple", "silver", "black", "pink", "brown",  "olive", "cyan", "magenta",  "coral", "navy", "maroon", "violet",   "khaki", "indigo", "darkgreen", "darkblue", "darkred", "darkorange", "darkgray", "darkcyan", "darkmagenta", "darkolivegreen", "darkkhaki", "darkgoldenrod", "darkviolet", "darkslategray", "darkslateblue", "darkseagreen", "darkorchid"]
 
-common_customs = ["shortMa", "longMa", "ultraLongMa", "shortVel", "longVel", "ultraLongVel", "shortAcc", "longAcc", "ultraLongAcc", "volume"]
-
-productToCustomSeries = {
-    "PEARLS": common_customs + ["CUSTOM1", "CUSTOM2", "CUSTOM3", "CUSTOM4", "CUSTOM5"],
-    "BANANAS": common_customs + ["buyPrice", "sellPrice"],
-    "PINA_COLADAS": common_customs + ["PC NPrice", "Coconut NPrice", "Ratio", "+t", "-t", "versusAcc"],
-    "COCONUTS": common_customs + ["rsi", "rstatus"],
-    "BERRIES": common_customs + ["buyPrice", "sellPrice", "Diff"],
-    "DOLPHIN_SIGHTINGS": common_customs + ["trend0", "trend1", "trend2", "dolphinDays", "gearDays", "prediction"],
-    "DIVING_GEAR": common_customs + ["ultraLongTrend", "sellPrice", "buyPrice", "longTrend", "sd", "sdsAway"] ,
-    "DIP": common_customs + ["rsi", "rstatus"],
-    "BAGUETTE": common_customs + ["rsi", "rstatus"],
-    "UKULELE": common_customs + ["rsi", "overallVel", "bandVel", "upperPrice", "lowerPrice", "bbb"],
-    "PICNIC_BASKET": common_customs + ["rsi", "rstatus"],
-}
-
 custom_colors = ["red", "green", "blue", "orange", "purple", "silver", "black", "pink", "brown",  "olive", "cyan", "magenta",  "coral", "navy", "maroon", "violet",   "khaki", "indigo", "darkgreen", "darkblue", "darkred", "darkorange", "darkgray", "darkcyan", "darkmagenta", "darkolivegreen", "darkkhaki", "darkgoldenrod", "darkviolet", "darkslategray", "darkslateblue", "darkseagreen", "darkorchid"]
 
-#TIMESTAMP, PRODUCT, POSITION, BID, PRICE, ASK, shortMa, longMa, ultraLongMa, shortVel, longVel, ultraLongVel, shortAcc, longAcc, ultraLongAcc, custom1, custom2, custom3, custom4, custom5
-#day;timestamp;product;bid_price_1;bid_volume_1;bid_price_2;bid_volume_2;bid_price_3;bid_volume_3;ask_price_1;ask_volume_1;ask_price_2;ask_volume_2;ask_price_3;ask_volume_3;mid_price;profit_and_loss
-
-for i in [timestamps, prices, bids, asks, positions, pnls]:
-    for product in products:
-        i[product] = []
+parsed = parse_log(filename, plot_products, resultsMode, jsonMode=False)
+timestamps, prices, bids, asks = parsed['timestamps'], parsed['prices'], parsed['bids'], parsed['asks']
+positions, customs, pnls = parsed['positions'], parsed['customs'], parsed['pnls']
 
 for product in products:
-    customs[product] = [
-        [] for i in range(len(productToCustomSeries[product]) if product in productToCustomSeries else 0)
-    ]
     monkeyBuyTrades[product] = {}
     monkeySellTrades[product] = {}
     monkeyVolume[product] = {}
 
-jsonMode = False
-
-print("Opening file: " + filename)
-with open(filename, "r") as f:        
-    lines = f.readlines()
-    if jsonMode:
-        lines = lines[8].split('": "')[1].split("\\n")
-    for line in lines:
-        if len(line) < 3 or (line[1] != ";" and line[2] != ';' and (not "CSVDATA" in line or "TIMESTAMP" in line)): # skip header and all lines without CSVDATA, but don't skip lines with ; in them
-            continue
-        line = line.strip()
-
-        if line[1] == ";":
-            line = line.split(";")
-            product = line[2]
-            if product not in plot_products:
-                continue
-
-            timestamp = int(line[1] if line[1] != "" else timestamps[product][-1] + 100 if len(timestamps[product]) > 0 else 0)
-
-            if jsonMode:
-                timestamps[product].append(timestamp)
-                prices[product].append(float(line[-2]))
-
-            if timestamp not in timestamps[product] and resultsMode:
-                timestamps[product].append(timestamp)
-            
-            if timestamp in timestamps[product]:
-                pnls[product].append(float(line[-1]))
-                if resultsMode:
-                    prices[product].append(float(line[-2]))
-
-            # else:
-            #     print("Unknown timestamp: " + str(timestamp) + " for product " + product + " in line " + str.join(";", line))
-            #     pnls[product].append(0)
-            continue
-
-        line = line.split(",")
-        product = line[1].removeprefix('"').removesuffix('"') if len(line) > 1 else "UNKNOWN"
-        if product not in plot_products:
-            continue
-        timestamps[product].append(int(line[0].split(" ")[0]))
-        positions[product].append(float(line[2]))
-        prices[product].append(float(line[4]))
-        bids[product].append(float(line[3]))
-        asks[product].append(float(line[5]))
-        for i in range(6, len(line) - 1): # skip timestamp, product, position, bid, price, ask and CSVDATA
-            if i-6 >= len(customs[product]):
-                #print("ERROR: too many custom series for product " + product)
-                break
-            if line[i] == "True":
-                customs[product][i-6].append(1)
-            elif line[i] == "False":
-                customs[product][i-6].append(0)
-            else:
-                customs[product][i-6].append(float(line[i]))
-
 
 if plot_monkeys:
     with open(monkey_tradefile, "r") as f: # timestamp;buyer;seller;symbol;currency;price;quantity
@@ -216,18 +130,6 @@ if plot_monkeys:
             monkeyVolume[product][seller][timestamp] = float(values[6])
 
 
-for product in products:
-    if len(timestamps[product]) != len(pnls[product]):
-        print("Different lengths for timestamps and pnls for product " + product + ": " + str(len(timestamps[product])) + " vs " + str(len(pnls[product])) + ". Fixing...")
-        modified = 0
-        while len(timestamps[product]) > len(pnls[product]):
-            pnls[product].append(pnls[product][-1])
-            modified += 1
-        while len(timestamps[product]) < len(pnls[product]):
-            pnls[product].pop(0)
-            modified += 1
-        print("Modified " + str(modified) + " PnLs for product " + product)
-
 # UTILITY FUNCTIONS
 def make_patch_spines_invisible(ax):
     ax.set_frame_on(True)
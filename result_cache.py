@@ -0,0 +1,425 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from ab_diff import variant_class
+from analytics import total_metrics
+from walk_forward import REPO, TRAINING_DIR, import_backtester
+
+CACHE_DIR = os.path.join(REPO, '.result_cache')
+# the least recently used entries are evicted once the cache is larger than this
+DEFAULT_BUDGET = 512 * 1024 * 1024
+# bumped whenever an entry changes layout, entries of an older version are never hit again
+CACHE_VERSION = 1
+# everything besides the trader and the market data that decides the result of a backtest
+ENGINE_FILES = ['backtester.py', 'datamodel.py', 'analytics.py', 'book_features.py', 'trade_store.py', 'fill_model.py']
+# methods that change the container they are called on
+MUTATORS = {'append', 'extend', 'insert', 'pop', 'popitem', 'remove', 'clear', 'update', 'setdefault', 'sort', 'reverse', 'add', 'discard'}
+# per tick series of a product kept in an entry, the columns of the trace
+SERIES = ['positions', 'ordered', 'filled', 'mids', 'pnl']
+
+# sha256 of files and analyses of trader files, by path, modification time and size. Workers keep them between jobs
+file_digests: dict[tuple, str] = {}
+analyses: dict[tuple, 'TraderAnalysis'] = {}
+
+
+def file_stamp(path: str) -> tuple:
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def file_digest(path: str) -> str:
+    stamp = file_stamp(path)
+    if stamp not in file_digests:
+        with open(path, 'rb') as f:
+            file_digests[stamp] = hashlib.sha256(f.read()).hexdigest()
+    return file_digests[stamp]
+
+
+def engine_digest() -> str:
+    return hashlib.sha256(''.join(file_digest(os.path.join(REPO, name)) for name in ENGINE_FILES).encode()).hexdigest()
+
+
+# the prices and trades files backtester.load_day reads for a day
+def data_digest(round: int, day: int) -> str:
+    names = [f'prices_round_{round}_day_{day}.csv', f'trades_round_{round}_day_{day}_wn.csv']
+    return hashlib.sha256(''.join(file_digest(os.path.join(TRAINING_DIR, name)) for name in names).encode()).hexdigest()
+
+
+def is_self_attribute(node: ast.AST) -> bool:
+    return isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'self'
+
+
+'''
+How a method uses the attributes of self: (name, keyed) pairs it reads and writes, keyed meaning it only
+touches the entry self.name[product] of the product it was called for, or of run's loop over the products.
+Writes are assignments, deletions and mutating calls on self.name, on its items or on a local name bound to
+either. Also the methods it calls and its string constants
+'''
+class MethodAccess:
+    def __init__(self, function: ast.FunctionDef, methods: set[str], skip: set[ast.AST] = frozenset()):
+        self.calls: set[str] = set()
+        self.reads: set[tuple[str, bool]] = set()
+        self.writes: set[tuple[str, bool]] = set()
+        self.strings: set[str] = set()
+        self.parents = {child: node for node in ast.walk(function) for child in ast.iter_child_nodes(node)}
+        # the product a handler was called for, or run's loop over the products
+        loops = [node.target for node in ast.walk(function) if isinstance(node, ast.For)]
+        self.keyed_by = 'product' if any(arg.arg == 'product' for arg in function.args.args) or any(
+            isinstance(target, ast.Name) and target.id == 'product' for target in loops) else None
+
+        aliases: dict[str, tuple[str, bool]] = {}
+        nodes = [node for node in ast.walk(function) if node not in skip]
+        for node in nodes:
+            if is_self_attribute(node):
+                if node.attr in methods:
+                    self.calls.add(node.attr)
+                    continue
+                top, keyed, read, write = self.access(node)
+                if read:
+                    self.reads.add((node.attr, keyed))
+                if write:
+                    self.writes.add((node.attr, keyed))
+                parent = self.parents.get(top)
+                if isinstance(parent, ast.Assign) and parent.value is top:
+                    aliases.update({target.id: (node.attr, keyed) for target in parent.targets if isinstance(target, ast.Name)})
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+                self.strings.add(node.value)
+        for node in nodes:
+            if isinstance(node, ast.Name) and node.id in aliases and isinstance(node.ctx, ast.Load):
+                top, _, _, write = self.access(node)
+                if write and top is not node:
+                    self.writes.add(aliases[node.id])
+
+    # (outermost expression of the access, keyed, reads, writes) for self.name or an alias of it
+    def access(self, node: ast.AST) -> tuple[ast.AST, bool, bool, bool]:
+        top, keyed = node, False
+        while True:
+            parent = self.parents.get(top)
+            if isinstance(parent, ast.Subscript) and parent.value is top:
+                if top is node:
+                    keyed = self.keyed_by is not None and isinstance(parent.slice, ast.Name) and parent.slice.id == self.keyed_by
+                top = parent
+            elif isinstance(parent, ast.Attribute) and parent.value is top:
+                call = self.parents.get(parent)
+                if parent.attr in MUTATORS and isinstance(call, ast.Call) and call.func is parent:
+                    # a pop or setdefault whose value is used also reads
+                    return top, keyed, not isinstance(self.parents.get(call), ast.Expr), True
+                top = parent
+            else:
+                break
+        store = isinstance(getattr(top, 'ctx', None), (ast.Store, ast.Del))
+        augmented = isinstance(self.parents.get(top), ast.AugAssign)
+        return top, keyed, not store or augmented, store
+
+
+# whether writes can change what reads see, entries of the same product's slot are the one exception
+def conflicts(writes: set[tuple[str, bool]], reads: set[tuple[str, bool]]) -> bool:
+    return any(name == other and not (keyed and other_keyed) for name, keyed in writes for other, other_keyed in reads)
+
+
+'''
+What the result of every product depends on in a trader file, read from its source without running it.
+run dispatches each product to its handlers with `if product == 'NAME':`, everything run and __init__ reach
+outside of those branches is shared by every product. A product depends on its own handlers and the methods
+only they reach, and on the handlers of other products that write an attribute it reads (directly or through
+shared code) or whose name it mentions, like a handler reading another product's position. Attributes set
+through getattr/setattr with a computed name are not seen, main.py only does that to restore its snapshot.
+A parameter only goes into the keys of the products whose code uses it. A file without that layout is treated as one piece, every product then depends on all of it
+'''
+class TraderAnalysis:
+    def __init__(self, path: str):
+        with open(os.path.join(REPO, path)) as f:
+            module = ast.parse(f.read())
+        trader = next((node for node in module.body if isinstance(node, ast.ClassDef) and node.name == 'Trader'), None)
+        functions = {node.name: node for node in trader.body if isinstance(node, ast.FunctionDef)} if trader else {}
+        self.handlers: dict[str, set[str]] = {}
+        branches: set[ast.AST] = set()
+        for node in ast.walk(functions['run']) if 'run' in functions else []:
+            product = self.dispatched_product(node)
+            if product is None:
+                continue
+            handlers = self.handlers.setdefault(product, set())
+            for statement in node.body:
+                for child in ast.walk(statement):
+                    branches.add(child)
+                    if is_self_attribute(child) and child.attr in functions:
+                        handlers.add(child.attr)
+
+        self.access = {name: MethodAccess(function, set(functions), branches if name == 'run' else frozenset()) for name, function in functions.items()}
+        self.shared = self.reached([name for name in ['run', '__init__'] if name in functions]) if self.handlers else set(functions)
+        self.own = {product: self.reached(handlers) - self.shared for product, handlers in self.handlers.items()}
+        self.depends = {product: self.dependencies(product) for product in self.own}
+        # class attributes with a constant default, the ones a sweep overrides
+        self.settings = [target.id for node in (trader.body if trader else []) if isinstance(node, (ast.Assign, ast.AnnAssign))
+                         and isinstance(node.value, ast.Constant) for target in (node.targets if isinstance(node, ast.Assign) else [node.target])
+                         if isinstance(target, ast.Name)]
+        # attributes that may be reached other than as self.name, through the class, getattr or a string naming them
+        self.loose = {node.attr for node in ast.walk(module) if isinstance(node, ast.Attribute) and not is_self_attribute(node)}
+        self.loose |= {node.value for node in ast.walk(module) if isinstance(node, ast.Constant) and isinstance(node.value, str)}
+
+        owned = set().union(*self.own.values()) if self.own else set()
+        if trader:
+            trader.body = [node for node in trader.body if not (isinstance(node, ast.FunctionDef) and node.name in owned)]
+        self.method_digests = {name: hashlib.sha256(ast.unparse(functions[name]).encode()).hexdigest() for name in owned}
+        # comments and formatting are not part of the digests, the source goes through the parser first
+        self.shared_digest = hashlib.sha256(ast.unparse(module).encode()).hexdigest()
+
+    # the product of `if product == 'NAME':` (either way round), None for any other statement
+    @staticmethod
+    def dispatched_product(node: ast.AST) -> str | None:
+        if not isinstance(node, ast.If) or not isinstance(node.test, ast.Compare) or len(node.test.ops) != 1 or not isinstance(node.test.ops[0], ast.Eq):
+            return None
+        sides = [node.test.left, node.test.comparators[0]]
+        names = [side for side in sides if isinstance(side, ast.Name)]
+        constants = [side.value for side in sides if isinstance(side, ast.Constant) and isinstance(side.value, str)]
+        return constants[0] if names and constants else None
+
+    def reached(self, start) -> set[str]:
+        seen, pending = set(), list(start)
+        while pending:
+            name = pending.pop()
+            if name not in seen:
+                seen.add(name)
+                pending += self.access[name].calls
+        return seen
+
+    def reads(self, methods: set[str]) -> set[tuple[str, bool]]:
+        return set().union(*(self.access[name].reads for name in methods))
+
+    def writes(self, methods: set[str]) -> set[tuple[str, bool]]:
+        return set().union(*(self.access[name].writes for name in methods))
+
+    # the products whose handlers must run for product's result to be right, product included
+    def dependencies(self, product: str) -> set[str]:
+        # a write reaches a read directly or through a chain of shared methods
+        def influences(writes: set, reads: set) -> bool:
+            if conflicts(writes, reads):
+                return True
+            reached, pending = set(), [writes]
+            while pending:
+                current = pending.pop()
+                for name in self.shared - reached:
+                    if conflicts(current, self.access[name].reads):
+                        reached.add(name)
+                        if conflicts(self.access[name].writes, reads):
+                            return True
+                        pending.append(self.access[name].writes)
+            return False
+
+        result = {product}
+        while True:
+            methods = set().union(*(self.own[other] for other in result))
+            reads = self.reads(methods)
+            strings = set().union(*(self.access[name].strings for name in methods))
+            added = {other for other in self.own if other not in result
+                     and (other in strings or influences(self.writes(self.own[other]), reads))}
+            if not added:
+                return result
+            result |= added
+
+    # digest of everything a product's result depends on in the file
+    def product_digest(self, product: str) -> str:
+        methods = sorted(set().union(*(self.own[other] for other in self.depends[product]))) if product in self.own else []
+        parts = [self.shared_digest, product] + [f'{name}:{self.method_digests[name]}' for name in methods]
+        return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+    # whether overriding the class attribute name can change product's result
+    def uses(self, product: str, name: str) -> bool:
+        if product not in self.own or name in self.loose:
+            return True
+        methods = self.shared.union(*(self.own[other] for other in self.depends[product]))
+        return any(name == used for used, _ in self.reads(methods) | self.writes(methods))
+
+    # products that have to run so that every one of products is right
+    def needed(self, products) -> set[str]:
+        return set().union(*(self.depends.get(product, {product}) for product in products))
+
+    # handlers that can be left out when only the needed products have to be right
+    def skippable(self, needed: set[str]) -> set[str]:
+        kept = self.shared.union(*(self.reached(self.handlers[product]) for product in needed if product in self.handlers))
+        return set().union(*(self.handlers[product] for product in self.handlers if product not in needed)) - kept
+
+
+def analyze(path: str) -> TraderAnalysis:
+    stamp = file_stamp(os.path.join(REPO, path))
+    if stamp not in analyses:
+        analyses[stamp] = TraderAnalysis(path)
+    return analyses[stamp]
+
+
+# identifies the result of one product of a backtest by everything it depends on, the parameters it does not use left out
+def product_key(analysis: TraderAnalysis, product: str, params: dict, round: int, day: int, time_limit: int, fill_model: dict | None) -> str:
+    used = {name: value for name, value in params.items() if analysis.uses(product, name)}
+    inputs = json.dumps([CACHE_VERSION, engine_digest(), data_digest(round, day), analysis.product_digest(product),
+                         used, round, day, time_limit, fill_model], sort_keys=True)
+    return hashlib.sha256(inputs.encode()).hexdigest()
+
+
+# stands in for the handlers of products whose results are not needed, they place no orders
+def skip_handler(self, *args, **kwargs):
+    return []
+
+
+'''
+Directory of per product results, one compressed .npz per key: the product's per tick series, its fills and
+its metrics. A hit refreshes the file's modification time, evict removes the least recently used files until
+the cache fits its budget. Entries are written to a temporary file first, so workers can share the directory
+'''
+class ResultCache:
+    def __init__(self, directory: str = CACHE_DIR, budget: int = DEFAULT_BUDGET):
+        self.directory = directory
+        self.budget = budget
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def get(self, key: str) -> dict | None:
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                entry = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        entry['metrics'] = json.loads(str(entry['metrics']))
+        return entry
+
+    def put(self, key: str, entry: dict):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez_compressed(f, **{name: value for name, value in entry.items() if name != 'metrics'}, metrics=json.dumps(entry['metrics']))
+        os.replace(temporary, path)
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        found = []
+        for folder, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.npz'):
+                    stat = os.stat(os.path.join(folder, name))
+                    found.append((stat.st_mtime, stat.st_size, os.path.join(folder, name)))
+        return found
+
+    # removes the least recently used entries past the budget, returns how many and their bytes
+    def evict(self) -> tuple[int, int]:
+        found = sorted(self.entries())
+        excess = sum(size for _, size, _ in found) - self.budget
+        removed = freed = 0
+        for _, size, path in found:
+            if freed >= excess:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += size
+        return removed, freed
+
+    def clear(self) -> int:
+        found = self.entries()
+        for _, _, path in found:
+            os.remove(path)
+        return len(found)
+
+
+# a product's columns of a backtest and its fills, as stored in the cache
+def product_entry(arrays: dict[str, np.ndarray], pnl: np.ndarray, reasons: list[str], column: int, metrics: dict[str, float]) -> dict:
+    fills = arrays['fill_symbols'] == column
+    return {
+        'times': arrays['times'],
+        **{name: (pnl if name == 'pnl' else arrays[name])[:, column] for name in SERIES},
+        'fill_ticks': arrays['fill_ticks'][fills],
+        'fill_prices': arrays['fill_prices'][fills],
+        'fill_quantities': arrays['fill_quantities'][fills],
+        'fill_reasons': np.array([reasons[i] for i in arrays['fill_reasons'][fills]], dtype=str),
+        'metrics': metrics,
+    }
+
+
+'''
+Backtests one day like results_db.run_record, serving every product whose key is in the cache from there.
+When some are missing only those and the products they depend on are simulated, the handlers of the others
+are replaced by skip_handler. Returns the trace in ab_diff's format with the fills added, the metrics per
+product and of the total, and which products were recomputed or came from the cache. Without a cache
+directory everything is simulated. Runs in a worker process
+'''
+def cached_run(trader: str, params: dict, round: int, day: int, time_limit: int = 999900, fill_model: dict | None = None,
+               cache_dir: str | None = CACHE_DIR) -> dict:
+    backtester = import_backtester()
+    with backtester.quiet():
+        analysis = analyze(trader)
+        symbols = backtester.SYMBOLS_BY_ROUND_POSITIONABLE[round]
+        cache = ResultCache(cache_dir) if cache_dir else None
+        keys = {symbol: product_key(analysis, symbol, params, round, day, time_limit, fill_model) for symbol in symbols} if cache else {}
+        entries = {symbol: cache.get(keys[symbol]) for symbol in symbols} if cache else {}
+        missing = [symbol for symbol in symbols if entries.get(symbol) is None]
+
+        if missing:
+            trader_class = variant_class(trader, params)
+            skipped = analysis.skippable(analysis.needed(missing))
+            if skipped:
+                trader_class = type('PartialTrader', (trader_class,), {name: skip_handler for name in skipped})
+            model = backtester.FillModel(**fill_model) if fill_model else None
+            states, trade_store, mids_by_time = backtester.load_day(round, day, time_limit)
+            trace = backtester.Trace(symbols)
+            _, _, profits_by_symbol, balance_by_symbol = backtester.trades_position_pnl_run(
+                states, max(states), *backtester.initial_accounting(states), trader=trader_class(), round=round,
+                halfway=model.halfway if model else True, mids_by_time=mids_by_time, restart_at=None, persist_state=False,
+                trade_store=trade_store, trace=trace, fill_model=model)
+            pnl = backtester.pnl_matrix(profits_by_symbol, balance_by_symbol, trace.times, trace.symbols)
+            metrics = backtester.compute_metrics(trace, pnl, backtester.current_limits)
+            arrays = trace.arrays()
+            for symbol in missing:
+                entries[symbol] = product_entry(arrays, pnl, trace.reasons, trace.index[symbol], metrics[symbol])
+                if cache:
+                    cache.put(keys[symbol], entries[symbol])
+
+        fills = {name: np.concatenate([entries[symbol][name] for symbol in symbols])
+                 for name in ['fill_ticks', 'fill_prices', 'fill_quantities', 'fill_reasons']}
+        fills['fill_symbols'] = np.concatenate([np.full(len(entries[symbol]['fill_ticks']), i) for i, symbol in enumerate(symbols)])
+        order = np.argsort(fills['fill_ticks'], kind='stable')
+        trace = {'times': entries[symbols[0]]['times'], 'symbols': list(symbols), 'customs': {},
+                 **{name: np.column_stack([entries[symbol][name] for symbol in symbols]) for name in SERIES},
+                 **{name: values[order] for name, values in fills.items()}}
+        return {'trace': trace, 'metrics': {symbol: entries[symbol]['metrics'] for symbol in symbols}, 'total': total_metrics(trace['pnl']),
+                'recomputed': missing, 'cached': [symbol for symbol in symbols if symbol not in missing]}
+
+
+def explain(analysis: TraderAnalysis) -> str:
+    lines = [f'{"product":<20}{"digest":<14}{"handlers":<32}{"depends on":<36}parameters of its own']
+    for product, handlers in analysis.handlers.items():
+        depends = ', '.join(sorted(analysis.depends[product] - {product})) or '-'
+        own = [name for name in analysis.settings if analysis.uses(product, name) and not all(analysis.uses(other, name) for other in analysis.own)]
+        lines.append(f'{product:<20}{analysis.product_digest(product)[:12]:<14}{", ".join(sorted(handlers)) or "-":<32}{depends:<36}{", ".join(own) or "-"}')
+    lines.append(f'{len(analysis.shared)} shared methods, digest {analysis.shared_digest[:12]}')
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspects and trims the per product backtest result cache')
+    parser.add_argument('--dir', default=CACHE_DIR)
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET / 2 ** 20, help='megabytes kept by --evict')
+    parser.add_argument('--evict', action='store_true', help='remove the least recently used entries past the budget')
+    parser.add_argument('--clear', action='store_true', help='remove every entry')
+    parser.add_argument('--explain', metavar='TRADER', help='show what each product of a trader file is keyed on')
+    args = parser.parse_args()
+
+    cache = ResultCache(args.dir, int(args.budget * 2 ** 20))
+    if args.explain:
+        print(explain(analyze(args.explain)))
+    if args.clear:
+        print(f'Removed {cache.clear()} entries')
+    if args.evict:
+        start = time.perf_counter()
+        removed, freed = cache.evict()
+        print(f'Evicted {removed} entries, {freed / 2 ** 20:.1f} MB in {time.perf_counter() - start:.2f}s')
+    found = cache.entries()
+    print(f'{len(found)} entries, {sum(size for _, size, _ in found) / 2 ** 20:.1f} MB of {cache.budget / 2 ** 20:.1f} MB in {cache.directory}')
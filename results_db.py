@@ -0,0 +1,312 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ab_diff import save_run
+from result_cache import CACHE_DIR, DEFAULT_BUDGET, ResultCache, cached_run
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DB_PATH = os.path.join(REPO, 'results.sqlite')
+TRACE_DIR = os.path.join(REPO, 'results')
+
+# the symbol the metrics of the whole run are stored under
+TOTAL = 'total'
+# runs written per transaction while a sweep is running
+INSERT_BATCH = 64
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_key TEXT UNIQUE NOT NULL,
+    created REAL NOT NULL,
+    source TEXT,
+    trader TEXT NOT NULL,
+    trader_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    time_limit INTEGER NOT NULL,
+    fill_model TEXT,
+    trace_path TEXT,
+    profit REAL,
+    max_drawdown REAL,
+    sharpe REAL
+);
+CREATE INDEX IF NOT EXISTS runs_by_data ON runs (round, day, trader_hash);
+CREATE INDEX IF NOT EXISTS runs_by_profit ON runs (profit);
+CREATE INDEX IF NOT EXISTS runs_by_sharpe ON runs (sharpe);
+CREATE TABLE IF NOT EXISTS params (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS params_by_value ON params (name, value, run_id);
+CREATE INDEX IF NOT EXISTS params_by_text ON params (name, text, run_id);
+CREATE INDEX IF NOT EXISTS params_by_run ON params (run_id, name);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    symbol TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS metrics_by_value ON metrics (name, symbol, value, run_id);
+CREATE INDEX IF NOT EXISTS metrics_by_run ON metrics (run_id, symbol, name);
+'''
+
+OPERATORS = ['>=', '<=', '!=', '=', '>', '<']
+
+
+# sha256 of a trader file, the same file gives the same hash wherever the repo is
+def trader_hash(path: str) -> str:
+    with open(os.path.join(REPO, path), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# identifies a run by everything that decides its result, recording the same run again replaces it.
+# kind keeps records with less in them (profit_record) from replacing a full record of the same run
+def run_key(trader_digest: str, params: dict, round: int, day: int, time_limit: int, fill_model: dict | None, kind: str | None = None) -> str:
+    inputs = [trader_digest, params, round, day, time_limit, fill_model] + ([kind] if kind else [])
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+'''
+Backtests one day with the trader file's Trader, params overriding its class attributes, and returns
+the record the results database stores: the run's metadata, the metrics of every product and of the total
+and, when trace_dir is given, the path of the per tick trace saved there in ab_diff's format
+(load it with ab_diff.load_run, or diff it with ab_diff.py --a-load). Products whose result is in the
+cache at cache_dir are not simulated again, see result_cache.py. Runs in a worker process
+'''
+def run_record(trader: str, params: dict, round: int, day: int, time_limit: int = 999900, fill_model: dict | None = None,
+               trace_dir: str | None = TRACE_DIR, source: str | None = None, cache_dir: str | None = CACHE_DIR) -> dict:
+    result = cached_run(trader, params, round, day, time_limit, fill_model, cache_dir)
+    metrics = dict(result['metrics'])
+    metrics[TOTAL] = result['total']
+
+    digest = trader_hash(trader)
+    key = run_key(digest, params, round, day, time_limit, fill_model)
+    trace_path = None
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+        trace_path = os.path.join(trace_dir, key + '.npz')
+        save_run(trace_path, {day: result['trace']})
+    return {'run_key': key, 'created': time.time(), 'source': source, 'trader': trader, 'trader_hash': digest,
+            'params': params, 'round': round, 'day': day, 'time_limit': time_limit, 'fill_model': fill_model,
+            'trace_path': trace_path, 'metrics': metrics, 'recomputed': result['recomputed'], 'cached': result['cached']}
+
+
+# record of a run only known by its final profit per symbol, like the optimizer's evaluations
+def profit_record(trader: str, params: dict, round: int, day: int, time_limit: int, profits: dict[str, float], source: str | None = None) -> dict:
+    digest = trader_hash(trader)
+    metrics = {symbol: {'profit': profit} for symbol, profit in profits.items()}
+    metrics[TOTAL] = {'profit': sum(profits.values())}
+    return {'run_key': run_key(digest, params, round, day, time_limit, None, 'profit'), 'created': time.time(), 'source': source, 'trader': trader,
+            'trader_hash': digest, 'params': params, 'round': round, 'day': day, 'time_limit': time_limit, 'fill_model': None,
+            'trace_path': None, 'metrics': metrics}
+
+
+'''
+SQLite store of backtest runs: one row per run with its metadata and total profit, drawdown and Sharpe,
+the parameters one row each (numbers in value, everything else as JSON in text) and every metric per product,
+all indexed so runs can be filtered by parameter and ranked by metric without loading them
+'''
+class ResultsDB:
+    def __init__(self, path: str = RESULTS_DB_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # records as returned by run_record, in one transaction. Returns their ids
+    def insert_many(self, records: list[dict]) -> list[int]:
+        ids = []
+        with self.connection:
+            for record in records:
+                total = record['metrics'].get(TOTAL, {})
+                self.connection.execute('DELETE FROM runs WHERE run_key = ?', (record['run_key'],))
+                cursor = self.connection.execute(
+                    'INSERT INTO runs (run_key, created, source, trader, trader_hash, params, round, day, time_limit, fill_model, '
+                    'trace_path, profit, max_drawdown, sharpe) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (record['run_key'], record['created'], record.get('source'), record['trader'], record['trader_hash'],
+                     json.dumps(record['params'], sort_keys=True), record['round'], record['day'], record['time_limit'],
+                     json.dumps(record['fill_model'], sort_keys=True) if record.get('fill_model') else None,
+                     record.get('trace_path'), total.get('profit'), total.get('max_drawdown'), total.get('sharpe')))
+                ids.append(cursor.lastrowid)
+                self.connection.executemany('INSERT INTO params (run_id, name, value, text) VALUES (?, ?, ?, ?)',
+                                            [(cursor.lastrowid, name, *param_columns(value)) for name, value in record['params'].items()])
+                self.connection.executemany('INSERT INTO metrics (run_id, symbol, name, value) VALUES (?, ?, ?, ?)',
+                                            [(cursor.lastrowid, symbol, name, value) for symbol, values in record['metrics'].items()
+                                             for name, value in values.items()])
+        return ids
+
+    '''
+    Runs matching every filter that have the ranked metric, best first by that metric of a symbol (TOTAL for the whole run).
+    params and metrics are lists of (name, operator, value), a metric filter applies to the ranked symbol.
+    Returns the runs with their parameters and the ranked symbol's metrics
+    '''
+    def query(self, round: int | None = None, day: int | None = None, trader_hash: str | None = None, params: list[tuple] = [],
+              metrics: list[tuple] = [], order_by: str = 'profit', symbol: str = TOTAL, limit: int | None = 20, ascending=False) -> list[dict]:
+        conditions, values = [], []
+        for column, value in (('round', round), ('day', day)):
+            if value is not None:
+                conditions.append(f'runs.{column} = ?')
+                values.append(value)
+        if trader_hash:
+            conditions.append('runs.trader_hash LIKE ?')
+            values.append(trader_hash + '%')
+        for name, operator, value in params + metrics:
+            # the operators go into the SQL as they are
+            if operator not in OPERATORS:
+                raise ValueError(f'Unknown operator {operator!r} in filter on {name}, expected one of {OPERATORS}')
+        for name, operator, value in params:
+            number, text = param_columns(value)
+            column, value = ('value', number) if text is None else ('text', text)
+            conditions.append(f'EXISTS (SELECT 1 FROM params WHERE params.run_id = runs.id AND params.name = ? AND params.{column} {operator} ?)')
+            values += [name, value]
+        for name, operator, value in metrics:
+            conditions.append(f'EXISTS (SELECT 1 FROM metrics WHERE metrics.run_id = runs.id AND metrics.name = ? AND metrics.symbol = ? AND metrics.value {operator} ?)')
+            values += [name, symbol, value]
+
+        # walks the ranked metric's index in order and stops at the limit, runs without that metric are left out
+        sql = ('SELECT runs.id, runs.trader, runs.trader_hash, runs.params, runs.round, runs.day, runs.time_limit, runs.fill_model, runs.trace_path '
+               'FROM metrics AS ranked JOIN runs ON runs.id = ranked.run_id WHERE ranked.name = ? AND ranked.symbol = ? AND ranked.value IS NOT NULL')
+        for condition in conditions:
+            sql += ' AND ' + condition
+        sql += f' ORDER BY ranked.value {"ASC" if ascending else "DESC"}'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        rows = self.connection.execute(sql, [order_by, symbol] + values).fetchall()
+
+        runs = [{'id': row[0], 'trader': row[1], 'trader_hash': row[2], 'params': json.loads(row[3]), 'round': row[4], 'day': row[5],
+                 'time_limit': row[6], 'fill_model': json.loads(row[7]) if row[7] else None, 'trace_path': row[8], 'metrics': {}} for row in rows]
+        by_id = {run['id']: run for run in runs}
+        if by_id:
+            marks = ','.join('?' * len(by_id))
+            for run_id, name, value in self.connection.execute(f'SELECT run_id, name, value FROM metrics WHERE symbol = ? AND run_id IN ({marks})',
+                                                               [symbol, *by_id]):
+                by_id[run_id]['metrics'][name] = value
+        return runs
+
+    def count(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+
+# (value, text) columns of a parameter: numbers and booleans are searchable by range, the rest by equality on its JSON
+def param_columns(value) -> tuple:
+    if isinstance(value, (bool, int, float)):
+        return float(value), None
+    return None, json.dumps(value, sort_keys=True)
+
+
+# 'name>=3' -> ('name', '>=', 3.0), a value that is not JSON is taken as a string
+def parse_filter(text: str) -> tuple:
+    for operator in OPERATORS:
+        if operator in text:
+            name, value = text.split(operator, 1)
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError:
+                pass
+            return name.strip(), operator, value
+    raise ValueError(f'No operator in filter {text}, expected one of {OPERATORS}')
+
+
+'''
+Backtests every parameter set on every day in parallel and writes the runs to the database as they finish,
+INSERT_BATCH per transaction. Workers only compute, the database is written by this process alone.
+With a cache, product results are served from it when they can be and the cache is trimmed to its budget
+at the end. Returns the ids of the runs and how many product results were recomputed and served from the cache
+'''
+def sweep(db: ResultsDB, trader: str, points: list[dict], round: int, days: list[int], time_limit: int = 999900,
+          fill_model: dict | None = None, trace_dir: str | None = TRACE_DIR, workers: int | None = None, source: str = 'sweep',
+          cache: ResultCache | None = None) -> tuple[list[int], int, int]:
+    ids, pending = [], []
+    recomputed = cached = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(run_record, trader, params, round, day, time_limit, fill_model, trace_dir, source, cache.directory if cache else None)
+                for params in points for day in days]
+        for job in as_completed(jobs):
+            record = job.result()
+            recomputed += len(record['recomputed'])
+            cached += len(record['cached'])
+            pending.append(record)
+            if len(pending) >= INSERT_BATCH:
+                ids += db.insert_many(pending)
+                pending = []
+    ids += db.insert_many(pending)
+    if cache:
+        cache.evict()
+    return ids, recomputed, cached
+
+
+def report(runs: list[dict], order_by: str) -> str:
+    columns = ['profit', 'max_drawdown', 'sharpe']
+    if order_by not in columns:
+        columns.append(order_by)
+    lines = [f'{"id":>6}  {"trader":<10}{"round":>6}{"day":>5}' + ''.join(f'{name:>14}' for name in columns) + '  params']
+    for run in runs:
+        lines.append(f'{run["id"]:>6}  {run["trader_hash"][:8]:<10}{run["round"]:>6}{run["day"]:>5}'
+                     + ''.join(f'{run["metrics"].get(name, float("nan")):>14.2f}' for name in columns)
+                     + '  ' + json.dumps(run['params'], sort_keys=True))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Records backtest runs in a SQLite database and queries them')
+    parser.add_argument('--db', default=RESULTS_DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sweep_parser = commands.add_parser('sweep', help='backtest a grid of parameters and record every run')
+    sweep_parser.add_argument('--trader', default='main.py', help='trader file relative to the repo')
+    sweep_parser.add_argument('--grid', default='{}', help='JSON object of parameter name to list of values')
+    sweep_parser.add_argument('--round', type=int, default=2)
+    sweep_parser.add_argument('--days', type=int, nargs='+', default=[0])
+    sweep_parser.add_argument('--time-limit', type=int, default=999900)
+    sweep_parser.add_argument('--fill-profile', help='fill profile JSON written by calibrate_fills.py')
+    sweep_parser.add_argument('--no-traces', action='store_true', help='do not save the per tick traces')
+    sweep_parser.add_argument('--no-cache', action='store_true', help='simulate every product of every run, see result_cache.py')
+    sweep_parser.add_argument('--cache-budget', type=float, default=DEFAULT_BUDGET / 2 ** 20, help='megabytes the result cache is trimmed to')
+    sweep_parser.add_argument('--workers', type=int, default=None)
+
+    query_parser = commands.add_parser('query', help='list recorded runs, best first')
+    query_parser.add_argument('--round', type=int)
+    query_parser.add_argument('--day', type=int)
+    query_parser.add_argument('--trader-hash', help='prefix of the trader hash')
+    query_parser.add_argument('--param', action='append', default=[], help='filter like shortMovingAverageSize>=10')
+    query_parser.add_argument('--metric', action='append', default=[], help='filter like sharpe>1 on the ranked symbol')
+    query_parser.add_argument('--order-by', default='profit', help='metric to rank by')
+    query_parser.add_argument('--symbol', default=TOTAL, help=f'product the metrics are of, {TOTAL} for the whole run')
+    query_parser.add_argument('--ascending', action='store_true')
+    query_parser.add_argument('--top', type=int, default=20)
+    query_parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    db = ResultsDB(args.db)
+    if args.command == 'sweep':
+        from walk_forward import grid_points
+        from fill_model import FillModel
+        fill_model = FillModel.load(args.fill_profile).params() if args.fill_profile else None
+        start = time.perf_counter()
+        cache = None if args.no_cache else ResultCache(CACHE_DIR, int(args.cache_budget * 2 ** 20))
+        ids, recomputed, cached = sweep(db, args.trader, grid_points(json.loads(args.grid)), args.round, args.days, args.time_limit, fill_model,
+                                        None if args.no_traces else TRACE_DIR, args.workers, cache=cache)
+        print(f'Recorded {len(ids)} runs in {time.perf_counter() - start:.1f}s, {db.count()} in {args.db}')
+        print(f'{recomputed} product results simulated, {cached} from the cache')
+    else:
+        start = time.perf_counter()
+        runs = db.query(args.round, args.day, args.trader_hash, [parse_filter(text) for text in args.param],
+                        [parse_filter(text) for text in args.metric], args.order_by, args.symbol, args.top, args.ascending)
+        if args.json:
+            print(json.dumps(runs, indent=2))
+        else:
+            print(report(runs, args.order_by))
+            print(f'{len(runs)} runs in {(time.perf_counter() - start) * 1000:.1f} ms')
+    db.close()
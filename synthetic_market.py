@@ -0,0 +1,342 @@
+import argparse
+import glob
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from book_features import LEVELS, book_arrays, compute_book_features
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+TRAINING_DIR = os.path.join(REPO, 'training')
+CALIBRATION_PATH = os.path.join(REPO, 'synthetic_calibration.json')
+
+TICKS = 10000
+TIME_DELTA = 100
+
+SYMBOLS_BY_ROUND = {
+    1: ['PEARLS', 'BANANAS'],
+    2: ['PEARLS', 'BANANAS', 'COCONUTS', 'PINA_COLADAS'],
+    3: ['PEARLS', 'BANANAS', 'COCONUTS', 'PINA_COLADAS', 'DIVING_GEAR', 'DOLPHIN_SIGHTINGS', 'BERRIES'],
+    4: ['PEARLS', 'BANANAS', 'COCONUTS', 'PINA_COLADAS', 'DIVING_GEAR', 'DOLPHIN_SIGHTINGS', 'BERRIES', 'BAGUETTE', 'DIP', 'UKULELE', 'PICNIC_BASKET'],
+}
+
+# PICNIC_BASKET is quoted around its contents plus a premium
+BASKET_LEGS = {'BAGUETTE': 2, 'DIP': 4, 'UKULELE': 1}
+
+# no prices file of round 3 made it into training/, so the sightings and the way diving gear follows them are not fitted
+DOLPHIN_DEFAULTS = {'start': 3000.0, 'sigma': 1.0, 'jump_probability': 0.0005, 'jump_sigma': 10.0}
+GEAR_RESPONSE_DEFAULTS = {'per_sighting': 30.0, 'ticks': 1000}
+
+SHAPES_PER_PRODUCT = 1000
+SEASONAL_BINS = 100
+
+
+'''
+Least squares fit of x[t+1] - x[t] = theta * (mu - x[t]) + sigma * noise over every series.
+theta 0 is a random walk, mu is then meaningless and set to the mean level
+'''
+def fit_ou(series: list[np.ndarray]) -> dict[str, float]:
+    x = np.concatenate([s[:-1] for s in series])
+    dx = np.concatenate([np.diff(s) for s in series])
+    slope, intercept = np.polyfit(x, dx, 1)
+    theta = float(min(max(-slope, 0.0), 1.0))
+    mu = float(intercept / theta) if theta > 1e-6 else float(x.mean())
+    residual = dx - (intercept + slope * x) if theta > 1e-6 else dx - dx.mean()
+    return {'mu': mu, 'theta': theta, 'sigma': float(residual.std()), 'start': float(np.mean([s[0] for s in series]))}
+
+
+def fill(values: np.ndarray) -> np.ndarray:
+    series = pd.Series(values)
+    return series.ffill().bfill().to_numpy()
+
+
+# per tick mid of every product of a prices file, filled where a side of the book is empty
+def price_file_mids(df_prices) -> dict[str, np.ndarray]:
+    book = book_arrays(df_prices)
+    features = compute_book_features(book)
+    mids = {}
+    for product in np.unique(book['product']):
+        rows = book['product'] == product
+        mids[str(product)] = fill(features['mid'][rows])
+    return mids
+
+
+# per tick last traded price of a symbol, filled before the first trade
+def trade_file_series(df_trades, symbol: str) -> np.ndarray | None:
+    trades = df_trades[df_trades['symbol'] == symbol]
+    if len(trades) == 0:
+        return None
+    last = trades.groupby('timestamp')['price'].last()
+    series = np.full(TICKS, np.nan)
+    series[(last.index.to_numpy() // TIME_DELTA).clip(0, TICKS - 1)] = last.to_numpy()
+    return fill(series)
+
+
+'''
+Offsets from the mid and volumes of every level of a sample of the real books of a product,
+(n, LEVELS) arrays per side with volume 0 for a missing level. Generated books draw whole shapes
+from it, so spread and depth keep their joint distribution
+'''
+def book_shapes(df_prices, product: str, rng: np.random.Generator) -> dict[str, list]:
+    book = book_arrays(df_prices[df_prices['product'] == product])
+    mid = compute_book_features(book)['mid']
+    rows = np.flatnonzero(~np.isnan(mid))
+    rows = rng.choice(rows, size=min(SHAPES_PER_PRODUCT, len(rows)), replace=False)
+    shapes = {}
+    for side in ['bid', 'ask']:
+        prices, volumes = book[f'{side}_price'][rows], book[f'{side}_volume'][rows]
+        present = prices > 0
+        shapes[f'{side}_offset'] = np.where(present, prices - mid[rows, None], 0).tolist()
+        shapes[f'{side}_volume'] = np.where(present, volumes, 0).astype(int).tolist()
+    return shapes
+
+
+# a one level book for symbols only known from their trades, half a typical trade to trade move away from the mid
+def default_shapes(series: np.ndarray, quantities: np.ndarray) -> dict[str, list]:
+    moves = np.abs(np.diff(series))
+    half_spread = max(1.0, float(np.median(moves[moves > 0])) / 2) if (moves > 0).any() else 1.0
+    volume = int(max(1, np.median(quantities) * 3))
+    empty = [0] * (LEVELS - 1)
+    return {
+        'bid_offset': [[-half_spread] + empty], 'bid_volume': [[volume] + empty],
+        'ask_offset': [[half_spread] + empty], 'ask_volume': [[volume] + empty],
+    }
+
+
+def trade_statistics(trade_files: list, symbol: str) -> dict:
+    counts, quantities, names = [], [], []
+    for df in trade_files:
+        trades = df[df['symbol'] == symbol]
+        if len(trades) == 0:
+            continue
+        counts.append(len(trades))
+        quantities += trades['quantity'].astype(int).tolist()
+        names += trades['buyer'].fillna('nan').astype(str).tolist() + trades['seller'].fillna('nan').astype(str).tolist()
+    return {
+        'rate': float(np.mean(counts)) / TICKS if counts else 0.0,
+        'quantities': quantities[:2000],
+        'names': sorted(set(names)),
+    }
+
+
+'''
+Fits every product's model from the CSVs in training_dir:
+PEARLS, BANANAS and COCONUTS as Ornstein-Uhlenbeck processes (a random walk when no mean reversion shows),
+PINA_COLADAS as beta * COCONUTS plus a mean reverting spread, BERRIES as the average intraday shape of
+its trade prices plus noise, DIVING_GEAR as a random walk pushed by DOLPHIN_SIGHTINGS jumps, the round 4
+products as OU processes on their trade prices with PICNIC_BASKET priced from its legs plus a premium.
+Book shapes come from the prices files, trade rates, sizes and counterparties from the trades files
+'''
+def calibrate(training_dir: str = TRAINING_DIR, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    price_files = [pd.read_csv(path, sep=';') for path in sorted(glob.glob(os.path.join(training_dir, 'prices_round_*_day_*.csv')))]
+    trade_paths = sorted(glob.glob(os.path.join(training_dir, 'trades_round_*_day_*_wn.csv')))
+    trade_files = [pd.read_csv(path, sep=';', dtype={ 'seller': str, 'buyer': str }) for path in trade_paths]
+    # the prices files already cover rounds 1 and 2, their trades only matter for the trade statistics
+    later_rounds = [df for path, df in zip(trade_paths, trade_files) if int(re.search(r'round_(\d+)', path)[1]) >= 3]
+
+    mids: dict[str, list[np.ndarray]] = {}
+    for df in price_files:
+        for product, series in price_file_mids(df).items():
+            mids.setdefault(product, []).append(series)
+    traded: dict[str, list[np.ndarray]] = {}
+    for df in later_rounds:
+        for symbol in ['DIVING_GEAR', 'BERRIES', 'BAGUETTE', 'DIP', 'UKULELE', 'PICNIC_BASKET']:
+            series = trade_file_series(df, symbol)
+            if series is not None:
+                traded.setdefault(symbol, []).append(series)
+
+    models: dict[str, dict] = {}
+    for product in ['PEARLS', 'BANANAS', 'COCONUTS']:
+        models[product] = {'model': 'ou', **fit_ou(mids[product])}
+
+    # cointegration with coconuts: regress the levels, the residual is the mean reverting spread
+    pina, coco = np.concatenate(mids['PINA_COLADAS']), np.concatenate(mids['COCONUTS'])
+    beta = float(np.polyfit(coco, pina, 1)[0])
+    spreads = [p - beta * c for p, c in zip(mids['PINA_COLADAS'], mids['COCONUTS'])]
+    models['PINA_COLADAS'] = {'model': 'pair', 'leg': 'COCONUTS', 'beta': beta, **fit_ou(spreads)}
+
+    # berries move with the time of day: the mean path relative to the day's first price, in bins
+    relative = np.mean([series - series[0] for series in traded['BERRIES']], axis=0)
+    curve = relative.reshape(SEASONAL_BINS, -1).mean(axis=1)
+    residuals = [series - series[0] - np.repeat(curve, TICKS // SEASONAL_BINS) for series in traded['BERRIES']]
+    models['BERRIES'] = {'model': 'seasonal', 'curve': curve.tolist(), **fit_ou(residuals),
+                         'start': float(np.mean([series[0] for series in traded['BERRIES']]))}
+
+    models['DOLPHIN_SIGHTINGS'] = {'model': 'jumps', **DOLPHIN_DEFAULTS}
+    gear = fit_ou(traded['DIVING_GEAR'])
+    models['DIVING_GEAR'] = {'model': 'driven', 'driver': 'DOLPHIN_SIGHTINGS', 'start': gear['start'], 'sigma': gear['sigma'], **GEAR_RESPONSE_DEFAULTS}
+
+    for product in BASKET_LEGS:
+        models[product] = {'model': 'ou', **fit_ou(traded[product])}
+    premiums = [basket - sum(count * legs[i] for count, legs in zip(BASKET_LEGS.values(), [traded[leg] for leg in BASKET_LEGS]))
+                for i, basket in enumerate(traded['PICNIC_BASKET'])]
+    models['PICNIC_BASKET'] = {'model': 'basket', 'legs': BASKET_LEGS, **fit_ou(premiums)}
+
+    for product, model in models.items():
+        if product == 'DOLPHIN_SIGHTINGS':
+            continue
+        stats = trade_statistics(trade_files, product)
+        model['trades'] = stats
+        source = next((df for df in price_files if (df['product'] == product).any()), None)
+        if source is not None:
+            model['shapes'] = book_shapes(source, product, rng)
+        else:
+            model['shapes'] = default_shapes(np.concatenate(traded[product]), np.array(stats['quantities'] or [1]))
+    return models
+
+
+def ou_paths(model: dict, days: int, rng: np.random.Generator, start: float | None = None) -> np.ndarray:
+    theta, mu, sigma = model['theta'], model['mu'], model['sigma']
+    noise = rng.standard_normal((days, TICKS)) * sigma
+    if theta <= 1e-6:
+        noise[:, 0] = 0
+        return (model['start'] if start is None else start) + np.cumsum(noise, axis=1)
+    paths = np.empty((days, TICKS))
+    paths[:, 0] = model['start'] if start is None else start
+    for t in range(1, TICKS):
+        previous = paths[:, t - 1]
+        paths[:, t] = previous + theta * (mu - previous) + noise[:, t]
+    return paths
+
+
+'''
+Mid (or observation) paths of every symbol of a round for days days at once, (days, TICKS) arrays.
+Symbols that depend on others are generated after them
+'''
+def generate_paths(models: dict, round: int, days: int, rng: np.random.Generator) -> dict[str, np.ndarray]:
+    paths: dict[str, np.ndarray] = {}
+    symbols = SYMBOLS_BY_ROUND[round]
+    order = [s for s in symbols if models[s]['model'] in ('ou', 'seasonal', 'jumps')] + \
+            [s for s in symbols if models[s]['model'] in ('pair', 'driven', 'basket')]
+    for symbol in order:
+        model = models[symbol]
+        kind = model['model']
+        if kind == 'ou':
+            paths[symbol] = ou_paths(model, days, rng)
+        elif kind == 'seasonal':
+            shape = np.repeat(np.asarray(model['curve']), TICKS // len(model['curve']))
+            paths[symbol] = model['start'] + shape + ou_paths(model, days, rng, start=0.0)
+        elif kind == 'jumps':
+            steps = rng.standard_normal((days, TICKS)) * model['sigma']
+            jumps = (rng.random((days, TICKS)) < model['jump_probability']) * rng.standard_normal((days, TICKS)) * model['jump_sigma']
+            steps[:, 0] = 0
+            jumps[:, 0] = 0
+            paths[symbol] = np.round(model['start'] + np.cumsum(steps + jumps, axis=1))
+            paths[symbol + ':jumps'] = jumps
+        elif kind == 'pair':
+            paths[symbol] = model['beta'] * paths[model['leg']] + ou_paths(model, days, rng)
+        elif kind == 'basket':
+            legs = sum(count * paths[leg] for leg, count in model['legs'].items())
+            paths[symbol] = legs + ou_paths(model, days, rng)
+        elif kind == 'driven':
+            # every sighting jump drags the gear along linearly over the following ticks
+            response = np.zeros((days, TICKS))
+            ramp = np.minimum(np.arange(TICKS), model['ticks']) / model['ticks']
+            for day, t in zip(*np.nonzero(paths[model['driver'] + ':jumps'])):
+                response[day, t:] += model['per_sighting'] * paths[model['driver'] + ':jumps'][day, t] * ramp[:TICKS - t]
+            walk = np.cumsum(rng.standard_normal((days, TICKS)) * model['sigma'], axis=1)
+            paths[symbol] = model['start'] + walk + response
+    return {symbol: path for symbol, path in paths.items() if ':' not in symbol}
+
+
+# one product's rows of a prices file: a book shape drawn per tick around the mid
+def product_rows(symbol: str, model: dict, mid: np.ndarray, day: int, rng: np.random.Generator) -> dict[str, np.ndarray]:
+    timestamps = np.arange(TICKS) * TIME_DELTA
+    columns: dict[str, np.ndarray] = {'day': np.full(TICKS, day), 'timestamp': timestamps, 'product': np.full(TICKS, symbol, dtype=object)}
+    if model['model'] == 'jumps':
+        for side in ['bid', 'ask']:
+            for level in range(1, LEVELS + 1):
+                columns[f'{side}_price_{level}'] = np.full(TICKS, np.nan)
+                columns[f'{side}_volume_{level}'] = np.full(TICKS, np.nan)
+        columns['mid_price'] = mid
+        return columns
+
+    shapes = model['shapes']
+    pick = rng.integers(0, len(shapes['bid_offset']), TICKS)
+    for side, rounding in [('bid', np.floor), ('ask', np.ceil)]:
+        offsets = np.asarray(shapes[f'{side}_offset'], dtype=float)[pick]
+        volumes = np.asarray(shapes[f'{side}_volume'], dtype=float)[pick]
+        prices = rounding(mid[:, None] + offsets)
+        for level in range(LEVELS):
+            present = volumes[:, level] > 0
+            columns[f'{side}_price_{level + 1}'] = np.where(present, prices[:, level], np.nan)
+            columns[f'{side}_volume_{level + 1}'] = np.where(present, volumes[:, level], np.nan)
+    columns['mid_price'] = (columns['bid_price_1'] + columns['ask_price_1']) / 2
+    return columns
+
+
+# market trades of one product: a Poisson number per tick at the best bid or ask, sizes and names drawn from the real ones
+def product_trades(symbol: str, model: dict, rows: dict[str, np.ndarray], rng: np.random.Generator) -> pd.DataFrame:
+    stats = model['trades']
+    counts = rng.poisson(stats['rate'], TICKS)
+    ticks = np.repeat(np.arange(TICKS), counts)
+    ticks = ticks[~np.isnan(rows['bid_price_1'][ticks]) & ~np.isnan(rows['ask_price_1'][ticks])]
+    at_ask = rng.random(len(ticks)) < 0.5
+    names = stats['names'] or ['nan']
+    return pd.DataFrame({
+        'timestamp': ticks * TIME_DELTA,
+        'buyer': rng.choice(names, len(ticks)),
+        'seller': rng.choice(names, len(ticks)),
+        'symbol': symbol,
+        'currency': 'SEASHELLS',
+        'price': np.where(at_ask, rows['ask_price_1'][ticks], rows['bid_price_1'][ticks]),
+        'quantity': rng.choice(stats['quantities'] or [1], len(ticks)),
+    })
+
+
+'''
+Yields (df_prices, df_trades) for days synthetic days of a round, in the layout of the training CSVs,
+ready for backtester.simulate_frames. Paths are generated chunk days at a time
+'''
+def generate_days(models: dict, round: int, days: int, seed: int = 0, chunk: int = 100):
+    rng = np.random.default_rng(seed)
+    symbols = SYMBOLS_BY_ROUND[round]
+    for first in range(0, days, chunk):
+        paths = generate_paths(models, round, min(chunk, days - first), rng)
+        for index in range(min(chunk, days - first)):
+            rows = {symbol: product_rows(symbol, models[symbol], paths[symbol][index], first + index, rng) for symbol in symbols}
+            df_prices = pd.concat([pd.DataFrame(columns) for columns in rows.values()], ignore_index=True)
+            df_prices = df_prices.sort_values('timestamp', kind='stable', ignore_index=True)
+            df_prices['profit_and_loss'] = 0.0
+            trades = [product_trades(symbol, models[symbol], rows[symbol], rng) for symbol in symbols if models[symbol]['model'] != 'jumps']
+            df_trades = pd.concat(trades, ignore_index=True).sort_values('timestamp', kind='stable', ignore_index=True)
+            yield df_prices, df_trades
+
+
+def load_calibration(path: str = CALIBRATION_PATH) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Calibrates a synthetic market on training/ and generates days from it')
+    parser.add_argument('--calibrate', action='store_true', help=f'refit and write {os.path.basename(CALIBRATION_PATH)}')
+    parser.add_argument('--round', type=int, default=3)
+    parser.add_argument('--days', type=int, default=0, help='number of days to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='directory to write the generated days as prices/trades CSVs')
+    parser.add_argument('--backtest', action='store_true', help='backtest the Trader on every generated day')
+    args = parser.parse_args()
+
+    if args.calibrate or not os.path.exists(CALIBRATION_PATH):
+        with open(CALIBRATION_PATH, 'w') as f:
+            json.dump(calibrate(seed=args.seed), f)
+        print(f'Wrote {CALIBRATION_PATH}')
+    models = load_calibration()
+
+    if args.backtest:
+        from walk_forward import import_backtester
+        backtester = import_backtester()
+    for day, (df_prices, df_trades) in enumerate(generate_days(models, args.round, args.days, args.seed)):
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            df_prices.to_csv(os.path.join(args.output, f'prices_round_{args.round}_day_{day}.csv'), sep=';', index=False)
+            df_trades.to_csv(os.path.join(args.output, f'trades_round_{args.round}_day_{day}_wn.csv'), sep=';', index=False)
+        if args.backtest:
+            with backtester.quiet():
+                profits = backtester.simulate_frames(df_prices, df_trades, args.round, backtester.Trader())
+            print(day, profits)
@@ -0,0 +1,154 @@
+import argparse
+import importlib.util
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from walk_forward import REPO, import_backtester, training_days
+
+# every file in the repo with a complete Trader, each carries its own copy of the datamodel
+DEFAULT_TRADERS = [
+    'main.py',
+    'JimmyJr.py',
+    'archive/Final_Submission.py',
+    'archive/Round 1 Submission.py',
+    'archive/Round 2 Submission.py',
+    'z_random/jimmy.py',
+]
+
+# the market data of every day, pickled once by the parent and handed to each worker when it starts
+preloaded: dict[int, bytes] = {}
+
+
+'''
+Imports the file at path as a module of its own, so trader files with the same class names
+(and each with its own Order, TradingState...) can live side by side in one process
+'''
+def load_trader_module(path: str):
+    path = os.path.join(REPO, path)
+    name = 'tournament_' + os.path.splitext(os.path.relpath(path, REPO))[0].replace(os.sep, '_').replace(' ', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+'''
+Subclass of trader_class whose run returns no orders when it raises, like the exchange, which logs the error
+and carries on with the next tick. errors gets the number of failed ticks and the first error. A Trader made
+by a simulated restart is of the same subclass, so it is tolerated and counted too
+'''
+def tolerant_class(trader_class, errors: dict):
+    def run(self, state):
+        try:
+            return trader_class.run(self, state)
+        except Exception as e:
+            errors['failed_ticks'] = errors.get('failed_ticks', 0) + 1
+            errors.setdefault('first_error', f'{type(e).__name__} at {state.timestamp}: {e}')
+            return {}
+    return type('Tolerant' + trader_class.__name__, (trader_class,), {'run': run})
+
+
+'''
+The states, market trades and mids of each day, loaded once. The states are filled in by a backtest,
+so every backtest unpickles its own copy
+'''
+def preload(round: int, days: list[int], time_limit: int = 999900) -> dict[int, bytes]:
+    backtester = import_backtester()
+    with backtester.quiet():
+        return {day: pickle.dumps(backtester.load_day(round, day, time_limit), protocol=pickle.HIGHEST_PROTOCOL) for day in days}
+
+
+def init_worker(data: dict[int, bytes]):
+    preloaded.update(data)
+
+
+'''
+Backtests the Trader of one file on one preloaded day in a worker and returns its final profit per symbol,
+the latency of its run calls and the ticks its run raised on (see tolerant_class). A trader file that
+cannot be loaded or a Trader that cannot be created gets its error instead
+'''
+def play(path: str, round: int, day: int, halfway: bool, restart_at: int | None) -> dict:
+    backtester = import_backtester()
+    try:
+        with backtester.quiet():
+            errors = {}
+            trader = tolerant_class(load_trader_module(path).Trader, errors)()
+            states, trade_store, mids_by_time = pickle.loads(preloaded[day])
+            max_time = max(states)
+            profiler = backtester.LatencyProfiler(trader)
+            _, _, profits_by_symbol, balance_by_symbol = backtester.trades_position_pnl_run(
+                states, max_time, *backtester.initial_accounting(states), trader=trader, round=round, halfway=halfway,
+                mids_by_time=mids_by_time, restart_at=restart_at, persist_state=restart_at is not None, trade_store=trade_store, profiler=profiler)
+        return {'profits': backtester.final_profits(profits_by_symbol, balance_by_symbol, round, max_time), 'latency': profiler.summary().get('run', {}),
+                'failed_ticks': errors.get('failed_ticks', 0), 'first_error': errors.get('first_error')}
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+
+
+'''
+Plays every trader file on every day of a round, all against the same market data, in parallel workers.
+Returns path -> {'profits': summed profit per symbol, 'latency': run latency worst over the days,
+'failed_ticks': ticks run raised on over the days, 'errors': [...]} where errors has the first error of each day
+'''
+def tournament(paths: list[str], round: int, days: list[int], workers: int | None = None, halfway=True,
+               restart_at: int | None = None, time_limit: int = 999900) -> dict[str, dict]:
+    data = preload(round, days, time_limit)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(data,)) as pool:
+        jobs = {(path, day): pool.submit(play, path, round, day, halfway, restart_at) for path in paths for day in days}
+        games = {key: job.result() for key, job in jobs.items()}
+
+    results = {}
+    for path in paths:
+        result = {'profits': {}, 'latency': {}, 'failed_ticks': 0, 'errors': []}
+        for day in days:
+            game = games[(path, day)]
+            if 'error' in game:
+                result['errors'].append(f'day {day}: {game["error"]}')
+                continue
+            if game['failed_ticks']:
+                result['failed_ticks'] += game['failed_ticks']
+                result['errors'].append(f'day {day}: {game["failed_ticks"]} failed ticks, first {game["first_error"]}')
+            for symbol, profit in game['profits'].items():
+                result['profits'][symbol] = result['profits'].get(symbol, 0.0) + profit
+            for key, value in game['latency'].items():
+                result['latency'][key] = max(result['latency'].get(key, 0), value)
+        results[path] = result
+    return results
+
+
+def report(results: dict[str, dict]) -> str:
+    names = {path: os.path.splitext(os.path.basename(path))[0][:16] for path in results}
+    symbols = list(dict.fromkeys(symbol for result in results.values() for symbol in result['profits']))
+    lines = [f'{"":<16}' + ''.join(f'{names[path]:>18}' for path in results)]
+    for symbol in symbols:
+        lines.append(f'{symbol:<16}' + ''.join(f'{result["profits"].get(symbol, 0.0):>18.0f}' for result in results.values()))
+    lines.append(f'{"TOTAL":<16}' + ''.join(f'{sum(result["profits"].values()):>18.0f}' for result in results.values()))
+    for key, title in [('mean_ms', 'run mean ms'), ('p99_ms', 'run p99 ms'), ('max_ms', 'run max ms')]:
+        lines.append(f'{title:<16}' + ''.join(f'{result["latency"].get(key, 0.0):>18.3f}' for result in results.values()))
+    lines.append(f'{"failed ticks":<16}' + ''.join(f'{result["failed_ticks"]:>18}' for result in results.values()))
+    for path, result in results.items():
+        for error in result['errors']:
+            lines.append(f'{path} raised on {error}')
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backtests several trader files on the same days and compares them side by side')
+    parser.add_argument('traders', nargs='*', default=DEFAULT_TRADERS, help='trader files relative to the repo, defaults to every full Trader in it')
+    parser.add_argument('--round', type=int, default=2)
+    parser.add_argument('--days', type=int, nargs='+', help='defaults to every training day of the round')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--restart-at', type=int, default=None, help='simulate the exchange restarting the trader at this timestamp')
+    parser.add_argument('--no-halfway', action='store_true', help='only fill orders at prices in the book')
+    parser.add_argument('--time-limit', type=int, default=999900)
+    args = parser.parse_args()
+
+    days = args.days or training_days()[args.round]
+    results = tournament(args.traders, args.round, days, args.workers, not args.no_halfway, args.restart_at, args.time_limit)
+    print(f'Round {args.round}, days {days}, profit summed over the days')
+    print(report(results))
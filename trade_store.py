@@ -0,0 +1,86 @@
+import sys
+import numpy as np
+from main import Trade
+
+'''
+Maps names to small integer ids. Every name is interned, so each symbol or
+counterparty exists exactly once in memory no matter how many days are loaded
+'''
+class InternTable:
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+
+    def id(self, name: str) -> int:
+        index = self.ids.get(name)
+        if index is None:
+            name = sys.intern(name)
+            index = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def intern(self, name: str) -> str:
+        return self.names[self.id(name)]
+
+    # vectorized id lookup for a whole column, only the distinct values go through the dict
+    def ids_of(self, values) -> np.ndarray:
+        uniques, inverse = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+        return np.array([self.id(name) for name in uniques], dtype=np.int16)[inverse]
+
+
+# shared by every loader in the process, so ids are stable across days
+SYMBOLS = InternTable()
+COUNTERPARTIES = InternTable()
+
+
+'''
+All market trades of a day as parallel integer arrays sorted by timestamp.
+Trade objects are only built for one timestamp at a time by trades_at,
+when the TradingState for that timestamp is handed to the trader
+'''
+class TradeStore:
+    def __init__(self, timestamp: np.ndarray, symbol: np.ndarray, price: np.ndarray, quantity: np.ndarray, buyer: np.ndarray, seller: np.ndarray):
+        order = np.argsort(timestamp, kind='stable')
+        self.timestamp = timestamp[order]
+        self.symbol = symbol[order]
+        self.price = price[order]
+        self.quantity = quantity[order]
+        self.buyer = buyer[order]
+        self.seller = seller[order]
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    '''
+    Appends the trades at time to market_trades (symbol -> list of Trade), creating
+    lists for symbols that are missing, and returns it
+    '''
+    def trades_at(self, time: int, market_trades: dict[str, list[Trade]]) -> dict[str, list[Trade]]:
+        start, end = np.searchsorted(self.timestamp, [time, time + 1]).tolist()
+        if start == end:
+            return market_trades
+        symbols, buyers, sellers = SYMBOLS.names, COUNTERPARTIES.names, COUNTERPARTIES.names
+        for symbol, price, quantity, buyer, seller in zip(
+                self.symbol[start:end].tolist(), self.price[start:end].tolist(), self.quantity[start:end].tolist(),
+                self.buyer[start:end].tolist(), self.seller[start:end].tolist()):
+            name = symbols[symbol]
+            if name not in market_trades:
+                market_trades[name] = []
+            market_trades[name].append(Trade(name, price, quantity, buyers[buyer], sellers[seller], time))
+        return market_trades
+
+
+'''
+Loads a trades dataframe (timestamp;buyer;seller;symbol;currency;price;quantity) up to time_limit.
+Missing names (the _nn files) become "nan", like str() of the missing value always did
+'''
+def load_trades(df_trades, time_limit: int) -> TradeStore:
+    df_trades = df_trades[df_trades['timestamp'] <= time_limit]
+    return TradeStore(
+        df_trades['timestamp'].to_numpy(dtype=np.int64),
+        SYMBOLS.ids_of(df_trades['symbol'].astype(str)),
+        df_trades['price'].to_numpy(dtype=np.float64),
+        df_trades['quantity'].to_numpy(dtype=np.int32),
+        COUNTERPARTIES.ids_of(df_trades['buyer'].fillna('nan').astype(str)),
+        COUNTERPARTIES.ids_of(df_trades['seller'].fillna('nan').astype(str)),
+    )
@@ -0,0 +1,146 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+TRAINING_DIR = os.path.join(REPO, 'training')
+
+# a small default grid over the parameters that were picked by eye on a single day
+DEFAULT_GRID: dict[str, list] = {
+    'shortMovingAverageSize': [5, 10, 20],
+    'microPriceWeight': [0.0, 0.25, 0.5],
+    'coconutsBuyBelow': [7890, 7910, 7930],
+    'coconutsSellAbove': [7930, 7950, 7970],
+}
+
+
+'''
+Days per round that have both a prices and a trades file, the only ones the backtester can replay
+'''
+def training_days(training_dir: str = TRAINING_DIR) -> dict[int, list[int]]:
+    files = set(os.listdir(training_dir))
+    days: dict[int, list[int]] = {}
+    for name in files:
+        match = re.fullmatch(r'prices_round_(\d+)_day_(-?\d+)\.csv', name)
+        if match and f'trades_round_{match[1]}_day_{match[2]}_wn.csv' in files:
+            days.setdefault(int(match[1]), []).append(int(match[2]))
+    return {round: sorted(days[round]) for round in sorted(days)}
+
+
+# (round, fit day, test day) for every pair of consecutive days of a round
+def folds(days: dict[int, list[int]]) -> list[tuple[int, int, int]]:
+    return [(round, fit, test) for round, round_days in days.items() for fit, test in zip(round_days, round_days[1:])]
+
+
+def grid_points(grid: dict[str, list]) -> list[dict]:
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+'''
+Imports the backtester from the repo. Importing it points stdout at simresults.txt,
+this keeps the caller's stdout and working directory, backtests go in backtester.quiet()
+'''
+def import_backtester():
+    stdout, cwd = sys.stdout, os.getcwd()
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    os.chdir(REPO)
+    try:
+        import backtester
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+    return backtester
+
+
+'''
+Backtests one day with the Trader's class attributes overridden by params and returns the final
+profit per symbol. The parameters go on a subclass so the Trader the backtester creates on its
+simulated restart gets them too. Runs in a worker process, the trader's prints are discarded
+'''
+def evaluate(params: dict, round: int, day: int, time_limit: int = 999900) -> dict[str, float]:
+    backtester = import_backtester()
+    with backtester.quiet():
+        trader_class = type('TunedTrader', (backtester.Trader,), dict(params))
+        return backtester.simulate_alternative(round, day, trader_class(), time_limit=time_limit, halfway=True, monkeys=False,
+                                               restart_at=None, persist_state=False, profile=False, write_log=False)
+
+
+'''
+For every fold, backtests every grid point on the fit day, keeps the one with the highest total
+profit, then backtests it and the untouched Trader on the test day. All backtests of a phase run in parallel.
+Returns one entry per fold with the chosen parameters and the per product profit in and out of sample
+'''
+def walk_forward(grid: dict[str, list], fold_list: list[tuple[int, int, int]], workers: int | None = None, time_limit: int = 999900) -> list[dict]:
+    points = grid_points(grid)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        fit_jobs = {(fold, i): pool.submit(evaluate, point, fold[0], fold[1], time_limit)
+                    for fold in fold_list for i, point in enumerate(points)}
+        fit_profits = {key: job.result() for key, job in fit_jobs.items()}
+
+        best: dict[tuple, int] = {}
+        for fold in fold_list:
+            best[fold] = max(range(len(points)), key=lambda i: sum(fit_profits[(fold, i)].values()))
+
+        test_jobs = {}
+        for fold in fold_list:
+            test_jobs[(fold, 'tuned')] = pool.submit(evaluate, points[best[fold]], fold[0], fold[2], time_limit)
+            test_jobs[(fold, 'default')] = pool.submit(evaluate, {}, fold[0], fold[2], time_limit)
+        test_profits = {key: job.result() for key, job in test_jobs.items()}
+
+    return [{
+        'round': fold[0],
+        'fit_day': fold[1],
+        'test_day': fold[2],
+        'params': points[best[fold]],
+        'in_sample': fit_profits[(fold, best[fold])],
+        'out_of_sample': test_profits[(fold, 'tuned')],
+        'out_of_sample_default': test_profits[(fold, 'default')],
+    } for fold in fold_list]
+
+
+def report(results: list[dict]) -> str:
+    lines = []
+    totals: dict[str, list[float]] = {}
+    for result in results:
+        lines.append(f'Round {result["round"]}: fit on day {result["fit_day"]}, test on day {result["test_day"]} with {result["params"]}')
+        lines.append(f'    {"product":<16}{"in sample":>12}{"out sample":>12}{"default":>12}')
+        for product, profit in result['out_of_sample'].items():
+            default = result['out_of_sample_default'][product]
+            lines.append(f'    {product:<16}{result["in_sample"][product]:>12.1f}{profit:>12.1f}{default:>12.1f}')
+            total = totals.setdefault(product, [0.0, 0.0])
+            total[0] += profit
+            total[1] += default
+    lines.append('Out of sample over all folds:')
+    lines.append(f'    {"product":<16}{"tuned":>12}{"default":>12}')
+    for product, (tuned, default) in totals.items():
+        lines.append(f'    {product:<16}{tuned:>12.1f}{default:>12.1f}')
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fits Trader parameters on one training day and tests them on the next')
+    parser.add_argument('--grid', help='JSON object of parameter name to list of values, defaults to DEFAULT_GRID')
+    parser.add_argument('--rounds', type=int, nargs='+', help='only use these rounds')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--time-limit', type=int, default=999900)
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    grid = json.loads(args.grid) if args.grid else DEFAULT_GRID
+    days = training_days()
+    if args.rounds:
+        days = {round: days[round] for round in args.rounds if round in days}
+    fold_list = folds(days)
+    print(f'{len(grid_points(grid))} parameter sets on {len(fold_list)} folds: {fold_list}')
+
+    results = walk_forward(grid, fold_list, args.workers, args.time_limit)
+    print(report(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)